@@ -1,19 +1,50 @@
 """Flask web application for PEC email catalog."""
 
 import os
-from flask import Flask, render_template, jsonify, request, send_from_directory, abort
-
-from storage.json_store import load_catalog, load_email, delete_source
-from pec_parser.mbox_reader import process_mbox, process_mbox_incremental
+import time
+from datetime import datetime, timezone
+from flask import (
+    Flask, Response, render_template, jsonify, request, send_file, send_from_directory, abort, g,
+)
+
+from storage import delete_source
+from storage.json_store import get_catalog_view, EMAIL_SORT_KEYS, GROUP_SORT_KEYS, FACETS
+from storage.blob_store import blobs_stranded, resolve_attachment
+from storage.search_index import search_email_ids, search_index_exists
+from pec_parser.mbox_reader import process_mbox, process_mbox_stream
+from pec_parser.jobs import (
+    submit_ingest, submit_backfill, submit_blob_collection, submit_index_rebuild, get_job,
+)
+from pec_parser.lazy import ensure_extracted, source_path
+from pec_parser.rebuild import rebuild_snapshot, MissingSourceFiles, RebuildConflict
+from pec_parser.follow import start_follower
+from pec_parser import gate, metrics
 import config
 from werkzeug.utils import secure_filename
 
 app = Flask(__name__)
 
 
+@app.before_request
+def _start_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def _record_request(response):
+    """Request duration histogram per route pattern (not per URL, so email
+    ids and filenames do not multiply the series)."""
+    started = g.get("request_started")
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule is not None else "<unmatched>"
+        metrics.observe_request(route, request.method, response.status_code,
+                                time.perf_counter() - started)
+    return response
+
+
 def ensure_catalog():
     """Parse mbox if catalog doesn't exist yet."""
-    if not os.path.exists(config.CATALOG_PATH):
+    if get_catalog_view() is None:
         process_mbox()
 
 
@@ -23,71 +54,221 @@ def index():
     return render_template("index.html")
 
 
+# Query parameters that switch /api/catalog from the full dump to a page
+CATALOG_PAGE_PARAMS = ("view", "limit", "cursor", "sort", "fields", "source_id", "group_id",
+                       "from", "to")
+# Fields returned for view=groups unless fields= asks otherwise
+GROUP_DEFAULT_FIELDS = ("group_id", "label", "count", "date", "source_id", "source_file")
+
+
 @app.route("/api/catalog")
 def api_catalog():
+    """Full catalog, or one page of it when any CATALOG_PAGE_PARAMS is given.
+
+    view=emails|groups, sort=[-]date|sender|group_size (groups: [-]date|group_size|label),
+    limit, cursor (opaque, from next_cursor), fields=a,b,c, source_id, group_id,
+    from/to (see _date_range).
+    """
     ensure_catalog()
-    catalog = load_catalog()
-    if catalog is None:
+    view = get_catalog_view()
+    if view is None:
         return jsonify({"error": "No catalog found"}), 404
-    return jsonify(catalog)
+    if not any(name in request.args for name in CATALOG_PAGE_PARAMS):
+        return Response(view.to_json(), mimetype="application/json")
+    return _catalog_page(view)
+
+
+DATE_RANGE_ERROR = "from and to must be dates (YYYY-MM-DD), ISO datetimes or epoch seconds"
+
+
+def _date_param(value: str, end: bool) -> int:
+    """Epoch seconds of a from/to value: epoch seconds, YYYY-MM-DD (to: the
+    end of that day) or an ISO datetime (UTC unless it has an offset)."""
+    if value.isdigit():
+        return int(value)
+    if len(value) == 10:
+        day = datetime.strptime(value, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+        return int(day.timestamp()) + (86399 if end else 0)
+    dt = datetime.fromisoformat(value)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp())
+
+
+def _date_range():
+    """(since, until) from the from/to query parameters; ValueError if malformed."""
+    since = request.args.get("from") or None
+    until = request.args.get("to") or None
+    return (_date_param(since, False) if since else None,
+            _date_param(until, True) if until else None)
+
+
+def _catalog_page(view):
+    kind = request.args.get("view", "emails")
+    if kind not in ("emails", "groups"):
+        return jsonify({"error": "view must be 'emails' or 'groups'"}), 400
+
+    sort = request.args.get("sort") or ("-group_size" if kind == "groups" else "-date")
+    sort_key = sort.lstrip("-")
+    allowed = GROUP_SORT_KEYS if kind == "groups" else EMAIL_SORT_KEYS
+    if sort_key not in allowed:
+        return jsonify({"error": "sort must be one of: {}".format(", ".join(allowed))}), 400
+
+    try:
+        limit = int(request.args.get("limit") or config.CATALOG_PAGE_SIZE)
+        cursor = int(request.args.get("cursor") or 0)
+    except ValueError:
+        return jsonify({"error": "limit and cursor must be integers"}), 400
+    limit = max(1, min(limit, config.CATALOG_MAX_PAGE_SIZE))
+    cursor = max(0, cursor)
+    try:
+        since, until = _date_range()
+    except ValueError:
+        return jsonify({"error": DATE_RANGE_ERROR}), 400
+
+    items = view.ordered(
+        kind, sort_key, reverse=sort.startswith("-"),
+        source_id=request.args.get("source_id"),
+        group_id=request.args.get("group_id"),
+        since=since, until=until,
+    )
+    page = items[cursor:cursor + limit]
+
+    id_field = "group_id" if kind == "groups" else "email_id"
+    fields = [f for f in request.args.get("fields", "").split(",") if f]
+    if not fields and kind == "groups":
+        fields = list(GROUP_DEFAULT_FIELDS)
+    if fields:
+        if id_field not in fields:
+            fields.insert(0, id_field)
+        page = [{f: item[f] for f in fields if f in item} for item in page]
+
+    next_cursor = cursor + limit
+    return jsonify({
+        "view": kind,
+        "sort": sort,
+        "items": page,
+        "total": len(items),
+        "next_cursor": str(next_cursor) if next_cursor < len(items) else None,
+        "total_emails": view.catalog.get("total_emails", 0),
+        "total_sources": view.catalog.get("total_sources", 0),
+    })
+
+
+@app.route("/api/facets")
+def api_facets():
+    """Value counts of every facet for the current filters: facet filters,
+    q and from/to, as accepted by /api/search."""
+    query = request.args.get("q", "").strip().lower()
+    filters = _facet_filters()
+    try:
+        since, until = _date_range()
+    except ValueError:
+        return jsonify({"error": DATE_RANGE_ERROR}), 400
+
+    view = get_catalog_view()
+    if view is None:
+        return jsonify({"facets": {name: [] for name in FACETS}, "total": 0})
+    base = None
+    if since is not None or until is not None or query:
+        candidates = view.summaries
+        if since is not None or until is not None:
+            candidates = view.between(since, until)
+        if query:
+            candidates = _matching(view, query, candidates)
+        base = {s["email_id"] for s in candidates}
+
+    matched = view.facet_ids(filters)
+    if base is not None:
+        matched = base if matched is None else matched & base
+    return jsonify({
+        "facets": view.facet_counts(filters, base),
+        "total": len(view.summaries) if matched is None else len(matched),
+    })
 
 
 @app.route("/api/email/<email_id>")
 def api_email(email_id):
-    data = load_email(email_id)
+    # Lazily ingested emails get their body and attachments extracted here
+    data = ensure_extracted(email_id)
     if data is None:
         return jsonify({"error": "Email not found"}), 404
     return jsonify(data)
 
 
+def _facet_filters():
+    """Facet filters from the query string: facet name -> accepted values
+    (a facet may be repeated; sender facets are case-insensitive)."""
+    filters = {}
+    for name in FACETS:
+        values = request.args.getlist(name)
+        if name in ("sender", "sender_domain", "has_attachments"):
+            values = [v.lower() for v in values]
+        if values:
+            filters[name] = values
+    return filters
+
+
+def _matching(view, query, candidates):
+    """The candidate summaries matching query."""
+    # Body, recipients and headers are matched through the inverted index; a
+    # missing one is rebuilt in the background, meanwhile only the catalog
+    # fields below match
+    if search_index_exists():
+        indexed_ids = search_email_ids(query)
+    else:
+        submit_index_rebuild()
+        indexed_ids = set()
+
+    results = []
+    for summary in candidates:
+        # Search in subject, sender, clean_subject
+        eid = summary["email_id"]
+        if query in view.search_text[eid] or eid in indexed_ids:
+            results.append(summary)
+    return results
+
+
 @app.route("/api/search")
 def api_search():
+    """Emails matching q and/or facet filters (FACETS), optionally within a
+    from/to date range (see _date_range)."""
     query = request.args.get("q", "").strip().lower()
-    if not query:
+    filters = _facet_filters()
+    try:
+        since, until = _date_range()
+    except ValueError:
+        return jsonify({"error": DATE_RANGE_ERROR}), 400
+    if not query and not filters:
         return jsonify({"results": []})
 
-    catalog = load_catalog()
-    if catalog is None:
+    view = get_catalog_view()
+    if view is None:
         return jsonify({"results": []})
-
-    # Flatten emails_summary from all sources
-    all_summaries = []
-    for source in catalog.get("sources", []):
-        all_summaries.extend(source.get("emails_summary", []))
-
-    results = []
-    seen = set()
-    for summary in all_summaries:
-        if summary["email_id"] in seen:
-            continue
-        # Search in subject, sender, clean_subject
-        searchable = " ".join([
-            summary.get("subject", ""),
-            summary.get("sender", ""),
-            summary.get("clean_subject", ""),
-        ]).lower()
-
-        if query in searchable:
-            results.append(summary)
-            seen.add(summary["email_id"])
-            continue
-
-        # Also search in body text
-        email_data = load_email(summary["email_id"])
-        if email_data:
-            body = " ".join(filter(None, [
-                email_data.get("body_text", ""),
-                email_data.get("body_html", ""),
-            ])).lower()
-            if query in body:
-                results.append(summary)
-                seen.add(summary["email_id"])
+    # Facets narrow the candidates by set intersection before any text matching
+    allowed = view.facet_ids(filters)
+    if since is not None or until is not None:
+        candidates = view.between(since, until)
+        if allowed is not None:
+            candidates = [s for s in candidates if s["email_id"] in allowed]
+    elif allowed is not None:
+        candidates = view.in_order(allowed)
+    else:
+        candidates = view.summaries
+
+    results = _matching(view, query, candidates) if query else candidates
 
     return jsonify({"results": results})
 
 
-@app.route("/attachment/<email_id>/<filename>")
-def download_attachment(email_id, filename):
+def _send_attachment(email_id, filename, as_attachment):
+    """Serve an attachment from the blob store via the email's manifest,
+    falling back to the per-email directory of older ingests."""
+    att = resolve_attachment(ensure_extracted(email_id), filename)
+    if att is not None:
+        return send_file(att["path"], mimetype=att.get("content_type"),
+                         as_attachment=as_attachment, download_name=filename)
+
     att_dir = os.path.join(config.ATTACHMENTS_DIR, email_id)
     if not os.path.isdir(att_dir):
         abort(404)
@@ -97,47 +278,108 @@ def download_attachment(email_id, filename):
         abort(403)
     if not os.path.exists(safe_path):
         abort(404)
-    return send_from_directory(att_dir, filename, as_attachment=True)
+    return send_from_directory(att_dir, filename, as_attachment=as_attachment)
+
+
+@app.route("/attachment/<email_id>/<filename>")
+def download_attachment(email_id, filename):
+    return _send_attachment(email_id, filename, as_attachment=True)
 
 
 @app.route("/inline/<email_id>/<filename>")
 def inline_attachment(email_id, filename):
-    att_dir = os.path.join(config.ATTACHMENTS_DIR, email_id)
-    if not os.path.isdir(att_dir):
-        abort(404)
-    safe_path = os.path.join(att_dir, filename)
-    if not os.path.abspath(safe_path).startswith(os.path.abspath(att_dir)):
-        abort(403)
-    if not os.path.exists(safe_path):
-        abort(404)
-    return send_from_directory(att_dir, filename, as_attachment=False)
+    return _send_attachment(email_id, filename, as_attachment=False)
 
 
 @app.route("/api/reparse", methods=["POST"])
 def api_reparse():
-    """Force re-parse the mbox file."""
-    import shutil
-    if os.path.exists(config.DATA_DIR):
-        shutil.rmtree(config.DATA_DIR)
-    process_mbox()
-    return jsonify({"status": "ok"})
+    """Re-parse the mbox file.
+
+    Unchanged messages are reused from the fingerprint cache. ?full=1
+    re-ingests every source into a new snapshot and swaps it in atomically,
+    so readers keep the old data until the rebuild is complete. An
+    incremental reparse returns its ingest report (pec_parser.metrics).
+    """
+    if request.args.get("full") in ("1", "true"):
+        try:
+            rebuild_snapshot()
+        except RebuildConflict as e:
+            return jsonify({"error": str(e)}), 409
+        except MissingSourceFiles as e:
+            return jsonify({"error": str(e), "missing": e.source_files}), 409
+        return jsonify({"status": "ok"})
+    with metrics.ingest_report() as report:
+        process_mbox()
+    return jsonify({"status": "ok", "report": report.to_dict()})
+
+
+def _upload_path(filename: str) -> str:
+    """A new path in UPLOADS_DIR for an uploaded file. A name some source
+    already uses gets a _2, _3... suffix: an upload never replaces the mbox
+    an earlier source (and the pending bodies of its emails) is read from."""
+    os.makedirs(config.UPLOADS_DIR, exist_ok=True)
+    view = get_catalog_view()
+    taken = {s["source_file"] for s in view.sources} if view is not None else set()
+    base, ext = os.path.splitext(filename)
+    n = 1
+    while True:
+        name = filename if n == 1 else "{}_{}{}".format(base, n, ext)
+        path = os.path.join(config.UPLOADS_DIR, name)
+        if name not in taken and source_path(name) == path:
+            try:
+                # Claim the name, so a concurrent upload picks another one
+                with open(path, "xb"):
+                    return path
+            except FileExistsError:
+                pass
+        n += 1
 
 
 @app.route("/api/upload", methods=["POST"])
 def api_upload():
-    """Accept an uploaded .mbox file, save it, and add as new source."""
+    """Accept an uploaded .mbox file, save it, and queue its ingest as a new source.
+
+    Returns 202 with the job_id to poll at /api/jobs/<job_id>.
+    """
     if "file" not in request.files:
         return jsonify({"error": "No file provided"}), 400
     f = request.files["file"]
     if not f.filename or not f.filename.endswith(".mbox"):
         return jsonify({"error": "Only .mbox files are accepted"}), 400
 
-    filename = secure_filename(f.filename)
-    os.makedirs(config.UPLOADS_DIR, exist_ok=True)
-    save_path = os.path.join(config.UPLOADS_DIR, filename)
+    save_path = _upload_path(secure_filename(f.filename))
+    filename = os.path.basename(save_path)
     f.save(save_path)
 
-    new_emails, source_entry = process_mbox_incremental(save_path)
+    job = submit_ingest(save_path, filename)
+
+    return jsonify({
+        "status": "queued",
+        "job_id": job.job_id,
+        "source_file": filename,
+    }), 202
+
+
+@app.route("/api/upload/stream", methods=["POST"])
+def api_upload_stream():
+    """Receive a raw .mbox request body (?filename=name.mbox) and parse it
+    while it arrives; responds once the new source is saved."""
+    filename = request.args.get("filename", "")
+    if not filename.endswith(".mbox"):
+        return jsonify({"error": "Only .mbox files are accepted"}), 400
+
+    save_path = _upload_path(secure_filename(filename))
+    chunks = iter(lambda: request.stream.read(config.UPLOAD_CHUNK_SIZE), b"")
+
+    try:
+        with metrics.ingest_report() as report:
+            new_emails, source_entry = process_mbox_stream(chunks, save_path)
+    except BaseException:
+        # Blobs of the messages parsed before the upload broke off
+        submit_blob_collection()
+        raise
+    if config.LAZY_BODIES:
+        submit_backfill(source_entry["source_file"])
 
     return jsonify({
         "status": "ok",
@@ -145,35 +387,49 @@ def api_upload():
         "source_id": source_entry["source_id"],
         "source_file": source_entry["source_file"],
         "uploaded_at": source_entry["uploaded_at"],
+        "report": report.to_dict(),
     })
 
 
+@app.route("/api/jobs/<job_id>")
+def api_job(job_id):
+    """Status of an ingest job: phase, progress, throughput, ETA and result."""
+    job = get_job(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job.to_dict())
+
+
+@app.route("/api/metrics")
+def api_metrics():
+    """Ingest and request metrics in the Prometheus text format."""
+    return Response(metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
 @app.route("/api/sources")
 def api_sources():
     """Return list of sources with id, file, date, count."""
-    catalog = load_catalog()
-    if catalog is None:
+    view = get_catalog_view()
+    if view is None:
         return jsonify({"sources": []})
-
-    sources = []
-    for s in catalog.get("sources", []):
-        sources.append({
-            "source_id": s["source_id"],
-            "source_file": s["source_file"],
-            "uploaded_at": s.get("uploaded_at", ""),
-            "email_count": s["email_count"],
-        })
-    return jsonify({"sources": sources})
+    return jsonify({"sources": view.sources})
 
 
 @app.route("/api/sources/<source_id>", methods=["DELETE"])
 def api_delete_source(source_id):
     """Delete a source and all its exclusive data."""
-    deleted = delete_source(source_id)
+    with gate.writing():
+        deleted = delete_source(source_id)
+    if blobs_stranded():
+        submit_blob_collection()
     if not deleted:
         return jsonify({"error": "Source not found"}), 404
     return jsonify({"status": "ok"})
 
 
+# Ingests appends to config.FOLLOW_PATHS in the background (None when off)
+follower = start_follower()
+
+
 if __name__ == "__main__":
     app.run(debug=True, host="0.0.0.0", port=5000)
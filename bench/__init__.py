@@ -0,0 +1 @@
+"""Ingest benchmarks on synthetic PEC corpora (see bench.corpus and bench.run)."""
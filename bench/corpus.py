@@ -0,0 +1,206 @@
+"""Deterministic generator of synthetic PEC mboxes for benchmarks.
+
+Every message has the structure PEC providers produce: a multipart/signed
+outer wrapper around a multipart/mixed with the notice text, daticert.xml
+(with a varied tipo) and the original email as postacert.eml, plus the
+smime.p7s signature. The inner emails mix charsets (UTF-8 and ISO-8859-1,
+base64 / quoted-printable / 8bit), RFC 2047 subjects and sender names,
+inline images and base64 attachments, a few of them large.
+
+    python -m bench.corpus out.mbox --count 10000 [--seed 0]
+"""
+
+import argparse
+import base64
+import quopri
+import random
+from datetime import datetime, timedelta, timezone
+from email.header import Header
+from typing import Dict
+
+# Named corpus sizes
+SIZES: Dict[str, int] = {"1k": 1000, "10k": 10000, "100k": 100000}
+
+# daticert.xml tipo values, weighted towards actual messages
+PEC_TYPES = [
+    ("posta-certificata", 60),
+    ("accettazione", 12),
+    ("avvenuta-consegna", 12),
+    ("non-accettazione", 4),
+    ("errore-consegna", 6),
+    ("preavviso-errore-consegna", 3),
+    ("presa-in-carico", 3),
+]
+PROVIDERS = ["ARUBA PEC S.p.A.", "Poste Italiane", "InfoCert S.p.A.", "Namirial S.p.A.", "Register.it"]
+DOMAINS = ["comune.roma.it", "studiolegale.it", "ditta-rossi.it", "asl.napoli.it", "condominio.it",
+           "tribunale.milano.it", "agenziaentrate.it", "inps.it"]
+NAMES = ["Mario Rossi", "Giulia Bianchi", "Luca Esposito", "Chiara Romano", "Niccolò Gallo",
+         "Francesca Conti", "José Ferrari", "Andrea Ricci"]
+TOPICS = [
+    "Convocazione assemblea condominiale", "Fattura n. {n} del {d}", "Sollecito di pagamento",
+    "Notifica atto giudiziario", "Richiesta documentazione pratica {n}", "Verbale di consegna",
+    "Comunicazione di avvio del procedimento", "Perizia tecnica immobile", "Rettifica anagrafica",
+    "Decreto ingiuntivo n. {n}/{y}", "Certificato di agibilità", "Contratto di locazione",
+]
+PREFIXES = ["", "", "", "Re: ", "R: ", "Fwd: ", "I: ", "RE: Re: "]
+BODY_WORDS = ("si trasmette in allegato la documentazione richiesta relativa alla pratica "
+              "in oggetto restando a disposizione per eventuali chiarimenti cordiali saluti "
+              "perché città già più attività entità proprietà").split()
+
+_BASE_DATE = datetime(2024, 1, 1, 8, 0, tzinfo=timezone.utc)
+
+
+def _weighted(rng: random.Random, choices):
+    values = [value for value, _ in choices]
+    weights = [weight for _, weight in choices]
+    return rng.choices(values, weights)[0]
+
+
+def _b64(payload: bytes) -> str:
+    return base64.encodebytes(payload).decode("ascii")
+
+
+def _header(value: str, rng: random.Random) -> str:
+    """The value as is if ASCII, else RFC 2047 encoded (B or Q, UTF-8 or Latin-1)."""
+    try:
+        value.encode("ascii")
+        return value
+    except UnicodeEncodeError:
+        charset = rng.choice(["utf-8", "iso-8859-1"])
+        try:
+            value.encode(charset)
+        except UnicodeEncodeError:
+            charset = "utf-8"
+        return Header(value, charset).encode()
+
+
+def _body(rng: random.Random, n: int):
+    words = [rng.choice(BODY_WORDS) for _ in range(rng.randint(30, 200))]
+    text = "Gentile destinatario,\n{}.\nRiferimento interno {}.\n".format(" ".join(words), n)
+    charset = rng.choice(["utf-8", "utf-8", "iso-8859-1"])
+    encoding = rng.choice(["quoted-printable", "base64", "8bit"])
+    if encoding == "8bit" and charset != "utf-8":
+        # The message is written as UTF-8: raw 8bit text must be UTF-8 too
+        encoding = "quoted-printable"
+    raw = text.encode(charset)
+    if encoding == "base64":
+        payload = _b64(raw)
+    elif encoding == "quoted-printable":
+        payload = quopri.encodestring(raw).decode("ascii")
+    else:
+        payload = raw.decode(charset)
+    headers = ("Content-Type: text/plain; charset={}\n"
+               "Content-Transfer-Encoding: {}\n\n".format(charset, encoding))
+    html = "<html><body><p>{}</p></body></html>".format(text.replace("\n", "<br>"))
+    html_part = ("Content-Type: text/html; charset=utf-8\n"
+                 "Content-Transfer-Encoding: base64\n\n" + _b64(html.encode("utf-8")))
+    return headers + payload, html_part
+
+
+def generate_message(rng: random.Random, n: int, large_kb: int = 1024, large_every: int = 500) -> str:
+    """One synthetic PEC message (mbox From_ line included), as text."""
+    name = rng.choice(NAMES)
+    domain = rng.choice(DOMAINS)
+    sender = "{}@{}".format(name.split()[0].lower().replace("ò", "o").replace("é", "e"), domain)
+    when = _BASE_DATE + timedelta(minutes=n * 7 + rng.randint(0, 6))
+    zone = rng.choice(["+0100", "+0200", "+0000"])
+    date = when.strftime("%a, %d %b %Y %H:%M:%S +0000")
+    pec_type = _weighted(rng, PEC_TYPES)
+    topic = rng.choice(TOPICS).format(n=rng.randint(1, 9999), d=when.strftime("%d/%m/%Y"), y=when.year)
+    subject = rng.choice(PREFIXES) + topic
+    if rng.random() < 0.2:
+        subject += " – urgente"
+
+    text_part, html_part = _body(rng, n)
+    parts = [text_part, html_part]
+    if rng.random() < 0.1:
+        parts.append(
+            "Content-Type: image/png\nContent-Disposition: inline\n"
+            "Content-ID: <logo{}@{}>\nContent-Transfer-Encoding: base64\n\n".format(n, domain)
+            + _b64(b"\x89PNG\r\n\x1a\n" + rng.randbytes(rng.randint(500, 4000)))
+        )
+    for k in range(rng.choice([0, 1, 1, 1, 2, 3])):
+        size = rng.randint(2, 40) * 1024
+        if large_every and n % large_every == large_every - 1 and k == 0:
+            size = large_kb * 1024
+        filename = _header("allegato_{}_{}{}.pdf".format(n, k, rng.choice(["", "", "_è"])), rng)
+        parts.append(
+            'Content-Type: application/pdf; name="{0}"\nContent-Transfer-Encoding: base64\n'
+            'Content-Disposition: attachment; filename="{0}"\n\n'.format(filename)
+            + _b64(b"%PDF-1.4\n" + rng.randbytes(size))
+        )
+
+    inner = (
+        "From: {name} <{sender}>\nTo: protocollo@pec.{dest}\nCc: archivio@{dest}\n"
+        "Subject: {subject}\nDate: {date}\nMessage-ID: <msg{n}.{seed}@{domain}>\n"
+        "MIME-Version: 1.0\nContent-Type: multipart/mixed; boundary=\"inner{n}\"\n\n"
+    ).format(name=_header(name, rng), sender=sender, dest=rng.choice(DOMAINS),
+             subject=_header(subject, rng), date=date, n=n, seed=rng.randint(0, 10 ** 6),
+             domain=domain)
+    inner += "".join("--inner{}\n{}\n".format(n, part) for part in parts) + "--inner{}--\n".format(n)
+
+    local = when.astimezone(timezone(timedelta(hours=int(zone[1:3]))))
+    daticert = (
+        '<?xml version="1.0" encoding="UTF-8"?><postacert tipo="{tipo}" errore="{errore}">'
+        "<intestazione><mittente>{sender}</mittente><oggetto>{oggetto}</oggetto></intestazione>"
+        '<dati><gestore-emittente>{provider}</gestore-emittente><data zona="{zone}">'
+        "<giorno>{giorno}</giorno><ora>{ora}</ora></data></dati></postacert>"
+    ).format(tipo=pec_type, errore="nessuno" if "errore" not in pec_type else "altro",
+             sender=sender, oggetto=topic.replace("&", "&amp;"), provider=rng.choice(PROVIDERS),
+             zone=zone, giorno=local.strftime("%d/%m/%Y"), ora=local.strftime("%H:%M:%S"))
+    notice = "Messaggio di posta certificata\nIl giorno {} il messaggio \"{}\" è stato inviato da \"{}\"".format(
+        local.strftime("%d/%m/%Y alle ore %H:%M:%S"), topic, sender)
+
+    return (
+        "From posta-certificata@pec.it {asctime}\n"
+        "From: =?utf-8?b?{per_conto}?= <posta-certificata@pec.it>\n"
+        "To: protocollo@pec.it\nSubject: {outer_subject}\nDate: {date}\n"
+        "Message-ID: <outer{n}@pec.it>\nX-Trasporto: {tipo}\nMIME-Version: 1.0\n"
+        "Content-Type: multipart/signed; protocol=\"application/pkcs7-signature\"; boundary=\"sig{n}\"\n\n"
+        "--sig{n}\nContent-Type: multipart/mixed; boundary=\"mix{n}\"\n\n"
+        "--mix{n}\nContent-Type: text/plain; charset=utf-8\nContent-Transfer-Encoding: 8bit\n\n{notice}\n"
+        "--mix{n}\nContent-Type: application/xml; name=\"daticert.xml\"\n"
+        "Content-Disposition: inline; filename=\"daticert.xml\"\n\n{daticert}\n"
+        "--mix{n}\nContent-Type: message/rfc822; name=\"postacert.eml\"\n"
+        "Content-Disposition: inline; filename=\"postacert.eml\"\n\n{inner}\n"
+        "--mix{n}--\n\n"
+        "--sig{n}\nContent-Type: application/pkcs7-signature; name=\"smime.p7s\"\n"
+        "Content-Disposition: attachment; filename=\"smime.p7s\"\nContent-Transfer-Encoding: base64\n\n"
+        "{signature}--sig{n}--\n\n"
+    ).format(asctime=when.strftime("%a %b %d %H:%M:%S %Y"),
+             per_conto=base64.b64encode("Per conto di: {}".format(sender).encode()).decode("ascii"),
+             outer_subject=_header("POSTA CERTIFICATA: " + subject, rng), date=date, n=n,
+             tipo=pec_type, notice=notice, daticert=daticert, inner=inner,
+             signature=_b64(rng.randbytes(rng.randint(1500, 3000))))
+
+
+def generate_mbox(path: str, count: int, seed: int = 0, large_kb: int = 1024,
+                  large_every: int = 500) -> int:
+    """Write a count-message mbox to path; the same arguments always give
+    the same bytes. Every large_every-th message carries a large_kb
+    attachment. Returns the file size."""
+    rng = random.Random(seed)
+    size = 0
+    with open(path, "wb") as f:
+        for n in range(count):
+            data = generate_message(rng, n, large_kb, large_every).encode("utf-8")
+            f.write(data)
+            size += len(data)
+    return size
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a synthetic PEC mbox.")
+    parser.add_argument("path")
+    parser.add_argument("--count", type=int, default=SIZES["1k"])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--large-kb", type=int, default=1024, help="size of the large attachments")
+    parser.add_argument("--large-every", type=int, default=500,
+                        help="one message in this many has a large attachment (0: none)")
+    args = parser.parse_args(argv)
+    size = generate_mbox(args.path, args.count, args.seed, args.large_kb, args.large_every)
+    print("{}: {} messages, {:.1f} MB".format(args.path, args.count, size / 1e6))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+"""Serving benchmark: drive the Flask app with concurrent clients.
+
+Builds an archive from a synthetic corpus (bench.corpus) in a throwaway
+data dir, then N client threads each send a seeded random mix of
+/api/catalog, /api/email/<id>, /api/search, /attachment/... and
+/api/sources requests, through the Flask test client or (--server) a
+local threaded WSGI server over HTTP. Reports p50/p95/p99 latency,
+throughput, errors and bytes transferred per endpoint.
+
+    python -m bench.load --count 1000 --clients 8 --requests 200 [--server]
+        [--mix search=3,catalog=1] [--json report.json]
+"""
+
+import argparse
+import http.client
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import quote, urlencode
+
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+from bench.corpus import TOPICS, generate_mbox
+from bench.run import _data_dir
+from pec_parser.mbox_reader import process_mbox
+from storage.json_store import get_catalog_view
+import storage
+import config
+
+
+# Default request mix: endpoint -> relative weight
+DEFAULT_MIX: Dict[str, int] = {
+    "catalog": 1,
+    "catalog_page": 2,
+    "email": 4,
+    "search": 3,
+    "attachment": 1,
+    "sources": 1,
+}
+
+SEARCH_TERMS = ["fattura", "sollecito", "rossi", "verbale", "decreto", "pratica", "comune",
+                "perizia", "agibilità", "locazione", "chiarimenti", "ditta-rossi.it"]
+PEC_TYPES = ["posta-certificata", "accettazione", "avvenuta-consegna", "errore-consegna"]
+# Emails whose attachment names are collected for /attachment requests
+ATTACHMENT_SAMPLE = 200
+
+
+def parse_mix(value: str) -> Dict[str, int]:
+    """"search=3,catalog=1" -> {"search": 3, "catalog": 1}; ValueError if malformed."""
+    mix = {}
+    for item in value.split(","):
+        name, _, weight = item.partition("=")
+        name = name.strip()
+        if name not in DEFAULT_MIX:
+            raise ValueError("unknown endpoint {!r} (one of: {})".format(name, ", ".join(DEFAULT_MIX)))
+        mix[name] = int(weight) if weight else 1
+    if not any(weight > 0 for weight in mix.values()):
+        raise ValueError("the mix needs at least one positive weight")
+    return mix
+
+
+class Archive:
+    """What the request generator draws from: email ids and attachment URLs."""
+
+    def __init__(self):
+        view = get_catalog_view()
+        self.email_ids = [s["email_id"] for s in view.summaries]
+        self.attachments: List[Tuple[str, str]] = []
+        with_attachments = [s["email_id"] for s in view.summaries if s.get("attachment_count")]
+        for email_id in with_attachments[:ATTACHMENT_SAMPLE]:
+            doc = storage.load_email(email_id) or {}
+            for att in doc.get("attachments", []):
+                self.attachments.append((email_id, att["filename"]))
+
+
+def _next_request(rng: random.Random, archive: Archive, names: List[str], weights: List[int]):
+    """(endpoint, path) of a random request."""
+    endpoint = rng.choices(names, weights)[0]
+    if endpoint == "catalog":
+        return endpoint, "/api/catalog"
+    if endpoint == "catalog_page":
+        params = {"view": rng.choice(["emails", "groups"]), "limit": rng.choice([20, 50, 100])}
+        params["sort"] = rng.choice(["-date", "date", "-group_size"])
+        if rng.random() < 0.5:
+            params["cursor"] = rng.randint(0, len(archive.email_ids))
+        return endpoint, "/api/catalog?" + urlencode(params)
+    if endpoint == "email":
+        return endpoint, "/api/email/" + rng.choice(archive.email_ids)
+    if endpoint == "search":
+        params = {}
+        if rng.random() < 0.8:
+            params["q"] = rng.choice(SEARCH_TERMS + [t.split()[0].lower() for t in TOPICS])
+        if rng.random() < 0.3 or not params:
+            params["pec_type"] = rng.choice(PEC_TYPES)
+        if rng.random() < 0.2:
+            params.update({"from": "2024-01-01", "to": "2024-01-31"})
+        return endpoint, "/api/search?" + urlencode(params)
+    if endpoint == "attachment" and archive.attachments:
+        email_id, filename = rng.choice(archive.attachments)
+        return endpoint, "/attachment/{}/{}".format(email_id, quote(filename))
+    return "sources", "/api/sources"
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of values (0 if empty)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * pct // 100))
+    return ordered[int(rank) - 1]
+
+
+def _test_client_fetcher():
+    from app import app
+    client = app.test_client()
+
+    def fetch(path):
+        resp = client.get(path)
+        return resp.status_code, len(resp.get_data())
+    return fetch
+
+
+class _QuietHandler(WSGIRequestHandler):
+    """No access log line per request."""
+
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+def _http_fetcher(port: int):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+
+    def fetch(path):
+        conn.request("GET", path)
+        resp = conn.getresponse()
+        return resp.status, len(resp.read())
+    return fetch
+
+
+def _client(fetch, rng, archive, mix, requests, warmup, samples, lock):
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    local = []
+    for n in range(warmup + requests):
+        endpoint, path = _next_request(rng, archive, names, weights)
+        start = time.perf_counter()
+        status, size = fetch(path)
+        elapsed = time.perf_counter() - start
+        if n >= warmup:
+            local.append((endpoint, elapsed, status, size))
+    with lock:
+        samples.extend(local)
+
+
+def _summarize(samples, wall: float) -> Dict:
+    by_endpoint: Dict[str, List] = {}
+    for sample in samples:
+        by_endpoint.setdefault(sample[0], []).append(sample)
+    report = {}
+    for endpoint, items in sorted(by_endpoint.items()) + [("all", samples)]:
+        latencies = [elapsed * 1000 for _, elapsed, _, _ in items]
+        report[endpoint] = {
+            "requests": len(items),
+            "errors": sum(1 for _, _, status, _ in items if status >= 400),
+            "p50_ms": round(percentile(latencies, 50), 2),
+            "p95_ms": round(percentile(latencies, 95), 2),
+            "p99_ms": round(percentile(latencies, 99), 2),
+            "requests_per_s": round(len(items) / wall, 1),
+            "bytes": sum(size for _, _, _, size in items),
+        }
+    return report
+
+
+def run_load(clients: int = 8, requests: int = 200, mix: Optional[Dict[str, int]] = None,
+             seed: int = 0, warmup: int = 5, server: bool = False) -> Dict:
+    """Run the load against the archive config currently points at; returns
+    the report (per endpoint and "all")."""
+    mix = mix or DEFAULT_MIX
+    archive = Archive()
+    httpd = None
+    if server:
+        from app import app
+        httpd = make_server("127.0.0.1", 0, app, threaded=True, request_handler=_QuietHandler)
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+
+    samples, lock = [], threading.Lock()
+    threads = []
+    for n in range(clients):
+        fetch = _http_fetcher(httpd.server_port) if server else _test_client_fetcher()
+        threads.append(threading.Thread(
+            target=_client,
+            args=(fetch, random.Random(seed * 1000 + n), archive, mix, requests, warmup, samples, lock),
+        ))
+    start = time.perf_counter()
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        if httpd is not None:
+            httpd.shutdown()
+    wall = time.perf_counter() - start
+
+    return {
+        "clients": clients,
+        "requests_per_client": requests,
+        "mode": "server" if server else "test_client",
+        "backend": config.STORAGE_BACKEND,
+        "wall_s": round(wall, 3),
+        "endpoints": _summarize(samples, wall),
+    }
+
+
+def _print_report(report: Dict):
+    print("{} clients x {} requests, {}, {} backend, {:.2f} s".format(
+        report["clients"], report["requests_per_client"], report["mode"], report["backend"],
+        report["wall_s"]))
+    print("  {:<13} {:>7} {:>6} {:>9} {:>9} {:>9} {:>9} {:>11}".format(
+        "endpoint", "reqs", "errors", "p50 ms", "p95 ms", "p99 ms", "req/s", "MB"))
+    for endpoint, r in report["endpoints"].items():
+        print("  {:<13} {:>7} {:>6} {:>9.2f} {:>9.2f} {:>9.2f} {:>9.1f} {:>11.2f}".format(
+            endpoint, r["requests"], r["errors"], r["p50_ms"], r["p95_ms"], r["p99_ms"],
+            r["requests_per_s"], r["bytes"] / 1e6))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test the HTTP endpoints on a synthetic archive.")
+    parser.add_argument("--count", type=int, default=1000, help="messages in the generated archive")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--clients", type=int, default=8, help="concurrent clients")
+    parser.add_argument("--requests", type=int, default=200, help="requests per client")
+    parser.add_argument("--warmup", type=int, default=5, help="unmeasured requests per client first")
+    parser.add_argument("--mix", help="endpoint weights, e.g. search=3,catalog=1 (default: {})".format(
+        ",".join("{}={}".format(k, v) for k, v in DEFAULT_MIX.items())))
+    parser.add_argument("--server", action="store_true",
+                        help="go through a local threaded WSGI server instead of the test client")
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args(argv)
+    try:
+        mix = parse_mix(args.mix) if args.mix else DEFAULT_MIX
+    except ValueError as e:
+        parser.error(str(e))
+
+    workdir = tempfile.mkdtemp(prefix="pec-load-")
+    try:
+        corpus = os.path.join(workdir, "load.mbox")
+        generate_mbox(corpus, args.count, args.seed)
+        with _data_dir(os.path.join(workdir, "data")):
+            config.MBOX_PATH = corpus
+            process_mbox(corpus)
+            report = run_load(args.clients, args.requests, mix, args.seed, args.warmup, args.server)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    _print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,99 @@
+"""Memory profile of one ingest: peak traced memory and RSS per stage, and
+the top allocation sites (pec_parser.memory).
+
+Ingests a given mbox, or a generated one, into a throwaway data dir with
+process_mbox (or process_mbox_incremental with --incremental) and prints
+the memory section of its ingest report. With --budget-mb the exit status
+is 1 when the peak traced memory goes over the budget.
+
+    python -m bench.memory [--mbox export.mbox | --count 1000 --large-kb 8192]
+        [--incremental [--lazy]] [--budget-mb 256] [--json report.json]
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+from bench.corpus import generate_mbox
+from bench.run import _data_dir
+from pec_parser import metrics
+from pec_parser.mbox_reader import process_mbox, process_mbox_incremental
+
+
+def profile_ingest(mbox_path: str, incremental: bool = False, lazy: bool = False) -> dict:
+    """Ingest mbox_path into a throwaway data dir; returns the ingest report."""
+    workdir = tempfile.mkdtemp(prefix="pec-memory-")
+    try:
+        with _data_dir(workdir):
+            with metrics.ingest_report(memory=True) as report:
+                if incremental:
+                    process_mbox_incremental(mbox_path, lazy=lazy)
+                else:
+                    process_mbox(mbox_path)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return report.to_dict()
+
+
+def _mb(value) -> str:
+    return "-" if value is None else "{:.1f}".format(value / 1e6)
+
+
+def _print_report(report: dict):
+    memory = report["memory"]
+    print("{} messages in {:.2f} s; traced peak {} MB (start {} MB), RSS peak {} MB (start {} MB)".format(
+        report["counters"]["messages"], report["seconds"], _mb(memory["peak_bytes"]),
+        _mb(memory["start_bytes"]), _mb(memory["rss_peak_bytes"]), _mb(memory["rss_start_bytes"])))
+    print("  {:<18} {:>14} {:>10}".format("stage", "traced peak MB", "RSS MB"))
+    for name, stage in memory["stages"].items():
+        print("  {:<18} {:>14} {:>10}".format(name, _mb(stage["peak_bytes"]), _mb(stage["rss_bytes"])))
+    print("top allocation sites (at {} MB traced):".format(_mb(memory["snapshot_bytes"])))
+    for site in memory["top_sites"]:
+        print("  {:>10} MB {:>8} blocks  {}".format(_mb(site["bytes"]), site["count"], site["site"]))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Profile the memory of one ingest.")
+    parser.add_argument("--mbox", help="mbox to ingest (default: a generated one)")
+    parser.add_argument("--count", type=int, default=1000, help="messages in the generated mbox")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--large-kb", type=int, default=8192, help="size of the large attachments")
+    parser.add_argument("--large-every", type=int, default=100,
+                        help="one generated message in this many has a large attachment")
+    parser.add_argument("--incremental", action="store_true",
+                        help="ingest as a new source (process_mbox_incremental)")
+    parser.add_argument("--lazy", action="store_true", help="with --incremental: headers only")
+    parser.add_argument("--budget-mb", type=float, help="fail if the traced peak goes over this")
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args(argv)
+
+    corpus_dir = None
+    mbox_path = args.mbox
+    if mbox_path is None:
+        corpus_dir = tempfile.mkdtemp(prefix="pec-corpus-")
+        mbox_path = os.path.join(corpus_dir, "memory.mbox")
+        generate_mbox(mbox_path, args.count, args.seed, args.large_kb, args.large_every)
+    try:
+        report = profile_ingest(mbox_path, args.incremental, args.lazy)
+    finally:
+        if corpus_dir is not None:
+            shutil.rmtree(corpus_dir, ignore_errors=True)
+
+    _print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+    if args.budget_mb is not None:
+        used = report["memory"]["peak_bytes"] - report["memory"]["start_bytes"]
+        if used > args.budget_mb * 1e6:
+            print("OVER BUDGET: {} MB > {} MB".format(_mb(used), args.budget_mb))
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,189 @@
+"""Ingest benchmark suite: time each stage of an ingest on a synthetic corpus.
+
+Stages: _parse_mbox_emails (parse + write the email documents),
+group_emails, save_catalog and delete_source. Each is reported in
+messages/s and MB/s of mbox, and compared with a baseline JSON (by default
+bench/baselines/<size>.json): a stage more than --tolerance slower than
+its baseline is a regression and the exit status is 1.
+
+Baselines are only meaningful on the machine that recorded them; rerun
+with --update-baseline after a deliberate change or on new hardware.
+
+    python -m bench.run --size 1k [--workers N] [--corpus path.mbox] [--update-baseline]
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+from bench.corpus import SIZES, generate_mbox
+from pec_parser.grouper import GroupIndex, group_emails
+from pec_parser.mbox_reader import _build_source_entry, _parse_mbox_emails
+from storage.json_store import generate_source_id, invalidate_catalog_cache
+import storage
+import config
+
+
+BASELINES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines")
+
+STAGES = ("parse", "group", "save_catalog", "delete_source")
+
+
+@contextmanager
+def _data_dir(workdir: str, workers: Optional[int] = None):
+    """Point every config path under DATA_DIR at workdir for the duration."""
+    live = config.DATA_DIR.rstrip(os.sep)
+    saved = {}
+    for name in dir(config):
+        value = getattr(config, name)
+        if name.isupper() and isinstance(value, str) and (value == live or value.startswith(live + os.sep)):
+            saved[name] = value
+            setattr(config, name, workdir + value[len(live):])
+    if workers is not None:
+        saved["INGEST_WORKERS"] = config.INGEST_WORKERS
+        config.INGEST_WORKERS = workers
+    invalidate_catalog_cache()
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            setattr(config, name, value)
+        invalidate_catalog_cache()
+
+
+def _stage(seconds: float, messages: int, size: int) -> Dict:
+    seconds = max(seconds, 1e-9)
+    return {
+        "seconds": round(seconds, 4),
+        "messages_per_s": round(messages / seconds, 1),
+        "mb_per_s": round(size / 1e6 / seconds, 2),
+    }
+
+
+def run_suite(mbox_path: str, workers: Optional[int] = None) -> Dict:
+    """Ingest mbox_path stage by stage into a throwaway data dir; returns the report."""
+    size = os.path.getsize(mbox_path)
+    workdir = tempfile.mkdtemp(prefix="pec-bench-")
+    try:
+        with _data_dir(workdir, workers):
+            start = time.perf_counter()
+            summaries = _parse_mbox_emails(mbox_path).summaries
+            parse_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            group_emails(summaries)
+            group_time = time.perf_counter() - start
+
+            # The stored groups come from the incremental index, built off the clock
+            index = GroupIndex()
+            index.assign(summaries)
+            source_name = os.path.basename(mbox_path)
+            source_id = generate_source_id(source_name)
+            entry = _build_source_entry(source_id, source_name, summaries)
+            start = time.perf_counter()
+            storage.save_catalog([entry], groups=index.to_list())
+            save_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            storage.delete_source(source_id)
+            delete_time = time.perf_counter() - start
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    count = len(summaries)
+    return {
+        "messages": count,
+        "mbox_bytes": size,
+        "workers": config.INGEST_WORKERS if workers is None else workers,
+        "backend": config.STORAGE_BACKEND,
+        "stages": {
+            "parse": _stage(parse_time, count, size),
+            "group": _stage(group_time, count, size),
+            "save_catalog": _stage(save_time, count, size),
+            "delete_source": _stage(delete_time, count, size),
+        },
+    }
+
+
+def compare(report: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """Stages whose throughput fell more than tolerance (a fraction) below
+    the baseline, as readable lines (empty if none did)."""
+    regressions = []
+    for stage in STAGES:
+        current = report["stages"].get(stage)
+        expected = (baseline.get("stages") or {}).get(stage)
+        if current is None or expected is None:
+            continue
+        floor = expected["messages_per_s"] * (1 - tolerance)
+        if current["messages_per_s"] < floor:
+            regressions.append("{}: {:.1f} msg/s, baseline {:.1f} msg/s ({:+.0%})".format(
+                stage, current["messages_per_s"], expected["messages_per_s"],
+                current["messages_per_s"] / expected["messages_per_s"] - 1))
+    return regressions
+
+
+def _print_report(report: Dict):
+    print("{} messages, {:.1f} MB, {} worker(s), {} backend".format(
+        report["messages"], report["mbox_bytes"] / 1e6, report["workers"], report["backend"]))
+    for stage in STAGES:
+        result = report["stages"][stage]
+        print("  {:<14} {:>9.3f} s {:>10.1f} msg/s {:>8.2f} MB/s".format(
+            stage, result["seconds"], result["messages_per_s"], result["mb_per_s"]))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the ingest pipeline on a synthetic corpus.")
+    parser.add_argument("--size", choices=sorted(SIZES), default="1k", help="named corpus size")
+    parser.add_argument("--count", type=int, help="number of messages (overrides --size)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, help="INGEST_WORKERS for the parse stage")
+    parser.add_argument("--corpus", help="mbox to benchmark (generated there first if missing)")
+    parser.add_argument("--baseline", help="baseline JSON (default: bench/baselines/<size>.json)")
+    parser.add_argument("--tolerance", type=float, default=0.3,
+                        help="allowed throughput drop before a stage counts as a regression")
+    parser.add_argument("--update-baseline", action="store_true", help="write the results as the baseline")
+    args = parser.parse_args(argv)
+
+    count = args.count or SIZES[args.size]
+    label = args.size if args.count is None else str(args.count)
+    baseline_path = args.baseline or os.path.join(BASELINES_DIR, "{}.json".format(label))
+
+    corpus_dir = None
+    corpus = args.corpus
+    if corpus is None:
+        corpus_dir = tempfile.mkdtemp(prefix="pec-corpus-")
+        corpus = os.path.join(corpus_dir, "bench_{}.mbox".format(label))
+    try:
+        if not os.path.exists(corpus):
+            generate_mbox(corpus, count, args.seed)
+        report = run_suite(corpus, args.workers)
+    finally:
+        if corpus_dir is not None:
+            shutil.rmtree(corpus_dir, ignore_errors=True)
+    _print_report(report)
+
+    if args.update_baseline:
+        os.makedirs(os.path.dirname(baseline_path), exist_ok=True)
+        with open(baseline_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+        print("baseline written to {}".format(baseline_path))
+        return 0
+    if not os.path.exists(baseline_path):
+        print("no baseline at {}".format(baseline_path))
+        return 0
+    with open(baseline_path, encoding="utf-8") as f:
+        regressions = compare(report, json.load(f), args.tolerance)
+    for line in regressions:
+        print("REGRESSION " + line)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -6,6 +6,102 @@ DATA_DIR = os.path.join(BASE_DIR, "data")
 CATALOG_PATH = os.path.join(DATA_DIR, "catalog.json")
 EMAILS_DIR = os.path.join(DATA_DIR, "emails")
 ATTACHMENTS_DIR = os.path.join(DATA_DIR, "attachments")
+BLOBS_DIR = os.path.join(DATA_DIR, "blobs")
+BLOB_REFS_PATH = os.path.join(DATA_DIR, "blob_refs.db")
 UPLOADS_DIR = os.path.join(DATA_DIR, "uploads")
+SEARCH_INDEX_PATH = os.path.join(DATA_DIR, "search_index.db")
+SQLITE_PATH = os.path.join(DATA_DIR, "catalog.db")
+FINGERPRINTS_DIR = os.path.join(DATA_DIR, "fingerprints")
+DEDUP_INDEX_PATH = os.path.join(DATA_DIR, "dedup.db")
+
+# Catalog/email storage: "json" (catalog.json + one file per email) or
+# "sqlite" (everything in SQLITE_PATH)
+STORAGE_BACKEND = "json"
+# Email documents an ingest writes per SQLite transaction (sqlite backend)
+SQLITE_EMAIL_BATCH = 256
+# Emails whose search postings an ingest holds before merging them into the index
+SEARCH_INDEX_BATCH = 512
+
+# Full rebuilds build a new snapshot here; DATA_DIR then becomes a symlink
+# to the live one. SNAPSHOTS_KEEP older snapshots are kept for in-flight readers.
+SNAPSHOTS_DIR = os.path.join(BASE_DIR, "data.snapshots")
+SNAPSHOTS_KEEP = 1
 
 GROUPING_THRESHOLD = 0.85
+# q-grams found in more than GROUPING_STOPGRAM_SEEDS group seeds are
+# stop-grams, skipped when looking up a subject's candidate groups; a seed
+# must then share at least GROUPING_MIN_SHARED_GRAMS of its rarer q-grams
+# (keeps grouping near-linear; exact while no stop-gram is skipped)
+GROUPING_STOPGRAM_SEEDS = 256
+GROUPING_MIN_SHARED_GRAMS = 3
+
+# Seconds between mtime checks of catalog.json by the in-process catalog cache
+CATALOG_CACHE_CHECK_INTERVAL = 1.0
+
+# Page sizes for the paginated /api/catalog
+CATALOG_PAGE_SIZE = 100
+CATALOG_MAX_PAGE_SIZE = 1000
+
+# Worker processes used to parse an mbox (1 = serial, 0 = one per CPU)
+INGEST_WORKERS = 1
+# Messages per shard handed to a worker in parallel ingest
+INGEST_SHARD_SIZE = 256
+# Ingest workers of a full (shadow) rebuild, which runs off the request path
+REBUILD_WORKERS = 0
+
+# Streaming uploads (/api/upload/stream): bytes read from the request per
+# chunk, and received messages waiting for the parser thread
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+STREAM_QUEUE_SIZE = 64
+
+# Background ingest jobs started by /api/upload: concurrent jobs, and how many
+# finished jobs /api/jobs/<id> remembers
+INGEST_JOB_WORKERS = 2
+INGEST_JOB_HISTORY = 100
+
+# Follow mode (pec_parser.follow): mbox files the web app polls for appended
+# messages in a background thread (empty = off), and seconds between polls
+FOLLOW_PATHS = []
+FOLLOW_INTERVAL = 5.0
+
+# Attachments are base64/quoted-printable decoded and written this many
+# encoded characters at a time, bounding memory per attachment
+DECODE_CHUNK_SIZE = 256 * 1024
+
+# Uploads are ingested in two tiers: headers, PEC metadata and the attachment
+# list first (enough for the listing), bodies and attachments on first access
+# or by a background backfill pausing BACKFILL_PAUSE seconds between messages
+LAZY_BODIES = True
+BACKFILL_PAUSE = 0.0
+# Backfilled emails committed (blob refs, search postings) per batch
+BACKFILL_BATCH = 256
+# Seconds the blob refs and search postings of emails extracted on access
+# wait (batched, off the request) before a background flush writes them
+LAZY_COMMIT_DELAY = 2.0
+
+# New sources (uploads) link messages already stored, found by raw-message
+# hash or Message-ID in the DEDUP_INDEX_PATH index, instead of parsing them
+# again; a re-upload of an identical file is linked as a whole
+DEDUP_UPLOADS = True
+
+# Ingest stage timings, counters and per-route request histograms
+# (pec_parser.metrics, served at /api/metrics); ingest reports list the
+# METRICS_SLOWEST slowest messages
+METRICS_ENABLED = True
+METRICS_SLOWEST = 10
+
+# Opt-in memory profiling of ingests (pec_parser.memory; several times
+# slower): peak traced memory and RSS per stage and the MEMORY_TOP_SITES top
+# allocation sites go into the ingest report; RSS is sampled every
+# MEMORY_SAMPLE_INTERVAL seconds
+MEMORY_PROFILE = False
+MEMORY_TOP_SITES = 10
+MEMORY_SAMPLE_INTERVAL = 0.05
+# Peak traced memory (above the starting point) allowed for a full or
+# incremental ingest, and for a lazy (headers-only) one, of the generated
+# mailbox in tests/test_memory.py (more than twice INGEST_MEMORY_BUDGET)
+INGEST_MEMORY_BUDGET = 16 * 1024 * 1024
+LAZY_INGEST_MEMORY_BUDGET = 6 * 1024 * 1024
+# Peak traced memory allowed to parse and store one message, full or on
+# access, whatever the size of its attachments (tests/test_memory.py)
+MESSAGE_MEMORY_BUDGET = 6 * 1024 * 1024
@@ -1,57 +1,55 @@
 """Extract and save email attachments to disk."""
 
 import os
-from typing import List
+from typing import Dict, Iterable, List
 
-from pec_parser.encoding_utils import safe_filename
-from pec_parser.pec_extractor import PEC_INFRA_FILES
+from pec_parser.pec_extractor import _extract_body_and_attachments
+from pec_parser import metrics
+from storage.blob_store import put_blob_stream
 import config
 
 
+class AttachmentWriter:
+    """Attachment sink writing payloads to data/attachments/<email_id>/.
+
+    Pass the class itself as parse_pec_message(..., attachment_sink=AttachmentWriter).
+    Filenames arrive already deduplicated by the extractor; payloads arrive
+    as an iterable of decoded chunks.
+    """
+
+    def __init__(self, email_id: str):
+        self.att_dir = os.path.join(config.ATTACHMENTS_DIR, email_id)
+        self.saved: List[str] = []
+
+    def write(self, filename: str, chunks: Iterable[bytes]):
+        os.makedirs(self.att_dir, exist_ok=True)
+        with open(os.path.join(self.att_dir, filename), "wb") as f:
+            for chunk in chunks:
+                f.write(chunk)
+            metrics.count("bytes_written", f.tell())
+        self.saved.append(filename)
+
+
+class BlobWriter:
+    """Attachment sink writing payloads to the content-addressed blob store.
+
+    Identical payloads are stored once; write() returns the blob digest,
+    which ends up on the Attachment and forms the email's manifest.
+    """
+
+    def __init__(self, email_id: str):
+        self.email_id = email_id
+        self.manifest: Dict[str, str] = {}
+
+    def write(self, filename: str, chunks: Iterable[bytes]) -> str:
+        digest, size = put_blob_stream(chunks)
+        metrics.count("bytes_written", size)
+        self.manifest[filename] = digest
+        return digest
+
+
 def save_attachments(inner_msg, email_id: str) -> List[str]:
     """Extract attachments from inner email and save to data/attachments/<email_id>/."""
-    att_dir = os.path.join(config.ATTACHMENTS_DIR, email_id)
-    saved = []
-
-    if not inner_msg.is_multipart():
-        return saved
-
-    for part in inner_msg.walk():
-        if part.get_content_maintype() == "multipart":
-            continue
-
-        filename = part.get_filename()
-        if not filename:
-            # Check if it's an inline image with Content-ID
-            cd = str(part.get("Content-Disposition", ""))
-            cid = part.get("Content-ID", "")
-            if "inline" in cd.lower() and part.get_content_type().startswith("image/"):
-                ext = part.get_content_type().split("/")[1]
-                filename = "inline_{}".format(cid.strip("<>") or "image") + "." + ext
-            else:
-                continue
-
-        if filename.lower() in PEC_INFRA_FILES:
-            continue
-
-        safe_name = safe_filename(filename)
-        payload = part.get_payload(decode=True)
-        if payload is None:
-            continue
-
-        os.makedirs(att_dir, exist_ok=True)
-
-        # Handle duplicate filenames
-        target = os.path.join(att_dir, safe_name)
-        if os.path.exists(target):
-            base, ext = os.path.splitext(safe_name)
-            counter = 1
-            while os.path.exists(target):
-                target = os.path.join(att_dir, "{}_{:d}{}".format(base, counter, ext))
-                counter += 1
-
-        with open(target, "wb") as f:
-            f.write(payload)
-        saved.append(os.path.basename(target))
-
-    return saved
+    writer = AttachmentWriter(email_id)
+    _extract_body_and_attachments(inner_msg, writer)
+    return writer.saved
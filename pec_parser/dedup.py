@@ -0,0 +1,150 @@
+"""Message-level dedup of new sources against the emails already stored.
+
+The index (a SQLite database, config.DEDUP_INDEX_PATH) maps the hash of
+every raw message ingested to its email_id (None if it did not parse), and
+the hash of every uploaded file to the email_ids it produced, in order.
+Lookups and updates touch only the rows involved, so neither grows with
+everything ever ingested. A new source looks each message up by hash
+before parsing it (and, on a miss, by the email_id a header-only skeleton
+parse derives from its Message-ID): a message whose email is stored fully
+extracted is linked to the new source instead of being parsed and written
+again. A file whose hash is known is linked as a whole.
+
+Entries are hints, checked against the email store before use; those of
+deleted emails are dropped by forget_emails.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from pec_parser import metrics
+from storage.sqlite_db import Database
+import config
+
+
+# Bytes hashed at a time by file_hash
+FILE_HASH_CHUNK = 1024 * 1024
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    digest TEXT PRIMARY KEY,
+    email_id TEXT
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS messages_email_id ON messages (email_id);
+CREATE TABLE IF NOT EXISTS files (
+    digest TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    email_id TEXT NOT NULL,
+    PRIMARY KEY (digest, position)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS files_email_id ON files (email_id);
+"""
+
+# Serializes index updates in-process, so they never hit the busy timeout
+_lock = threading.Lock()
+
+
+@metrics.stage("fingerprint")
+def message_hash(raw) -> str:
+    """Hash of a raw mbox record (the digest part of its fingerprint)."""
+    return hashlib.blake2b(raw, digest_size=16).hexdigest()
+
+
+def digest_of(key: str) -> str:
+    """The message hash inside a fingerprint cache key."""
+    return key.rsplit(":", 1)[1]
+
+
+@metrics.stage("fingerprint")
+def file_hash(path: str) -> str:
+    """Hash of a whole file, read FILE_HASH_CHUNK bytes at a time."""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(FILE_HASH_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def new_file_hash():
+    """Incremental hasher matching file_hash, for files received in chunks."""
+    return hashlib.blake2b(digest_size=16)
+
+
+def _legacy_index_path() -> str:
+    return os.path.join(os.path.dirname(config.DEDUP_INDEX_PATH), "dedup.json")
+
+
+def _import_legacy_index(conn: sqlite3.Connection):
+    """Move the index of a data directory written before the database
+    (data/dedup.json) into it."""
+    if not os.path.exists(_legacy_index_path()):
+        return
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # Another connection may have imported it meanwhile
+        path = _legacy_index_path()
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                index = json.load(f)
+            _insert(conn, index.get("messages", {}), index.get("files", {}))
+            os.remove(path)
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+
+_db = Database("DEDUP_INDEX_PATH", _SCHEMA, migrate=_import_legacy_index)
+
+
+def _insert(conn: sqlite3.Connection, messages: Dict[str, Optional[str]],
+            files: Dict[str, List[str]]):
+    conn.executemany("INSERT OR REPLACE INTO messages (digest, email_id) VALUES (?, ?)",
+                     messages.items())
+    for digest, email_ids in files.items():
+        conn.execute("DELETE FROM files WHERE digest = ?", (digest,))
+        conn.executemany("INSERT INTO files (digest, position, email_id) VALUES (?, ?, ?)",
+                         ((digest, i, eid) for i, eid in enumerate(email_ids)))
+
+
+def lookup(digest: str) -> Tuple[bool, Optional[str]]:
+    """(True, email_id or None) for a message hash in the index, else (False, None)."""
+    row = _db.connect().execute("SELECT email_id FROM messages WHERE digest = ?",
+                                (digest,)).fetchone()
+    return (True, row[0]) if row is not None else (False, None)
+
+
+def file_emails(file_digest: str) -> Optional[List[str]]:
+    """The email_ids of the file hashed file_digest, in order (None if unknown
+    or if it produced none)."""
+    email_ids = [eid for (eid,) in _db.connect().execute(
+        "SELECT email_id FROM files WHERE digest = ? ORDER BY position", (file_digest,))]
+    return email_ids or None
+
+
+@metrics.stage("dedup_index")
+def record(messages: Dict[str, Optional[str]], file_digest: Optional[str] = None,
+           email_ids: Optional[List[str]] = None):
+    """Add message hashes (-> email_id or None) and, if given, the email_ids
+    of the file hashed file_digest to the index."""
+    if not messages and file_digest is None:
+        return
+    files = {file_digest: list(email_ids or [])} if file_digest is not None else {}
+    with _lock, _db.transaction() as conn:
+        _insert(conn, messages, files)
+
+
+def forget_emails(email_ids: Iterable[str]):
+    """Drop the entries of deleted emails (and of files that held any)."""
+    email_ids = set(email_ids)
+    if not email_ids or not (_db.exists() or os.path.exists(_legacy_index_path())):
+        return
+    with _lock, _db.transaction() as conn:
+        for eid in email_ids:
+            conn.execute("DELETE FROM messages WHERE email_id = ?", (eid,))
+            conn.execute("DELETE FROM files WHERE digest IN "
+                         "(SELECT digest FROM files WHERE email_id = ?)", (eid,))
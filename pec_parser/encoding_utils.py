@@ -1,8 +1,13 @@
+import binascii
 import re
-from typing import Optional, List
+from typing import Iterable, Iterator, Optional, List
 from email.header import decode_header
 from email.utils import parseaddr, getaddresses
 
+from pec_parser import metrics
+from pec_parser.mbox_scanner import RecordMessage
+import config
+
 
 def decode_header_value(raw: Optional[str]) -> str:
     """Decode an RFC 2047 encoded header value to a Unicode string."""
@@ -18,6 +23,7 @@ def decode_header_value(raw: Optional[str]) -> str:
     return "".join(decoded_parts).strip()
 
 
+@metrics.stage("decode_payload")
 def decode_payload(part) -> str:
     """Decode an email part's payload to a Unicode string."""
     payload = part.get_payload(decode=True)
@@ -27,6 +33,115 @@ def decode_payload(part) -> str:
     return payload.decode(charset, errors="replace")
 
 
+# Everything a2b_base64 skips: not base64 alphabet nor padding
+_BASE64_SKIPPED_RE = re.compile(rb"[^A-Za-z0-9+/=]")
+_PADDING_RE = re.compile(rb"=+")
+
+
+def _encoded_pieces(payload, chunk_size: int) -> Iterator[bytes]:
+    """An encoded payload (ASCII string or bytes-like) as bytes, chunk_size
+    characters at a time."""
+    for start in range(0, len(payload), chunk_size):
+        piece = payload[start:start + chunk_size]
+        yield piece.encode("ascii") if isinstance(piece, str) else bytes(piece)
+
+
+def _base64_runs(pieces: Iterable[bytes]) -> Iterator[bytes]:
+    """The base64 alphabet characters of pieces, in runs, as
+    binascii.a2b_base64 reads them: other characters are skipped and the
+    data ends at the first padding that completes a quantum."""
+    count = pads = 0
+    for piece in pieces:
+        piece = _BASE64_SKIPPED_RE.sub(b"", piece)
+        pos = 0
+        for match in _PADDING_RE.finditer(piece):
+            if match.start() > pos:
+                yield piece[pos:match.start()]
+                count += match.start() - pos
+                pads = 0
+            # Padding only counts after two or three characters of a quantum
+            if count % 4 >= 2:
+                pads += match.end() - match.start()
+                if count % 4 + pads >= 4:
+                    return
+            pos = match.end()
+        if pos < len(piece):
+            yield piece[pos:]
+            count += len(piece) - pos
+            pads = 0
+
+
+def _decode_base64(runs: Iterable[bytes]) -> Iterator[bytes]:
+    carry = b""
+    for run in runs:
+        data = carry + run
+        usable = len(data) - len(data) % 4
+        if usable:
+            yield binascii.a2b_base64(data[:usable])
+        carry = data[usable:]
+    # An unpadded last quantum is decoded as if padded
+    if len(carry) > 1:
+        yield binascii.a2b_base64(carry + b"=" * (-len(carry) % 4))
+
+
+def _decode_quoted_printable(pieces: Iterable[bytes]) -> Iterator[bytes]:
+    carry = b""
+    for piece in pieces:
+        data = carry + piece
+        # Decode whole lines only, so no soft line break or =XX is cut
+        cut = data.rfind(b"\n") + 1
+        if cut:
+            yield binascii.a2b_qp(data[:cut])
+        carry = data[cut:]
+    if carry:
+        yield binascii.a2b_qp(carry)
+
+
+def iter_decoded_payload(part, chunk_size: Optional[int] = None) -> Iterator[bytes]:
+    """Yield a leaf part's decoded payload in pieces.
+
+    Same bytes as part.get_payload(decode=True), malformed base64 included,
+    but base64 and quoted-printable are decoded chunk_size input characters
+    at a time (default config.DECODE_CHUNK_SIZE), so the decoded payload is
+    never held in memory as a whole. A mbox_scanner.RecordMessage body is
+    read straight from its record; other payloads with non-ASCII bytes are
+    decoded by the email package. Yields nothing for multipart parts.
+    """
+    if part.is_multipart():
+        return
+    chunk_size = max(4, chunk_size or config.DECODE_CHUNK_SIZE)
+    cte = str(part.get("content-transfer-encoding", "")).lower()
+    if isinstance(part, RecordMessage) and part.raw_body() is not None:
+        # Straight from the record: the body is never copied as a whole
+        payload = part.raw_body()
+    else:
+        payload = part.get_payload(decode=False)
+        # Non-ASCII payloads were charset-decoded by get_payload(): only the
+        # email package knows their original bytes, so it decodes them whole
+        if not isinstance(payload, str) or not payload.isascii():
+            payload = None
+    if payload is None or cte in ("x-uuencode", "uuencode", "uue", "x-uue"):
+        decoded = part.get_payload(decode=True) or b""
+        for start in range(0, len(decoded), chunk_size):
+            yield decoded[start:start + chunk_size]
+        return
+
+    if cte == "base64":
+        if sum(map(len, _base64_runs(_encoded_pieces(payload, chunk_size)))) % 4 == 1:
+            # Undecodable (one character too many): like the email package,
+            # return the input itself without its line breaks
+            decoded_pieces = (b"".join(p.splitlines()) for p in _encoded_pieces(payload, chunk_size))
+        else:
+            decoded_pieces = _decode_base64(_base64_runs(_encoded_pieces(payload, chunk_size)))
+    elif cte == "quoted-printable":
+        decoded_pieces = _decode_quoted_printable(_encoded_pieces(payload, chunk_size))
+    else:
+        decoded_pieces = _encoded_pieces(payload, chunk_size)
+    for piece in decoded_pieces:
+        if piece:
+            yield piece
+
+
 def extract_email_address(raw: Optional[str]) -> str:
     """Extract just the email address from a header like 'Name <addr>'."""
     if not raw:
@@ -0,0 +1,50 @@
+"""Per-message fingerprint cache, so a reparse only parses changed messages.
+
+For each source file, data/fingerprints/<source_file>.json maps
+"offset:length:hash" of every raw message to what parsing it produced: its
+summary (None if it did not parse) and its attachment blobs.
+"""
+
+import hashlib
+import json
+import os
+from typing import Dict
+
+from pec_parser import metrics
+import config
+
+
+@metrics.stage("fingerprint")
+def fingerprint(offset: int, length: int, raw) -> str:
+    """Cache key of a raw mbox record (bytes or memoryview)."""
+    digest = hashlib.blake2b(raw, digest_size=16).hexdigest()
+    return "{}:{}:{}".format(offset, length, digest)
+
+
+def _path(source_file: str) -> str:
+    return os.path.join(config.FINGERPRINTS_DIR, source_file + ".json")
+
+
+def load_fingerprints(source_file: str) -> Dict[str, Dict]:
+    path = _path(source_file)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+@metrics.stage("save_fingerprints")
+def save_fingerprints(source_file: str, entries: Dict[str, Dict]):
+    os.makedirs(config.FINGERPRINTS_DIR, exist_ok=True)
+    path = _path(source_file)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(entries, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp_path, path)
+
+
+def drop_fingerprints(source_file: str):
+    """Forget a source file's cache (its emails are gone)."""
+    path = _path(source_file)
+    if os.path.exists(path):
+        os.remove(path)
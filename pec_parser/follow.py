@@ -0,0 +1,209 @@
+"""Follow mode: ingest the messages appended to a growing mbox.
+
+A followed source keeps a checkpoint in its catalog entry ("follow": inode,
+size, byte offset and message count of what has been ingested). A poll
+parses only the bytes past the offset and appends the new emails to the
+existing source, its groups and the search index. If the file was replaced
+(new inode) or truncated, or the source was reparsed since, the whole file
+is reparsed with process_mbox instead.
+
+    python -m pec_parser.follow [mbox ...] [--interval SECONDS] [--once]
+"""
+
+import argparse
+import mmap
+import multiprocessing
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+from pec_parser.mbox_reader import process_mbox, _parse_record
+from pec_parser.mbox_scanner import iter_message_spans
+from pec_parser import gate
+from pec_parser.fingerprints import fingerprint, load_fingerprints, save_fingerprints
+from storage import email_batch, load_catalog, update_catalog
+from storage.json_store import load_group_index
+from storage.search_index import PostingsBatch
+from storage.blob_store import update_blob_refs
+import config
+
+
+def _find_source(catalog: Optional[Dict], source_file: str) -> Optional[Dict]:
+    for source in (catalog or {}).get("sources", []):
+        if source["source_file"] == source_file:
+            return source
+    return None
+
+
+def _complete_spans(mm, start: int, end: int) -> List[tuple]:
+    """Message spans in mm[start:end], without a trailing message that is
+    still being written (one not yet terminated by its blank line)."""
+    spans = list(iter_message_spans(mm, start, end))
+    if spans:
+        offset, length = spans[-1]
+        tail = mm[offset + length - 4:offset + length]
+        if not (tail.endswith(b"\n\n") or tail == b"\r\n\r\n"):
+            spans.pop()
+    return spans
+
+
+def _checkpoint(st, offset: int, messages: int) -> Dict:
+    return {"inode": st.st_ino, "size": st.st_size, "offset": offset, "messages": messages}
+
+
+def _reset(path: str, st) -> int:
+    """Reparse the whole file and start following it from its end."""
+    source_name = os.path.basename(path)
+    emails, _ = process_mbox(path)
+
+    spans = []
+    if st.st_size:
+        with open(path, "rb") as f:
+            with mmap.mmap(f.fileno(), st.st_size, access=mmap.ACCESS_READ) as mm:
+                spans = _complete_spans(mm, 0, st.st_size)
+    offset = spans[-1][0] + spans[-1][1] if spans else 0
+    checkpoint = _checkpoint(st, offset, len(spans))
+
+    def mark(catalog):
+        source = _find_source(catalog, source_name)
+        if source is not None:
+            source["follow"] = checkpoint
+
+    update_catalog(mark)
+    return len(emails)
+
+
+@gate.writing()
+def follow_once(mbox_path=None) -> int:
+    """Ingest what was appended to the mbox since the last call.
+
+    Returns the number of emails added (after a reset, the number of emails
+    in the reparsed file).
+    """
+    path = mbox_path or config.MBOX_PATH
+    source_name = os.path.basename(path)
+    st = os.stat(path)
+    source = _find_source(load_catalog(), source_name)
+    checkpoint = source.get("follow") if source is not None else None
+    if checkpoint is None or checkpoint["inode"] != st.st_ino or st.st_size < checkpoint["offset"]:
+        return _reset(path, st)
+    if st.st_size == checkpoint["offset"]:
+        return 0
+
+    summaries = []
+    postings = PostingsBatch()
+    blob_refs = {}
+    cache = {}
+    with open(path, "rb") as f, email_batch():
+        # Map only the size seen above: bytes written meanwhile wait for the next poll
+        with mmap.mmap(f.fileno(), st.st_size, access=mmap.ACCESS_READ) as mm, memoryview(mm) as view:
+            spans = _complete_spans(mm, checkpoint["offset"], st.st_size)
+            if not spans:
+                return 0
+            for i, (offset, length) in enumerate(spans, start=checkpoint["messages"]):
+                with view[offset:offset + length] as raw:
+                    summary = _parse_record(raw, i, offset, length, source_name, postings, blob_refs)
+                    blobs = blob_refs.get(summary.email_id, []) if summary is not None else []
+                    if summary is not None:
+                        summaries.append(summary)
+                    cache[fingerprint(offset, length, raw)] = {
+                        "summary": summary.to_dict() if summary is not None else None,
+                        "blobs": blobs,
+                    }
+    end = spans[-1][0] + spans[-1][1]
+    new_checkpoint = _checkpoint(st, end, checkpoint["messages"] + len(spans))
+
+    # As for uploads: blobs are referenced before the catalog commit
+    update_blob_refs(blob_refs)
+
+    def publish(catalog):
+        source = _find_source(catalog, source_name)
+        if source is None or source.get("follow") != checkpoint:
+            # A reparse, delete or another follower got there first
+            return None
+        known = {e["email_id"] for e in source["emails_summary"]}
+        fresh = []
+        for summary in summaries:
+            if summary.email_id not in known:
+                known.add(summary.email_id)
+                fresh.append(summary)
+        index = load_group_index(catalog)
+        index.assign(fresh)
+        source["emails_summary"].extend(s.to_dict() for s in fresh)
+        source["email_count"] = len(source["emails_summary"])
+        source["follow"] = new_checkpoint
+        catalog["groups"] = index.to_list()
+        return fresh
+
+    fresh = update_catalog(publish)
+    if fresh is None:
+        return 0
+    postings.flush()
+    # Keep the fingerprint cache complete, so a later reparse reuses these too
+    entries = load_fingerprints(source_name)
+    entries.update(cache)
+    save_fingerprints(source_name, entries)
+    return len(fresh)
+
+
+class Follower(threading.Thread):
+    """Background thread calling follow_once on each path every interval seconds."""
+
+    def __init__(self, paths: List[str], interval: float):
+        super().__init__(name="mbox-follow", daemon=True)
+        self.paths = list(paths)
+        self.interval = interval
+        self.errors: Dict[str, str] = {}
+        self._stopped = threading.Event()
+
+    def poll(self):
+        for path in self.paths:
+            try:
+                follow_once(path)
+            except Exception as e:
+                # Keep following the other files; the error is retried next poll
+                self.errors[path] = str(e) or e.__class__.__name__
+            else:
+                self.errors.pop(path, None)
+
+    def run(self):
+        while not self._stopped.is_set():
+            self.poll()
+            self._stopped.wait(self.interval)
+
+    def stop(self):
+        self._stopped.set()
+
+
+def start_follower() -> Optional[Follower]:
+    """Start following config.FOLLOW_PATHS (None if follow mode is off, or
+    in a worker process, e.g. a rebuild's, which re-imports the app)."""
+    if not config.FOLLOW_PATHS or multiprocessing.parent_process() is not None:
+        return None
+    follower = Follower(config.FOLLOW_PATHS, config.FOLLOW_INTERVAL)
+    follower.start()
+    return follower
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Ingest messages appended to growing mbox files.")
+    parser.add_argument("paths", nargs="*", help="mbox files to follow (default: MBOX_PATH)")
+    parser.add_argument("--interval", type=float, default=config.FOLLOW_INTERVAL,
+                        help="seconds between polls")
+    parser.add_argument("--once", action="store_true", help="poll once and exit")
+    args = parser.parse_args(argv)
+    paths = args.paths or [config.MBOX_PATH]
+
+    while True:
+        for path in paths:
+            added = follow_once(path)
+            if added:
+                print("{}: {} new email(s)".format(os.path.basename(path), added))
+        if args.once:
+            return
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""Writers gate: ingests write to DATA_DIR together, a full rebuild alone.
+
+Everything that writes emails, blobs or the catalog in the background or
+outside the catalog lock (ingest jobs, streamed uploads, reparses, the
+follower, backfill and on-access extraction, deletes) holds the gate
+shared for the duration of its write. A rebuild holds it exclusively from
+the moment it reads the catalog until the new snapshot is live: it waits
+for running writers to finish and keeps new ones waiting, so no write can
+land in the snapshot being replaced.
+"""
+
+import threading
+from contextlib import contextmanager
+from typing import Iterator
+
+_cond = threading.Condition()
+_writers = 0
+# A rebuild holds (or waits for) the gate; new writers wait until it is done
+_exclusive = False
+# Per thread: how many times the thread holds the gate shared (nested writers)
+_local = threading.local()
+
+
+def _depth() -> int:
+    return getattr(_local, "depth", 0)
+
+
+def enter(wait: bool = True) -> bool:
+    """Take the gate shared (again, if this thread holds it already). False
+    if wait is off and a rebuild holds or awaits the gate."""
+    global _writers
+    if _depth():
+        _local.depth += 1
+        return True
+    with _cond:
+        if _exclusive and not wait:
+            return False
+        while _exclusive:
+            _cond.wait()
+        _writers += 1
+    _local.depth = 1
+    return True
+
+
+def leave():
+    """Release one enter() of this thread."""
+    global _writers
+    _local.depth -= 1
+    if _local.depth:
+        return
+    with _cond:
+        _writers -= 1
+        _cond.notify_all()
+
+
+@contextmanager
+def writing(wait: bool = True) -> Iterator[bool]:
+    """Hold the gate shared for the block; yields False (without holding it)
+    if wait is off and a rebuild holds or awaits it."""
+    if not enter(wait):
+        yield False
+        return
+    try:
+        yield True
+    finally:
+        leave()
+
+
+@contextmanager
+def exclusive():
+    """Hold the gate alone for the block: wait for the writers to finish,
+    keep new ones waiting."""
+    global _exclusive
+    if _depth():
+        raise RuntimeError("a writer cannot rebuild")
+    with _cond:
+        while _exclusive:
+            _cond.wait()
+        _exclusive = True
+        while _writers:
+            _cond.wait()
+    try:
+        yield
+    finally:
+        with _cond:
+            _exclusive = False
+            _cond.notify_all()
+
+
+@contextmanager
+def alone() -> Iterator[bool]:
+    """Keep new writers waiting for the block; yields whether no other
+    thread holds the gate, i.e. nothing else is being written meanwhile."""
+    with _cond:
+        yield _writers == (1 if _depth() else 0)
@@ -2,15 +2,179 @@
 
 import difflib
 import hashlib
-from typing import List, Dict
+import math
+from collections import Counter
+from typing import Iterable, List, Dict, Optional
 
 from pec_parser.models import ParsedEmail, EmailGroup
 from pec_parser.subject_cleaner import clean_subject
+from pec_parser import metrics
 import config
 
 
+# q-gram length used for candidate blocking (bigrams keep the count bound
+# positive for every subject length at thresholds around 0.85)
+_QGRAM = 2
+
+
+# Longer q-grams, probed once the bigrams left to probe are stop-grams
+_LONG_QGRAM = 4
+
+
+def _qgrams(key: str, q: int = _QGRAM) -> Counter:
+    return Counter(key[i:i + q] for i in range(len(key) - q + 1))
+
+
+class SubjectMatcher:
+    """Index of group seed keys answering "which seed would absorb this key?".
+
+    find(key) returns the index of the earliest seed whose
+    SequenceMatcher(None, seed, key).ratio() >= threshold, exactly like the
+    pairwise greedy merge, but only runs ratio() on blocked candidates:
+
+    - length window: ratio <= 2 * min(la, lb) / (la + lb)
+    - bigram count filter: ratio >= t leaves at most D = T - 2 * ceil(t * T / 2)
+      insertions/deletions (T = la + lb), each destroying at most q q-grams,
+      so the strings share at least max(la, lb) - q + 1 - q * D q-grams
+    - prefix filter: a seed sharing >= tau q-grams must contain one of the
+      key's (n - tau + 1) rarest q-gram occurrences, so only those postings
+      are counted.
+
+    All of them are upper bounds on ratio, so no true match is ever skipped,
+    as long as the prefix holds no stop-gram (a q-gram in more than
+    stopgram_seeds seeds). Stop-gram postings are never counted, which bounds
+    the work per key: when the prefix reaches one, the candidates are the
+    seeds sharing min_shared of the key's non-stop bigram and 4-gram
+    occurrences instead, and a match sharing only frequent ones is missed.
+    """
+
+    def __init__(self, threshold: float, stopgram_seeds: Optional[int] = None,
+                 min_shared: Optional[int] = None):
+        self.threshold = threshold
+        self.stopgram_seeds = config.GROUPING_STOPGRAM_SEEDS if stopgram_seeds is None else stopgram_seeds
+        self.min_shared = config.GROUPING_MIN_SHARED_GRAMS if min_shared is None else min_shared
+        self.keys: List[str] = []
+        self._masks: List[int] = []
+        self._postings: Dict[str, List[int]] = {}
+        self._long_postings: Dict[str, List[int]] = {}
+        self._by_length: Dict[int, List[int]] = {}
+        # (q-gram, occurrence number) -> bit, so that popcount(a & b) is the
+        # multiset intersection size of two keys' q-grams
+        self._bits: Dict[tuple, int] = {}
+
+    def _mask(self, grams: Counter) -> int:
+        mask = 0
+        for gram, count in grams.items():
+            for n in range(count):
+                bit = self._bits.setdefault((gram, n), len(self._bits))
+                mask |= 1 << bit
+        return mask
+
+    def add(self, key: str) -> int:
+        """Register key as a new seed and return its index."""
+        idx = len(self.keys)
+        grams = _qgrams(key)
+        self.keys.append(key)
+        self._masks.append(self._mask(grams))
+        for gram in grams:
+            self._postings.setdefault(gram, []).append(idx)
+        for gram in _qgrams(key, _LONG_QGRAM):
+            self._long_postings.setdefault(gram, []).append(idx)
+        self._by_length.setdefault(len(key), []).append(idx)
+        return idx
+
+    def _length_ok(self, la: int, lb: int) -> bool:
+        total = la + lb
+        if total == 0:
+            return True
+        return 2.0 * min(la, lb) / total >= self.threshold - 1e-9
+
+    def _count_bound(self, la: int, lb: int) -> int:
+        """Minimum shared q-grams for ratio >= threshold (<= 0 means no bound)."""
+        total = la + lb
+        # One match of slack guards against float rounding in ratio()
+        min_matches = max(0, math.ceil(self.threshold * total / 2.0) - 1)
+        max_indels = total - 2 * min_matches
+        return max(la, lb) - _QGRAM + 1 - _QGRAM * max_indels
+
+    def _rare_matches(self, key: str, counts: Counter) -> List[int]:
+        """Seeds sharing min_shared of the key's non-stop bigram and longer
+        q-gram occurrences (counts holds the bigram ones)."""
+        for gram, count in _qgrams(key, _LONG_QGRAM).items():
+            postings = self._long_postings.get(gram)
+            if postings and len(postings) <= self.stopgram_seeds:
+                for _ in range(count):
+                    counts.update(postings)
+        return [i for i, c in counts.items() if c >= self.min_shared]
+
+    def find(self, key: str) -> Optional[int]:
+        """Index of the earliest seed similar enough to key, or None."""
+        la = len(key)
+        candidates = set()
+        bounds = {}
+        for lb, seeds in self._by_length.items():
+            if not self._length_ok(la, lb):
+                continue
+            bound = self._count_bound(la, lb)
+            if bound <= 0:
+                # Too short for the count filter: every seed is a candidate
+                candidates.update(seeds)
+            else:
+                bounds[lb] = bound
+
+        if bounds:
+            tau = min(bounds.values())
+            grams = _qgrams(key)
+            total = sum(grams.values())
+            # Count, in C, how many of the rarest occurrences each seed shares
+            counts = Counter()
+            covered = 0
+            stopped = False
+            for gram in sorted(grams, key=lambda g: len(self._postings.get(g, ()))):
+                if covered >= total - tau + 1:
+                    break
+                postings = self._postings.get(gram)
+                if postings and len(postings) > self.stopgram_seeds:
+                    # Stop-gram (and so are all the next ones)
+                    stopped = True
+                    break
+                if postings:
+                    for _ in range(grams[gram]):
+                        counts.update(postings)
+                covered += grams[gram]
+            if stopped:
+                blocked = self._rare_matches(key, counts)
+            else:
+                # Occurrences not probed can add at most (total - covered) shared q-grams
+                slack = total - covered
+                blocked = [i for i, c in counts.items() if c + slack >= tau]
+            mask = self._mask(grams)
+            for idx in blocked:
+                bound = bounds.get(len(self.keys[idx]))
+                if bound is not None and (mask & self._masks[idx]).bit_count() >= bound:
+                    candidates.add(idx)
+
+        # The key's side of the matcher is analysed once for all candidates
+        matcher = difflib.SequenceMatcher(None, "", key)
+        for idx in sorted(candidates):
+            matcher.set_seq1(self.keys[idx])
+            if matcher.quick_ratio() >= self.threshold and matcher.ratio() >= self.threshold:
+                return idx
+        return None
+
+
+def _timestamp_key(email):
+    """Chronological sort key (emails without a timestamp last)."""
+    timestamp = getattr(email, "timestamp", None)
+    return (timestamp is None, timestamp or 0)
+
+
+@metrics.stage("grouping")
 def group_emails(emails: List[ParsedEmail]) -> List[EmailGroup]:
-    """Group emails by cleaned subject similarity."""
+    """Group emails by cleaned subject similarity.
+
+    Accepts ParsedEmail or EmailSummary objects (subject, date, email_id).
+    """
     threshold = config.GROUPING_THRESHOLD
 
     # First, clean all subjects
@@ -25,29 +189,21 @@ def group_emails(emails: List[ParsedEmail]) -> List[EmailGroup]:
             exact_groups[key] = []
         exact_groups[key].append(email)
 
-    # Now merge fuzzy-similar groups
-    group_keys = list(exact_groups.keys())
-    merged = [False] * len(group_keys)
+    # Now merge fuzzy-similar groups: each key joins the earliest seed it
+    # matches, otherwise it becomes a new seed
+    matcher = SubjectMatcher(threshold)
     result_groups: List[List[ParsedEmail]] = []
 
-    for i, key_i in enumerate(group_keys):
-        if merged[i]:
-            continue
-        current = list(exact_groups[key_i])
-        merged[i] = True
-
-        for j in range(i + 1, len(group_keys)):
-            if merged[j]:
-                continue
-            ratio = difflib.SequenceMatcher(None, key_i, group_keys[j]).ratio()
-            if ratio >= threshold:
-                current.extend(exact_groups[group_keys[j]])
-                merged[j] = True
-
-        result_groups.append(current)
+    for key in exact_groups:
+        idx = matcher.find(key)
+        if idx is None:
+            matcher.add(key)
+            result_groups.append(list(exact_groups[key]))
+        else:
+            result_groups[idx].extend(exact_groups[key])
 
     # Sort groups: multi-email groups first, then singletons; within each, by date
-    result_groups.sort(key=lambda g: (-len(g), g[0].date))
+    result_groups.sort(key=lambda g: (-len(g), _timestamp_key(g[0])))
 
     # Build EmailGroup objects
     output = []
@@ -62,3 +218,100 @@ def group_emails(emails: List[ParsedEmail]) -> List[EmailGroup]:
         output.append(EmailGroup(group_id=group_id, label=label, email_ids=email_ids))
 
     return output
+
+
+class GroupIndex:
+    """Persistent global grouping, updated one email at a time.
+
+    Stored as a list of {group_id, label, key, keys, email_ids} dicts: key is
+    the seed subject new emails are compared against, keys are all exact
+    (lowercased clean) subjects merged into the group. Assigning emails in
+    order gives the same groups as group_emails() on the same emails.
+    """
+
+    def __init__(self, groups: Optional[List[Dict]] = None, threshold: Optional[float] = None):
+        self.threshold = config.GROUPING_THRESHOLD if threshold is None else threshold
+        self.groups: List[Dict] = [dict(g) for g in groups or []]
+        self._reindex()
+
+    def _reindex(self):
+        self._matcher = SubjectMatcher(self.threshold)
+        self._by_key: Dict[str, int] = {}
+        self._by_email: Dict[str, int] = {}
+        for idx, group in enumerate(self.groups):
+            self._matcher.add(group["key"])
+            for key in group["keys"]:
+                self._by_key[key] = idx
+            for eid in group["email_ids"]:
+                self._by_email[eid] = idx
+
+    def _new_group(self, key: str, label: str) -> int:
+        group_id = "group_" + hashlib.md5(key.encode("utf-8", errors="replace")).hexdigest()[:8]
+        self.groups.append({
+            "group_id": group_id,
+            "label": label,
+            "key": key,
+            "keys": [],
+            "email_ids": [],
+        })
+        self._matcher.add(key)
+        return len(self.groups) - 1
+
+    @metrics.stage("grouping")
+    def assign(self, emails: Iterable) -> List[str]:
+        """Place emails (ParsedEmail or EmailSummary) into groups.
+
+        Sets clean_subject on every email; emails already in the index are
+        left where they are. Returns the ids of the groups that changed.
+        """
+        changed = []
+        for email in emails:
+            email.clean_subject = clean_subject(email.subject)
+            if email.email_id in self._by_email:
+                continue
+            key = email.clean_subject.lower()
+            idx = self._by_key.get(key)
+            if idx is None:
+                idx = self._matcher.find(key)
+                if idx is None:
+                    idx = self._new_group(key, email.clean_subject)
+                self.groups[idx]["keys"].append(key)
+                self._by_key[key] = idx
+            group = self.groups[idx]
+            group["email_ids"].append(email.email_id)
+            # Use the longest clean subject as the group label
+            if len(email.clean_subject) > len(group["label"]):
+                group["label"] = email.clean_subject
+            self._by_email[email.email_id] = idx
+            if group["group_id"] not in changed:
+                changed.append(group["group_id"])
+        return changed
+
+    def remove(self, email_ids: Iterable[str], subjects: Dict[str, str]):
+        """Drop emails from their groups; groups left empty are deleted.
+
+        subjects maps the emails kept to their clean subjects: the groups that
+        lose members get their keys, seed key and label recomputed from the
+        members left (group ids are kept).
+        """
+        email_ids = set(email_ids) & set(self._by_email)
+        if not email_ids:
+            return
+        for idx in {self._by_email[eid] for eid in email_ids}:
+            group = self.groups[idx]
+            group["email_ids"] = [eid for eid in group["email_ids"] if eid not in email_ids]
+            kept = [subjects[eid] for eid in group["email_ids"] if eid in subjects]
+            if kept:
+                group["keys"] = list(dict.fromkeys(s.lower() for s in kept))
+                group["key"] = group["keys"][0]
+                # As assign(): the first of the longest clean subjects
+                group["label"] = max(kept, key=len)
+        self.groups = [g for g in self.groups if g["email_ids"]]
+        self._reindex()
+
+    def group_of(self, email_id: str) -> Optional[Dict]:
+        idx = self._by_email.get(email_id)
+        return self.groups[idx] if idx is not None else None
+
+    def to_list(self) -> List[Dict]:
+        return self.groups
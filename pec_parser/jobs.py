@@ -0,0 +1,207 @@
+"""Background ingest jobs: uploads are parsed by a bounded worker pool."""
+
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Optional
+
+from pec_parser.lazy import backfill_source
+from pec_parser import gate, metrics
+from pec_parser.mbox_reader import process_mbox_incremental
+from storage.blob_store import blobs_stranded, collect_blobs
+from storage.search_index import rebuild_search_index
+import config
+
+
+# Phases reported while an ingest runs, in order
+PHASES = ("scan", "parse", "attachments", "grouping", "save")
+
+
+class IngestJob:
+    """State of one queued/running/finished ingest, updated by its worker."""
+
+    def __init__(self, path: str, source_file: str):
+        self.job_id = "job_" + uuid.uuid4().hex[:12]
+        self.path = path
+        self.source_file = source_file
+        self.status = "queued"
+        self.phase: Optional[str] = None
+        self.processed = 0
+        self.total: Optional[int] = None
+        # Offset reached in the mbox and its size, while the message count is unknown
+        self.bytes_read: Optional[int] = None
+        self.bytes_total: Optional[int] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.parse_started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.error: Optional[str] = None
+        self.result: Optional[Dict] = None
+        self._lock = threading.Lock()
+
+    def progress(self, phase: str, processed: int = 0, total: Optional[int] = None,
+                 bytes_read: Optional[int] = None, bytes_total: Optional[int] = None):
+        """Progress callback handed to process_mbox_incremental."""
+        with self._lock:
+            if phase == "parse" and self.phase != "parse":
+                self.parse_started_at = time.time()
+            self.phase = phase
+            self.processed = processed
+            if total is not None:
+                self.total = total
+            if bytes_read is not None:
+                self.bytes_read = bytes_read
+            if bytes_total is not None:
+                self.bytes_total = bytes_total
+
+    def to_dict(self) -> Dict:
+        with self._lock:
+            now = self.finished_at or time.time()
+            throughput = None
+            eta = None
+            if self.parse_started_at is not None and self.processed:
+                elapsed = now - self.parse_started_at
+                if elapsed > 0:
+                    throughput = self.processed / elapsed
+                if self.phase == "parse" and self.total is not None and throughput:
+                    eta = max(0, self.total - self.processed) / throughput
+                elif self.phase == "parse" and self.bytes_total and self.bytes_read and elapsed > 0:
+                    # Message count unknown until the single scan ends: go by bytes
+                    eta = max(0, self.bytes_total - self.bytes_read) * elapsed / self.bytes_read
+            return {
+                "job_id": self.job_id,
+                "source_file": self.source_file,
+                "status": self.status,
+                "phase": self.phase,
+                "processed": self.processed,
+                "total": self.total,
+                "bytes_read": self.bytes_read,
+                "bytes_total": self.bytes_total,
+                "throughput": round(throughput, 2) if throughput is not None else None,
+                "eta_seconds": round(eta, 1) if eta is not None else None,
+                "elapsed_seconds": round(now - self.started_at, 2) if self.started_at else None,
+                "error": self.error,
+                "result": self.result,
+            }
+
+
+_lock = threading.Lock()
+_jobs: "OrderedDict[str, IngestJob]" = OrderedDict()
+_executor: Optional[ThreadPoolExecutor] = None
+# A single backfill thread, so extraction never competes with itself
+_backfill_executor: Optional[ThreadPoolExecutor] = None
+# The queued/running search index rebuild and blob collection, if any
+_index_rebuild: Optional[Future] = None
+_blob_collection: Optional[Future] = None
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=max(1, config.INGEST_JOB_WORKERS),
+                                           thread_name_prefix="ingest")
+        return _executor
+
+
+def _get_backfill_executor() -> ThreadPoolExecutor:
+    global _backfill_executor
+    with _lock:
+        if _backfill_executor is None:
+            _backfill_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="backfill")
+        return _backfill_executor
+
+
+def submit_backfill(source_file: str):
+    """Queue the body/attachment extraction of a lazily ingested source."""
+    return _get_backfill_executor().submit(backfill_source, source_file)
+
+
+def _rebuild_index():
+    with gate.writing():
+        rebuild_search_index()
+
+
+def submit_index_rebuild() -> Future:
+    """Queue a rebuild of the search index from the stored emails, unless
+    one is already queued or running (on the backfill thread)."""
+    global _index_rebuild
+    executor = _get_backfill_executor()
+    with _lock:
+        if _index_rebuild is None or _index_rebuild.done():
+            _index_rebuild = executor.submit(_rebuild_index)
+        return _index_rebuild
+
+
+def _collect_blobs():
+    with gate.exclusive():
+        collect_blobs()
+
+
+def submit_blob_collection() -> Future:
+    """Queue a collection of the blobs no email references (on the backfill
+    thread), unless one is already queued."""
+    global _blob_collection
+    executor = _get_backfill_executor()
+    with _lock:
+        if _blob_collection is None or _blob_collection.done():
+            _blob_collection = executor.submit(_collect_blobs)
+        return _blob_collection
+
+
+def _run(job: IngestJob):
+    job.started_at = time.time()
+    job.status = "running"
+    try:
+        with metrics.ingest_report() as report:
+            new_emails, entry = process_mbox_incremental(job.path, progress=job.progress)
+    except Exception as e:
+        job.error = str(e) or e.__class__.__name__
+        job.status = "failed"
+    else:
+        job.result = {
+            "new_emails": len(new_emails),
+            "source_id": entry["source_id"],
+            "source_file": entry["source_file"],
+            "uploaded_at": entry["uploaded_at"],
+            "report": report.to_dict(),
+        }
+        job.status = "done"
+        if config.LAZY_BODIES:
+            submit_backfill(entry["source_file"])
+    finally:
+        job.finished_at = time.time()
+        # Blobs of a failed ingest, or orphaned while other writers ran
+        if job.status == "failed" or blobs_stranded():
+            submit_blob_collection()
+
+
+def submit_ingest(path: str, source_file: str) -> IngestJob:
+    """Queue an uploaded mbox for ingestion and return its job."""
+    job = IngestJob(path, source_file)
+    with _lock:
+        _jobs[job.job_id] = job
+        # Forget the oldest finished jobs beyond the history limit
+        finished = [j for j in _jobs.values() if j.finished_at is not None]
+        for old in finished[:max(0, len(_jobs) - config.INGEST_JOB_HISTORY)]:
+            del _jobs[old.job_id]
+    _get_executor().submit(_run, job)
+    return job
+
+
+def get_job(job_id: str) -> Optional[IngestJob]:
+    with _lock:
+        return _jobs.get(job_id)
+
+
+def wait_for_job(job_id: str, timeout: Optional[float] = None) -> Optional[IngestJob]:
+    """Block until a job has finished (or timeout elapses); returns the job."""
+    deadline = None if timeout is None else time.monotonic() + timeout
+    job = get_job(job_id)
+    while job is not None and job.finished_at is None:
+        if deadline is not None and time.monotonic() >= deadline:
+            break
+        time.sleep(0.05)
+    return job
@@ -0,0 +1,227 @@
+"""Tier two of a lazy ingest: bodies and attachments of headers-only emails.
+
+A lazy ingest (config.LAZY_BODIES) stores each email with its headers, PEC
+metadata and attachment list only, marked body_pending, together with its
+byte span in the stored mbox. The full extraction happens on first access
+(ensure_extracted) or in a background backfill of the whole source.
+
+A lazy ingest of an mbox overlapping an earlier one does not move a pending
+email to the new file: the copy is added to the email's other_sources, and
+extraction reads the first copy still on disk, so deleting either source
+keeps the body recoverable.
+
+On-access extraction writes only the email's document (and its blobs): its
+blob references and search postings are deferred, and written in batches
+by the next backfill commit or a flush on a background timer
+(LAZY_COMMIT_DELAY), so serving a request never rewrites the global files.
+"""
+
+import atexit
+import mmap
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from pec_parser.attachment_handler import BlobWriter
+from pec_parser.mbox_scanner import message_skeleton, read_record
+from pec_parser.models import ParsedEmail
+from pec_parser.pec_extractor import parse_pec_message
+from pec_parser import gate
+from storage import email_batch, load_catalog, load_email, save_email
+from storage.search_index import add_postings, flush_search_index, merge_search_index
+from storage.blob_store import flush_blob_refs, update_blob_refs
+import config
+
+
+# Per email_id: serializes its on-access extraction (so concurrent requests
+# for one email extract it once) and add_location; entries are [lock, users]
+_extract_locks: Dict[str, list] = {}
+_extract_locks_mutex = threading.Lock()
+# Pending flush of the deferred commits of on-access extractions
+_flush_lock = threading.Lock()
+_flush_timer: Optional[threading.Timer] = None
+
+
+@contextmanager
+def _extract_lock(email_id: str) -> Iterator[None]:
+    """Hold the extraction lock of one email (other emails are not blocked)."""
+    with _extract_locks_mutex:
+        entry = _extract_locks.setdefault(email_id, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _extract_locks_mutex:
+            entry[1] -= 1
+            if not entry[1]:
+                del _extract_locks[email_id]
+
+
+def source_path(source_file: str) -> str:
+    """Path of the mbox a source was ingested from."""
+    if source_file == os.path.basename(config.MBOX_PATH):
+        return config.MBOX_PATH
+    for path in config.FOLLOW_PATHS:
+        if os.path.basename(path) == source_file:
+            return path
+    return os.path.join(config.UPLOADS_DIR, source_file)
+
+
+def locations(doc: Dict) -> List[Tuple[str, int, int]]:
+    """(source_file, offset, length) of every copy of a pending email's
+    record, the one it was first stored from first."""
+    spans = [(doc.get("source_file") or "", doc["source_offset"], doc["source_length"])]
+    spans.extend(tuple(span) for span in doc.get("other_sources") or [])
+    return spans
+
+
+def add_location(email_id: str, source_file: str, offset: int, length: int) -> bool:
+    """Record another copy of the record of a stored pending email.
+
+    Returns False if the email is not stored pending (absent, or already
+    extracted), in which case nothing is changed.
+    """
+    with _extract_lock(email_id):
+        doc = load_email(email_id)
+        if doc is None or not doc.get("body_pending"):
+            return False
+        span = (source_file, offset, length)
+        if span not in locations(doc):
+            email = ParsedEmail.from_dict(doc)
+            email.other_sources.append(list(span))
+            save_email(email)
+        return True
+
+
+def _extract(doc: Dict, raw, location, postings, blob_refs) -> Optional[ParsedEmail]:
+    """Fully parse the raw record of a pending email read from location
+    (blobs are written, the document is not saved). None if the record no
+    longer holds that email, e.g. because the file was replaced."""
+    msg = message_skeleton(raw)
+    stub = parse_pec_message(msg, 0, headers_only=True)
+    if stub is None or stub.email_id != doc["email_id"]:
+        return None
+    source_file, offset, length = location
+    parsed = parse_pec_message(msg, 0, source_file=source_file, attachment_sink=BlobWriter)
+    parsed.source_offset = offset
+    parsed.source_length = length
+    add_postings(postings, parsed)
+    blob_refs[parsed.email_id] = [a.blob for a in parsed.attachments if a.blob]
+    return parsed
+
+
+def _commit(parsed: List[ParsedEmail], postings, blob_refs, defer: bool = False):
+    # Same order as an ingest: blob references first, then the documents
+    update_blob_refs(blob_refs, defer=defer)
+    with email_batch():
+        for email in parsed:
+            save_email(email)
+    merge_search_index(postings, defer=defer)
+    if defer:
+        _schedule_flush()
+
+
+def flush_deferred():
+    """Write the blob references and postings deferred by on-access
+    extractions. The caller holds the writers gate (shared or exclusive)."""
+    flush_blob_refs()
+    flush_search_index()
+
+
+def _schedule_flush():
+    global _flush_timer
+    with _flush_lock:
+        if _flush_timer is None:
+            _flush_timer = threading.Timer(config.LAZY_COMMIT_DELAY, _flush_in_background)
+            _flush_timer.daemon = True
+            _flush_timer.start()
+
+
+def _flush_in_background():
+    global _flush_timer
+    with _flush_lock:
+        _flush_timer = None
+    with gate.writing(wait=False) as entered:
+        # A rebuild flushes them itself before replacing the data
+        if entered:
+            flush_deferred()
+
+
+atexit.register(flush_deferred)
+
+
+def ensure_extracted(email_id: str) -> Optional[Dict]:
+    """Load an email document, extracting its body and attachments first if
+    it is still pending, from the first copy of its record still on disk.
+    A pending email none of whose mboxes holds it any more is returned as is."""
+    doc = load_email(email_id)
+    if doc is None or not doc.get("body_pending"):
+        return doc
+    with gate.writing(wait=False) as entered, _extract_lock(email_id):
+        if not entered:
+            # A rebuild is replacing the data: serve the tier-one record
+            return doc
+        doc = load_email(email_id)
+        if doc is None or not doc.get("body_pending"):
+            return doc
+        for location in locations(doc):
+            source_file, offset, length = location
+            try:
+                raw = read_record(source_path(source_file), offset, length)
+            except OSError:
+                continue
+            postings, blob_refs = {}, {}
+            parsed = _extract(doc, raw, location, postings, blob_refs)
+            if parsed is not None:
+                _commit([parsed], postings, blob_refs, defer=True)
+                return parsed.to_dict()
+        return doc
+
+
+def backfill_source(source_file: str) -> int:
+    """Extract every still-pending email of a source, BACKFILL_BATCH at a time.
+
+    Returns the number of emails extracted.
+    """
+    source = next((s for s in (load_catalog() or {}).get("sources", [])
+                   if s["source_file"] == source_file), None)
+    path = source_path(source_file)
+    if source is None or not os.path.exists(path) or os.path.getsize(path) == 0:
+        return 0
+    email_ids = [e["email_id"] for e in source.get("emails_summary", [])]
+
+    extracted = 0
+    batch_size = max(1, config.BACKFILL_BATCH)
+    with open(path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, memoryview(mm) as view:
+            for start in range(0, len(email_ids), batch_size):
+                with gate.writing():
+                    extracted += _backfill_batch(source_file, view, email_ids[start:start + batch_size])
+    return extracted
+
+
+def _backfill_batch(source_file: str, view, email_ids: List[str]) -> int:
+    """Extract the pending emails among email_ids that have a copy in
+    source_file (a memoryview of its mapping) and commit them. Returns how many."""
+    parsed, postings, blob_refs = [], {}, {}
+    for email_id in email_ids:
+        doc = load_email(email_id)
+        if doc is None or not doc.get("body_pending"):
+            continue
+        location = next((span for span in locations(doc) if span[0] == source_file), None)
+        if location is None:
+            continue
+        _, offset, length = location
+        with view[offset:offset + length] as raw:
+            email = _extract(doc, raw, location, postings, blob_refs)
+        if email is not None:
+            parsed.append(email)
+        if config.BACKFILL_PAUSE > 0:
+            # Low priority: leave room to the requests being served
+            time.sleep(config.BACKFILL_PAUSE)
+    if parsed:
+        _commit(parsed, postings, blob_refs)
+    return len(parsed)
@@ -1,121 +1,694 @@
 """Orchestrator: parse mbox file -> extract all data -> save to JSON."""
 
-import mailbox
+import mmap
 import os
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import fields
 from datetime import datetime
+from typing import Dict, List, NamedTuple, Optional, Tuple
 
-from pec_parser.pec_extractor import parse_pec_message, _find_pec_parts
-from pec_parser.grouper import group_emails
-from pec_parser.attachment_handler import save_attachments
-from storage.json_store import save_catalog, load_catalog, generate_source_id
+from pec_parser.pec_extractor import parse_pec_message
+from pec_parser.mbox_scanner import (
+    MboxSplitter, scan_mbox, iter_message_spans, message_skeleton,
+)
+from pec_parser.attachment_handler import BlobWriter
+from pec_parser.fingerprints import fingerprint, load_fingerprints, save_fingerprints
+from pec_parser.dedup import (
+    digest_of, file_emails, file_hash, forget_emails, lookup, message_hash, new_file_hash, record,
+)
+from pec_parser.models import EmailSummary
+from pec_parser.lazy import add_location
+from pec_parser import gate, metrics
+from storage import delete_emails, email_batch, load_email, save_email, update_catalog
+from storage.json_store import generate_source_id, group_subjects, load_group_index
+from storage.search_index import PostingsBatch
+from storage.blob_store import update_blob_refs
 import config
 
 
-def _build_source_entry(source_id, source_file, emails, uploaded_at=None):
-    """Build a source dict from parsed emails."""
-    groups = group_emails(emails)
+def _build_source_entry(source_id, source_file, summaries, uploaded_at=None):
+    """Build a source dict from email summaries (grouping lives in the global GroupIndex)."""
     if uploaded_at is None:
         uploaded_at = datetime.now().strftime("%d/%m/%Y %H:%M")
     return {
         "source_id": source_id,
         "source_file": source_file,
         "uploaded_at": uploaded_at,
-        "email_count": len(emails),
-        "groups": [g.to_dict() for g in groups],
-        "emails_summary": [
-            {
-                "email_id": e.email_id,
-                "subject": e.subject,
-                "sender": e.sender,
-                "date": e.date,
-                "clean_subject": e.clean_subject,
-                "attachment_count": len(e.attachments),
-                "pec_provider": e.pec_provider,
-                "source_file": e.source_file,
-            }
-            for e in emails
-        ],
-        "_emails": emails,
+        "email_count": len(summaries),
+        "emails_summary": [s.to_dict() for s in summaries],
     }
 
 
-def _parse_mbox_emails(mbox_path):
-    """Parse an mbox file and return list of ParsedEmail + source_name."""
-    source_name = os.path.basename(mbox_path)
-    mbox = mailbox.mbox(mbox_path)
+def _link_known(email_id, source_name, blob_refs) -> Optional[EmailSummary]:
+    """Summary of an email already stored fully extracted, listed under
+    source_name (None if it is not): the message is linked, not parsed.
+
+    Its blobs are recorded in blob_refs again, which keeps refs self-healing.
+    """
+    doc = load_email(email_id)
+    if doc is None or doc.get("body_pending"):
+        return None
+    attachments = doc.get("attachments") or []
+    blob_refs[email_id] = [a["blob"] for a in attachments if a.get("blob")]
+    summary = EmailSummary.from_dict(doc)
+    summary.attachment_count = len(attachments)
+    summary.source_file = source_name
+    metrics.count("linked")
+    return summary
+
+
+def _link_hash(known, digest, source_name, blob_refs) -> Tuple[bool, Optional[EmailSummary]]:
+    """(True, summary) for a message whose hash the dedup index (looked up
+    with known, see pec_parser.dedup.lookup) maps to an email stored fully
+    extracted (summary None: a message that did not parse); (False, None) if
+    the message must be parsed."""
+    if known is None:
+        return False, None
+    found, email_id = known(digest)
+    if not found:
+        return False, None
+    if email_id is None:
+        return True, None
+    summary = _link_known(email_id, source_name, blob_refs)
+    return summary is not None, summary
+
+
+def _parse_record(raw, index, offset, length, source_name, postings, blob_refs,
+                  headers_only=False, link_known=False):
+    """Parse one raw mbox record and write it out (email JSON + attachment blobs).
+
+    The message's tokens are added to postings (a PostingsBatch) and its
+    blob digests to blob_refs; only the slim EmailSummary is returned (None if the message
+    could not be parsed). headers_only stores a tier-one record instead
+    (headers and attachment list, body_pending), see pec_parser.lazy.
+
+    With headers_only or link_known, an email already stored fully extracted
+    (same email_id, i.e. Message-ID, from a header-only skeleton parse) is
+    linked instead of being parsed and written again. With headers_only, an
+    email stored pending keeps its record and gets this one as another copy
+    (see pec_parser.lazy).
+    """
+    started = time.perf_counter()
+    metrics.count("messages")
+    metrics.count("bytes_read", length)
+    parsed = None
+    with metrics.stage("mime_parse"):
+        msg = message_skeleton(raw)
+    if headers_only or link_known:
+        parsed = parse_pec_message(msg, index, source_file=source_name,
+                                   attachment_sink=BlobWriter, headers_only=True)
+        if parsed is not None:
+            summary = _link_known(parsed.email_id, source_name, blob_refs)
+            if summary is None and headers_only and add_location(parsed.email_id, source_name,
+                                                                 offset, length):
+                # Pending from an earlier source: keep its record, add this copy
+                summary = parsed.summary()
+            if summary is not None:
+                metrics.message(time.perf_counter() - started, index, parsed.email_id)
+                return summary
+    if not headers_only:
+        parsed = parse_pec_message(msg, index, source_file=source_name, attachment_sink=BlobWriter)
+    if parsed is None:
+        metrics.message(time.perf_counter() - started, index)
+        return None
+    parsed.source_offset = offset
+    parsed.source_length = length
+    with metrics.stage("save_email"):
+        save_email(parsed)
+    with metrics.stage("index_tokens"):
+        postings.add(parsed)
+    blob_refs[parsed.email_id] = [a.blob for a in parsed.attachments if a.blob]
+    metrics.message(time.perf_counter() - started, index, parsed.email_id)
+    return parsed.summary()
+
+
+def _ingest_workers():
+    workers = config.INGEST_WORKERS
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+    return workers
+
+
+def _init_worker(settings):
+    """Give a worker process the parent's config (paths may have been overridden)."""
+    for name, value in settings.items():
+        setattr(config, name, value)
+
+
+def _parse_shard(mbox_path, source_name, first_index, spans, headers_only=False,
+                 link_known=False):
+    """Worker entry point: parse a run of (offset, length) spans.
+
+    Returns (results, postings, blob_refs) for the shard, results holding
+    the EmailSummary (or None) of each span and postings the token -> ids
+    mapping of the parsed ones.
+    """
+    results = []
+    postings = PostingsBatch(autoflush=False)
+    blob_refs = {}
+    with open(mbox_path, "rb") as f, email_batch():
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, memoryview(mm) as view:
+            for i, (offset, length) in enumerate(spans, start=first_index):
+                with view[offset:offset + length] as raw:
+                    results.append(_parse_record(raw, i, offset, length, source_name, postings,
+                                                 blob_refs, headers_only, link_known))
+    return results, postings.postings, blob_refs
+
+
+def _parse_shard_measured(*args):
+    """_parse_shard in a worker process: its result, plus the metrics it
+    recorded (metrics.IngestReport.state()) for the parent to merge."""
+    # Memory is profiled in the parent only (see pec_parser.memory)
+    with metrics.ingest_report(memory=False) as report:
+        result = _parse_shard(*args)
+    return result, report.state()
+
+
+@metrics.stage("scan")
+def _message_spans(mbox_path):
+    """(offset, length) of every message in the mbox."""
+    with open(mbox_path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return []
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return list(iter_message_spans(mm))
+
+
+class _ParsedMbox(NamedTuple):
+    summaries: List[EmailSummary]
+    source_name: str
+    # Postings not merged into the search index yet
+    postings: PostingsBatch
+    blob_refs: Dict[str, List[str]]
+    # fingerprint -> (summary or None, blobs) of every message, if a cache was given
+    fingerprints: Dict[str, Tuple[Optional[EmailSummary], List[str]]]
+    # message hash -> email_id (None if it did not parse) of every message,
+    # if a dedup index was given
+    hashes: Dict[str, Optional[str]]
+
+
+_SUMMARY_FIELDS = {f.name for f in fields(EmailSummary)}
+
+
+class _Ingest:
+    """Accumulates per-message results in mbox order, reusing cached ones
+    and linking known ones."""
+
+    def __init__(self, source_name, cache, progress, headers_only=False, known=None):
+        self.source_name = source_name
+        self.cache = cache
+        self.progress = progress
+        self.headers_only = headers_only
+        # Lookup of message hashes in the dedup index (None: no dedup)
+        self.known = known
+        self.summaries = []
+        self.postings = PostingsBatch()
+        self.blob_refs = {}
+        self.fingerprints = {}
+        self.hashes = {}
+        self.done = 0
+        # Bytes of the mbox scanned so far, and its size (serial path only)
+        self.position = None
+        self.size = None
+
+    def cached(self, key) -> bool:
+        """Whether the cache holds a usable result for key (entries written
+        before a summary field existed are parsed again)."""
+        if self.cache is None or key not in self.cache:
+            return False
+        summary = self.cache[key]["summary"]
+        return summary is None or _SUMMARY_FIELDS.issubset(summary)
+
+    def reuse(self, key, report=True) -> bool:
+        """Take a message's result from the cache; False on a miss."""
+        if not self.cached(key):
+            return False
+        entry = self.cache[key]
+        metrics.count("reused")
+        summary = EmailSummary.from_dict(entry["summary"]) if entry["summary"] else None
+        self.add(key, summary, entry["blobs"], report)
+        return True
+
+    def link(self, digest):
+        return _link_hash(self.known, digest, self.source_name, self.blob_refs)
+
+    def blobs(self, summary) -> List[str]:
+        return self.blob_refs.get(summary.email_id, []) if summary is not None else []
+
+    def add(self, key, summary, blobs, report=True, digest=None):
+        if digest is not None:
+            self.hashes[digest] = summary.email_id if summary is not None else None
+        if summary is not None:
+            self.summaries.append(summary)
+            if not self.headers_only:
+                # Re-recording the blobs of reused messages keeps refs self-healing
+                self.blob_refs[summary.email_id] = blobs
+        if key is not None:
+            self.fingerprints[key] = (summary, blobs)
+        self.done += 1
+        if report and self.progress is not None:
+            self.progress("parse", self.done, None, self.position, self.size)
+
+    def result(self) -> _ParsedMbox:
+        return _ParsedMbox(self.summaries, self.source_name, self.postings,
+                           self.blob_refs, self.fingerprints, self.hashes)
+
+
+def _parse_mbox_emails_parallel(mbox_path, ingest, workers):
+    """Shard the mbox by message offsets and parse the shards in a process pool.
+
+    Only messages missing from the fingerprint cache and not linked by hash
+    are sharded; results are merged back in mbox order, so the output is
+    identical to the serial path.
+    """
+    spans = _message_spans(mbox_path)
+    if ingest.progress is not None:
+        ingest.progress("parse", 0, len(spans))
+
+    keys = [None] * len(spans)
+    digests = [None] * len(spans)
+    linked: Dict[int, Optional[EmailSummary]] = {}
+    if ingest.cache is not None or ingest.known is not None:
+        with open(mbox_path, "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, memoryview(mm) as view:
+                for i, (offset, length) in enumerate(spans):
+                    with view[offset:offset + length] as raw:
+                        if ingest.cache is not None:
+                            keys[i] = fingerprint(offset, length, raw)
+                            if ingest.cached(keys[i]):
+                                continue
+                        if ingest.known is not None:
+                            digests[i] = digest_of(keys[i]) if keys[i] else message_hash(raw)
+                            hit, summary = ingest.link(digests[i])
+                            if hit:
+                                linked[i] = summary
+    missing = [i for i, key in enumerate(keys)
+               if i not in linked and (key is None or not ingest.cached(key))]
+    missing_spans = [spans[i] for i in missing]
+
+    parsed: Dict[int, Optional[EmailSummary]] = {}
+    shard_size = max(1, config.INGEST_SHARD_SIZE)
+    shards = [(start, missing_spans[start:start + shard_size])
+              for start in range(0, len(missing_spans), shard_size)]
+
+    def collect(start, shard_result):
+        results, postings, blob_refs = shard_result
+        for n, summary in enumerate(results):
+            parsed[missing[start + n]] = summary
+        if ingest.progress is not None:
+            ingest.progress("parse", len(parsed), None)
+        ingest.postings.update(postings, sum(1 for summary in results if summary is not None))
+        ingest.blob_refs.update(blob_refs)
+
+    if len(shards) <= 1:
+        for start, shard in shards:
+            collect(start, _parse_shard(mbox_path, ingest.source_name, start, shard,
+                                        ingest.headers_only, ingest.known is not None))
+    else:
+        settings = {name: getattr(config, name) for name in dir(config) if name.isupper()}
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(settings,)) as pool:
+            futures = [
+                (start, pool.submit(_parse_shard_measured, mbox_path, ingest.source_name, start,
+                                    shard, ingest.headers_only, ingest.known is not None))
+                for start, shard in shards
+            ]
+            for start, future in futures:
+                result, measured = future.result()
+                metrics.merge(measured)
+                collect(start, result)
+
+    for i, key in enumerate(keys):
+        if i in parsed or i in linked:
+            summary = parsed[i] if i in parsed else linked[i]
+            ingest.add(key, summary, ingest.blobs(summary), report=False, digest=digests[i])
+        else:
+            ingest.reuse(key, report=False)
+    if ingest.progress is not None:
+        ingest.progress("parse", len(spans), None)
 
-    emails = []
-    for i, msg in enumerate(mbox):
-        parsed = parse_pec_message(msg, i, source_file=source_name)
-        if parsed is None:
-            continue
 
-        _, inner_msg = _find_pec_parts(msg)
-        if inner_msg is not None:
-            save_attachments(inner_msg, parsed.email_id)
+def _parse_mbox_emails(mbox_path, progress=None, cache=None, headers_only=False,
+                       known=None) -> _ParsedMbox:
+    """Parse an mbox file, streaming each email to disk as soon as it is parsed.
 
-        emails.append(parsed)
+    Returns a _ParsedMbox: the EmailSummary list, the source file name, and
+    the search-index postings and attachment blob references collected on
+    the way. Full ParsedEmail objects are never accumulated, and postings are
+    merged into the index in batches as they fill up (the rest is merged by
+    the caller once the emails are published).
 
-    mbox.close()
-    return emails, source_name
+    cache, if given, maps message fingerprints to earlier results
+    (pec_parser.fingerprints): those messages are not parsed again, and the
+    fingerprints of all messages are returned for the next run.
 
+    progress, if given, is called as progress(phase, processed, total,
+    bytes_read, bytes_total) with phase "scan" then "parse". The serial path
+    scans the mbox once, so the number of messages (total) is only known at
+    the end; meanwhile bytes_read / bytes_total (the offset reached in the
+    file and its size) tell how far the parse is.
 
-def process_mbox(mbox_path=None):
+    headers_only stores tier-one records (see _parse_record); do not combine
+    it with a cache, whose entries must describe fully extracted emails.
+
+    known, if given, looks message hashes up in the dedup index
+    (pec_parser.dedup.lookup): messages whose email is already stored fully
+    extracted are linked instead of parsed, and the hashes of all messages
+    are returned for the index.
+    """
+    ingest = _Ingest(os.path.basename(mbox_path), cache, progress, headers_only, known)
+    if progress is not None:
+        progress("scan", 0, None)
+
+    workers = _ingest_workers()
+    if workers > 1:
+        _parse_mbox_emails_parallel(mbox_path, ingest, workers)
+        return ingest.result()
+
+    ingest.position, ingest.size = 0, os.path.getsize(mbox_path)
+    if progress is not None:
+        progress("parse", 0, None, ingest.position, ingest.size)
+
+    with email_batch():
+        for i, record in enumerate(metrics.timed(scan_mbox(mbox_path), "scan")):
+            ingest.position = record.offset + record.length
+            key = None
+            digest = None
+            if cache is not None:
+                key = fingerprint(record.offset, record.length, record.data)
+                if ingest.reuse(key):
+                    continue
+            if known is not None:
+                digest = digest_of(key) if key else message_hash(record.data)
+                hit, summary = ingest.link(digest)
+                if hit:
+                    ingest.add(key, summary, ingest.blobs(summary), digest=digest)
+                    continue
+            summary = _parse_record(record.data, i, record.offset, record.length,
+                                    ingest.source_name, ingest.postings, ingest.blob_refs,
+                                    headers_only, known is not None)
+            ingest.add(key, summary, ingest.blobs(summary), digest=digest)
+
+    if progress is not None:
+        progress("parse", ingest.done, ingest.done, ingest.size, ingest.size)
+    return ingest.result()
+
+
+@gate.writing()
+def process_mbox(mbox_path=None, reuse=True):
     """Parse the mbox file, create a source entry, save catalog.
 
+    Returns (summaries, sources).
+
     If a catalog already exists and contains a source with the same source_file,
     it gets updated. Otherwise a new source is appended.
+
+    With reuse, messages whose fingerprint (offset, length, hash) is
+    unchanged since the last run are taken from the fingerprint cache instead
+    of being parsed again; emails that vanished from the file are removed.
     """
     path = mbox_path or config.MBOX_PATH
-    emails, source_name = _parse_mbox_emails(path)
-
-    catalog = load_catalog()
-    existing_sources = catalog.get("sources", []) if catalog else []
-
-    # Check if source_file already exists
-    found = False
-    for i, s in enumerate(existing_sources):
-        if s["source_file"] == source_name:
-            source_id = s["source_id"]
-            uploaded_at = s["uploaded_at"]
-            existing_sources[i] = _build_source_entry(
-                source_id, source_name, emails, uploaded_at
-            )
-            found = True
-            break
+    source_name = os.path.basename(path)
+    cache = load_fingerprints(source_name) if reuse else {}
+    parsed = _parse_mbox_emails(path, cache=cache)
+    emails = parsed.summaries
 
-    if not found:
-        source_id = generate_source_id(source_name)
+    def publish(catalog):
+        existing_sources = catalog["sources"]
+        index = load_group_index(catalog)
+
+        # Emails that disappear from a refreshed source and no other source keeps
+        stale_ids = set()
+        for s in existing_sources:
+            if s["source_file"] == source_name:
+                stale_ids.update(e["email_id"] for e in s.get("emails_summary", []))
+        for s in existing_sources:
+            if s["source_file"] != source_name:
+                stale_ids.difference_update(e["email_id"] for e in s.get("emails_summary", []))
+        stale_ids.difference_update(e.email_id for e in emails)
+        if stale_ids:
+            kept = [e for s in existing_sources if s["source_file"] != source_name
+                    for e in s.get("emails_summary", [])]
+            index.remove(stale_ids, group_subjects(kept + [e.to_dict() for e in emails]))
+        index.assign(emails)
+
+        # Check if source_file already exists
+        found = False
+        for i, s in enumerate(existing_sources):
+            if s["source_file"] == source_name:
+                existing_sources[i] = _build_source_entry(
+                    s["source_id"], source_name, emails, s["uploaded_at"]
+                )
+                found = True
+                break
+
+        if not found:
+            source_id = generate_source_id(source_name)
+            entry = _build_source_entry(source_id, source_name, emails)
+            existing_sources.append(entry)
+
+        catalog["groups"] = index.to_list()
+        return stale_ids, existing_sources
+
+    # Read, regroup and write back in one storage transaction
+    stale_ids, sources = update_catalog(publish)
+    delete_emails(stale_ids)
+    parsed.postings.flush(remove_ids=stale_ids)
+    update_blob_refs(parsed.blob_refs, remove_ids=stale_ids)
+    save_fingerprints(source_name, {
+        key: {"summary": summary.to_dict() if summary is not None else None, "blobs": blobs}
+        for key, (summary, blobs) in parsed.fingerprints.items()
+    })
+    # Uploads overlapping this file can then link its messages by hash
+    forget_emails(stale_ids)
+    record({
+        digest_of(key): summary.email_id if summary is not None else None
+        for key, (summary, _) in parsed.fingerprints.items()
+    })
+    return emails, sources
+
+
+def _publish_new_source(source_name, emails, postings, blob_refs, report):
+    """Record blobs, group and commit freshly parsed emails as a NEW source.
+
+    Returns the saved source entry.
+    """
+    # Blob references are recorded before the catalog commit: if the commit
+    # fails the blobs are only kept too long, never collected too early
+    report("attachments", len(emails))
+    update_blob_refs(blob_refs)
+
+    source_id = generate_source_id(source_name)
+
+    def publish(catalog):
+        # Only the new emails are placed; existing groups are not recomputed
+        report("grouping", len(emails))
+        index = load_group_index(catalog)
+        index.assign(emails)
+        report("save", len(emails))
         entry = _build_source_entry(source_id, source_name, emails)
-        existing_sources.append(entry)
+        catalog["sources"].append(entry)
+        catalog["groups"] = index.to_list()
+        return entry
+
+    # The new source becomes visible only when this commits
+    entry = update_catalog(publish)
+    postings.flush()
+    return entry
+
 
-    save_catalog(existing_sources)
-    return emails, existing_sources
+def _link_file(email_ids, source_name, blob_refs) -> Optional[List[EmailSummary]]:
+    """Summaries of the emails of an already ingested file, all linked to
+    source_name (None unless every one is still stored fully extracted)."""
+    summaries = []
+    for email_id in email_ids:
+        summary = _link_known(email_id, source_name, blob_refs)
+        if summary is None:
+            return None
+        summaries.append(summary)
+    return summaries
 
 
-def process_mbox_incremental(mbox_path):
+@gate.writing()
+def process_mbox_incremental(mbox_path, progress=None, lazy=None, dedup=None):
     """Parse a new mbox, append as a NEW source to the catalog.
 
-    Returns (new_emails, source_entry).
+    Returns (new_summaries, source_entry). progress, if given, is called as
+    progress(phase, processed, total) through the phases scan, parse,
+    attachments, grouping and save (parse reports also pass bytes_read and
+    bytes_total, see _parse_mbox_emails).
+
+    lazy (default config.LAZY_BODIES) ingests headers only: bodies and
+    attachments are extracted later by pec_parser.lazy.
+
+    dedup (default config.DEDUP_UPLOADS) links messages already stored
+    instead of parsing them (see pec_parser.dedup); if the whole file was
+    ingested before, no message is read at all.
     """
-    emails, source_name = _parse_mbox_emails(mbox_path)
+    def report(phase, processed=0, total=None):
+        if progress is not None:
+            progress(phase, processed, total)
 
-    source_id = generate_source_id(source_name)
-    entry = _build_source_entry(source_id, source_name, emails)
+    if lazy is None:
+        lazy = config.LAZY_BODIES
+    if dedup is None:
+        dedup = config.DEDUP_UPLOADS
+    if not dedup:
+        parsed = _parse_mbox_emails(mbox_path, progress, headers_only=lazy)
+        entry = _publish_new_source(parsed.source_name, parsed.summaries, parsed.postings,
+                                    parsed.blob_refs, report)
+        return parsed.summaries, entry
+
+    source_name = os.path.basename(mbox_path)
+    report("scan")
+    file_digest = file_hash(mbox_path)
+    blob_refs = {}
+    emails = None
+    email_ids = file_emails(file_digest)
+    if email_ids is not None:
+        emails = _link_file(email_ids, source_name, blob_refs)
+    if emails is not None:
+        report("parse", len(emails), len(emails))
+        entry = _publish_new_source(source_name, emails, PostingsBatch(), blob_refs, report)
+        return emails, entry
+
+    parsed = _parse_mbox_emails(mbox_path, progress, headers_only=lazy, known=lookup)
+    entry = _publish_new_source(parsed.source_name, parsed.summaries, parsed.postings,
+                                parsed.blob_refs, report)
+    record(parsed.hashes, file_digest, [s.email_id for s in parsed.summaries])
+    return parsed.summaries, entry
+
+
+class StreamingIngest:
+    """Ingest an mbox while it is still being received.
+
+    feed() appends each chunk to save_path and hands every completed message
+    to a parser thread through a bounded queue (so a slow parser throttles
+    the reader instead of buffering the upload). finish() waits for the last
+    message and publishes a NEW source like process_mbox_incremental
+    (headers only, if lazy or config.LAZY_BODIES; linking messages already
+    stored, if dedup or config.DEDUP_UPLOADS). The parser thread records its
+    metrics into the ingest report active where the ingest was created.
+
+    The writers gate (pec_parser.gate) is held from creation until finish()
+    or abort(), which must be called from the creating thread.
+    """
+
+    def __init__(self, save_path, lazy=None, dedup=None):
+        gate.enter()
+        try:
+            self._setup(save_path, lazy, dedup)
+        except BaseException:
+            gate.leave()
+            raise
+
+    def _setup(self, save_path, lazy, dedup):
+        self.source_name = os.path.basename(save_path)
+        self.lazy = config.LAZY_BODIES if lazy is None else lazy
+        self.dedup = config.DEDUP_UPLOADS if dedup is None else dedup
+        # Lookup in the dedup index, and message hash -> email_id of the messages received
+        self._known = lookup if self.dedup else None
+        self._hashes = {}
+        self._file_hash = new_file_hash()
+        self._file = open(save_path, "wb")
+        self._splitter = MboxSplitter()
+        self._queue = queue.Queue(maxsize=max(1, config.STREAM_QUEUE_SIZE))
+        self._count = 0
+        self._summaries = []
+        self._postings = PostingsBatch()
+        self._blob_refs = {}
+        self._error = None
+        self._report = metrics.current_report()
+        self._parser = threading.Thread(target=self._parse_loop, name="stream-parse", daemon=True)
+        self._parser.start()
+
+    def _parse_loop(self):
+        with email_batch():
+            if self._report is not None:
+                with metrics.ingest_report(self._report):
+                    self._parse_all()
+            else:
+                self._parse_all()
+
+    def _parse_all(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            if self._error is not None:
+                # Keep draining so feed() never blocks on a dead parser
+                continue
+            index, offset, raw = item
+            try:
+                summary = self._parse(index, offset, raw)
+            except Exception as e:
+                self._error = e
+                continue
+            if summary is not None:
+                self._summaries.append(summary)
+
+    def _parse(self, index, offset, raw):
+        if self._known is None:
+            return _parse_record(raw, index, offset, len(raw), self.source_name,
+                                 self._postings, self._blob_refs, self.lazy)
+        digest = message_hash(raw)
+        hit, summary = _link_hash(self._known, digest, self.source_name, self._blob_refs)
+        if not hit:
+            summary = _parse_record(raw, index, offset, len(raw), self.source_name,
+                                    self._postings, self._blob_refs, self.lazy, link_known=True)
+        self._hashes[digest] = summary.email_id if summary is not None else None
+        return summary
+
+    def _enqueue(self, records):
+        for offset, raw in records:
+            self._queue.put((self._count, offset, raw))
+            self._count += 1
+
+    def _stop(self):
+        self._file.close()
+        self._queue.put(None)
+        self._parser.join()
+
+    def feed(self, chunk: bytes):
+        self._file.write(chunk)
+        self._file_hash.update(chunk)
+        self._enqueue(self._splitter.feed(chunk))
 
-    catalog = load_catalog()
-    existing_sources = catalog.get("sources", []) if catalog else []
-    existing_sources.append(entry)
+    def abort(self):
+        """Stop after a failed upload; nothing is published."""
+        try:
+            self._stop()
+        finally:
+            gate.leave()
 
-    save_catalog(existing_sources)
+    def finish(self):
+        """Returns (new_summaries, source_entry)."""
+        try:
+            self._enqueue(self._splitter.close())
+            self._stop()
+            if self._error is not None:
+                raise self._error
+            entry = _publish_new_source(self.source_name, self._summaries, self._postings,
+                                        self._blob_refs, lambda *args: None)
+            if self.dedup:
+                record(self._hashes, self._file_hash.hexdigest(),
+                       [s.email_id for s in self._summaries])
+        finally:
+            gate.leave()
+        return self._summaries, entry
 
-    # Return a clean copy of entry (without _emails which was popped by save_catalog)
-    # Re-read the source from the saved catalog
-    catalog = load_catalog()
-    saved_entry = None
-    for s in catalog.get("sources", []):
-        if s["source_id"] == source_id:
-            saved_entry = s
-            break
 
-    return emails, saved_entry
+def process_mbox_stream(chunks, save_path):
+    """Parse an mbox from an iterable of byte chunks while persisting it to
+    save_path. Returns (new_summaries, source_entry)."""
+    ingest = StreamingIngest(save_path)
+    try:
+        for chunk in chunks:
+            ingest.feed(chunk)
+    except BaseException:
+        ingest.abort()
+        raise
+    return ingest.finish()
@@ -0,0 +1,266 @@
+"""Single-pass mbox splitter over a memory-mapped file."""
+
+import email
+import mmap
+import os
+import re
+from email.message import Message
+from email.parser import BytesHeaderParser
+from typing import Iterator, List, NamedTuple, Optional, Tuple
+
+_SEPARATOR = b"From "
+
+
+class MboxRecord(NamedTuple):
+    """One raw message of an mbox: byte span (From_ line included) and its bytes."""
+    offset: int
+    length: int
+    data: memoryview
+
+
+def iter_message_spans(buf, start: int = 0, end: int = None) -> Iterator[Tuple[int, int]]:
+    """Yield (offset, length) of every message in buf[start:end].
+
+    A message starts at a line beginning with "From " and runs up to the
+    next such line (or end). start must be 0 or a message boundary.
+    """
+    if end is None:
+        end = len(buf)
+    if start >= end:
+        return
+    if buf[start:start + len(_SEPARATOR)] == _SEPARATOR:
+        pos = start
+    else:
+        pos = buf.find(b"\n" + _SEPARATOR, start, end)
+        if pos == -1:
+            return
+        pos += 1
+    while pos < end:
+        nxt = buf.find(b"\n" + _SEPARATOR, pos, end)
+        stop = end if nxt == -1 else nxt + 1
+        yield pos, stop - pos
+        pos = stop
+
+
+def scan_mbox(path: str, start: int = 0) -> Iterator[MboxRecord]:
+    """Memory-map an mbox and yield one MboxRecord per message.
+
+    record.data is a zero-copy view into the mapping and is only valid
+    until the next record is requested; copy it to keep it around.
+    """
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            view = memoryview(mm)
+            try:
+                for offset, length in iter_message_spans(mm, start):
+                    data = view[offset:offset + length]
+                    try:
+                        yield MboxRecord(offset, length, data)
+                    finally:
+                        data.release()
+            finally:
+                view.release()
+
+
+def _find(data, sub: bytes, start: int, end: int) -> int:
+    """data.find(sub, start, end) for any bytes-like data, memoryviews included."""
+    match = re.compile(re.escape(sub)).search(data, start, end)
+    return match.start() if match else -1
+
+
+def _startswith(data, prefix: bytes, start: int, end: int) -> bool:
+    return start + len(prefix) <= end and data[start:start + len(prefix)] == prefix
+
+
+def message_bytes(raw) -> memoryview:
+    """Strip the From_ line and the blank separator line from a raw record
+    (a zero-copy view of it)."""
+    view = memoryview(raw)
+    end = len(view)
+    newline = _find(view, b"\n", 0, end)
+    start = newline + 1 if newline != -1 else end
+    # Same as mailbox.mbox: the blank line before the next From_ is not content
+    if _startswith(view, b"\r\n\r\n", max(start, end - 4), end):
+        end -= 2
+    elif _startswith(view, b"\n\n", max(start, end - 2), end):
+        end -= 1
+    return view[start:end]
+
+
+def message_from_record(raw):
+    """Parse a raw mbox record (MboxRecord.data or bytes) into an email Message
+    with the email package: the whole message is copied and kept decoded.
+    Ingestion uses message_skeleton()."""
+    return email.message_from_bytes(bytes(message_bytes(raw)))
+
+
+class RecordMessage(Message):
+    """A Message whose leaf body is still a range of the raw record.
+
+    get_payload() turns the body into a payload string the first time it is
+    called (texts, daticert.xml); raw_body() gives a zero-copy view of it for
+    streaming (encoding_utils.iter_decoded_payload).
+    """
+
+    _body = None
+
+    def set_body(self, body: memoryview):
+        self._payload = None
+        self._body = body
+
+    def raw_body(self) -> Optional[memoryview]:
+        """The undecoded body of a leaf part, or None."""
+        return self._body
+
+    def get_payload(self, i=None, decode=False):
+        if self._payload is None and self._body is not None:
+            self._payload = str(self._body, "ascii", "surrogateescape")
+        return super().get_payload(i, decode)
+
+
+def _header_end(data, start: int, end: int) -> Tuple[int, int]:
+    """(end of the header block, start of the body) of the entity data[start:end]."""
+    if _startswith(data, b"\n", start, end) or _startswith(data, b"\r\n", start, end):
+        body = _find(data, b"\n", start, end) + 1
+        return start, body
+    pos = _find(data, b"\n\n", start, end)
+    limit = end if pos == -1 else pos
+    crlf = _find(data, b"\n\r\n", start, limit)
+    if crlf != -1:
+        return crlf + 1, crlf + 3
+    if pos != -1:
+        return pos + 1, pos + 2
+    return end, end
+
+
+def _split_multipart(data, start: int, end: int, boundary: str) -> List[Tuple[int, int]]:
+    """(start, end) of the parts between the boundary delimiter lines of data[start:end].
+
+    Delimiter lines are matched like the email package does: the delimiter,
+    "--" for the closing one, trailing blanks and the line break; without a
+    closing delimiter the last part runs to the end of data.
+    """
+    delimiter = re.compile(rb"(?m)^--" + re.escape(boundary.encode("ascii", "surrogateescape"))
+                           + rb"(--)?[ \t]*(\r\n|\r|\n|\Z)")
+    parts = []
+    part_start = None
+    for match in delimiter.finditer(data, start, end):
+        if part_start is not None:
+            # The line break before a delimiter belongs to the delimiter
+            part_end = max(part_start, match.start() - 1)
+            if part_end > part_start and data[part_end - 1:part_end] == b"\r":
+                part_end -= 1
+            parts.append((part_start, part_end))
+        if match.group(1):
+            return parts
+        part_start = match.end()
+    if part_start is not None:
+        part_end = end
+        # At the end of the message its last line break goes (an enclosing
+        # delimiter has already taken it otherwise)
+        if end == len(data) and _startswith(data, b"\n", end - 1, end):
+            part_end -= 1
+            if _startswith(data, b"\r", part_end - 1, end):
+                part_end -= 1
+        parts.append((part_start, max(part_start, part_end)))
+    return parts
+
+
+def _skeleton(data: memoryview, start: int, end: int) -> RecordMessage:
+    header_end, body = _header_end(data, start, end)
+    msg = BytesHeaderParser(RecordMessage).parsebytes(bytes(data[start:header_end]))
+    boundary = msg.get_boundary() if msg.get_content_maintype() == "multipart" else None
+    if boundary:
+        msg.set_payload([_skeleton(data, s, e) for s, e in _split_multipart(data, body, end, boundary)])
+    elif msg.get_content_type() == "message/rfc822":
+        msg.set_payload([_skeleton(data, body, end)])
+    else:
+        msg.set_body(data[body:end])
+    return msg
+
+
+def message_skeleton(raw) -> RecordMessage:
+    """Parse a raw mbox record (MboxRecord.data or bytes) without copying it.
+
+    Only headers are parsed: multipart bodies are split at their boundaries
+    with byte searches and leaf bodies stay ranges of raw (RecordMessage),
+    so a large attachment costs nothing until it is streamed. The tree
+    holds on to raw, and a memory map cannot be closed while it is alive.
+    """
+    data = message_bytes(raw)
+    return _skeleton(data, 0, len(data))
+
+
+def read_record(path: str, offset: int, length: int) -> memoryview:
+    """Map a message recorded at (offset, length) and return a view of its raw bytes.
+
+    The mapping is released when the last view of it goes away.
+    """
+    with open(path, "rb") as f:
+        if length <= 0 or os.fstat(f.fileno()).st_size == 0:
+            return memoryview(b"")
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return memoryview(mm)[offset:offset + length]
+
+
+class MboxSplitter:
+    """Incremental iter_message_spans for an mbox arriving in chunks.
+
+    feed() returns the (offset, raw bytes) of every message completed by the
+    chunk; close() returns the last one. Splits exactly like scan_mbox.
+    """
+
+    def __init__(self):
+        self._buf = bytearray()
+        self._offset = 0  # file offset of _buf[0]
+        self._scanned = 0  # no separator starts before this index of _buf
+        self._started = False
+
+    def _discard(self, n: int):
+        del self._buf[:n]
+        self._offset += n
+        self._scanned = max(0, self._scanned - n)
+
+    def _find_start(self) -> bool:
+        """Drop anything before the first message; False if it is not in yet."""
+        if self._offset == 0 and len(self._buf) < len(_SEPARATOR):
+            if _SEPARATOR.startswith(bytes(self._buf)):
+                return False
+        if self._offset == 0 and self._buf.startswith(_SEPARATOR):
+            return True
+        pos = self._buf.find(b"\n" + _SEPARATOR, self._scanned)
+        if pos == -1:
+            # Keep a tail that could be the start of a split separator
+            self._discard(max(0, len(self._buf) - len(_SEPARATOR)))
+            return False
+        self._discard(pos + 1)
+        return True
+
+    def feed(self, chunk) -> List[Tuple[int, bytes]]:
+        self._buf += chunk
+        if not self._started:
+            self._started = self._find_start()
+            if not self._started:
+                return []
+
+        records = []
+        start = 0
+        while True:
+            nxt = self._buf.find(b"\n" + _SEPARATOR, max(start, self._scanned))
+            if nxt == -1:
+                break
+            stop = nxt + 1
+            records.append((self._offset + start, bytes(self._buf[start:stop])))
+            start = stop
+        self._discard(start)
+        self._scanned = max(0, len(self._buf) - len(_SEPARATOR))
+        return records
+
+    def close(self) -> List[Tuple[int, bytes]]:
+        if not self._started or not self._buf:
+            return []
+        record = (self._offset, bytes(self._buf))
+        self._discard(len(self._buf))
+        return [record]
@@ -0,0 +1,142 @@
+"""Opt-in memory profiling of an ingest (tracemalloc + RSS sampling).
+
+A MemoryProfile is attached to an ingest report (metrics.ingest_report(
+memory=True) or config.MEMORY_PROFILE) and is told when each stage starts
+and stops. It records, per stage, the peak memory traced by tracemalloc
+while the stage ran (nested stages included) and the highest RSS a
+sampling thread saw during it, plus the top allocation sites at the
+largest traced size seen at a stage boundary.
+
+tracemalloc slows an ingest down several times and its peak is process
+wide: profile one ingest at a time, and with INGEST_WORKERS > 1 only the
+parent process is measured.
+"""
+
+import os
+import threading
+import tracemalloc
+from typing import Dict, List, Optional
+
+import config
+
+
+# A snapshot for the top allocation sites is taken whenever the traced size
+# grows past this factor of the last one (and past SNAPSHOT_MIN_BYTES)
+SNAPSHOT_GROWTH = 1.25
+SNAPSHOT_MIN_BYTES = 1024 * 1024
+
+
+def current_rss() -> Optional[int]:
+    """Resident set size of this process in bytes (None where unknown)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+class MemoryProfile:
+    """Peak traced memory and RSS per stage of one ingest."""
+
+    def __init__(self):
+        self._owns_tracing = not tracemalloc.is_tracing()
+        if self._owns_tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        self.start_bytes = tracemalloc.get_traced_memory()[0]
+        self.peak_bytes = self.start_bytes
+        self.stage_peaks: Dict[str, int] = {}
+        self.rss_start = current_rss()
+        self.rss_peak = self.rss_start
+        self.stage_rss: Dict[str, int] = {}
+        self.top_sites: List[Dict] = []
+        self._stack: List[list] = []
+        self._snapshot = None
+        self._snapshot_bytes = 0
+        self._stopped = threading.Event()
+        self._sampler = None
+        if self.rss_start is not None:
+            self._sampler = threading.Thread(target=self._sample_rss, name="rss-sampler", daemon=True)
+            self._sampler.start()
+
+    def _sample_rss(self):
+        while not self._stopped.wait(config.MEMORY_SAMPLE_INTERVAL):
+            rss = current_rss()
+            if rss is None:
+                continue
+            self.rss_peak = max(self.rss_peak, rss)
+            stack = list(self._stack)
+            for entry in stack:
+                self.stage_rss[entry[0]] = max(self.stage_rss.get(entry[0], 0), rss)
+
+    def _boundary(self):
+        """Charge the peak since the last boundary to every open stage."""
+        current, peak = tracemalloc.get_traced_memory()
+        self.peak_bytes = max(self.peak_bytes, peak)
+        for entry in self._stack:
+            entry[1] = max(entry[1], peak)
+        if current > max(self._snapshot_bytes * SNAPSHOT_GROWTH, SNAPSHOT_MIN_BYTES):
+            self._snapshot = tracemalloc.take_snapshot()
+            self._snapshot_bytes = current
+        tracemalloc.reset_peak()
+
+    def enter(self, name: str):
+        self._boundary()
+        self._stack.append([name, 0])
+
+    def exit(self, name: str):
+        self._boundary()
+        if not self._stack:
+            return
+        entry = self._stack.pop()
+        self.stage_peaks[entry[0]] = max(self.stage_peaks.get(entry[0], 0), entry[1])
+
+    def close(self):
+        """Stop sampling (and tracing, if this profile started it)."""
+        self._boundary()
+        self._stopped.set()
+        if self._sampler is not None:
+            self._sampler.join()
+        rss = current_rss()
+        if rss is not None and self.rss_peak is not None:
+            self.rss_peak = max(self.rss_peak, rss)
+        if self._snapshot is None:
+            # Never grew past SNAPSHOT_MIN_BYTES: show what the ingest left allocated
+            self._snapshot = tracemalloc.take_snapshot()
+            self._snapshot_bytes = tracemalloc.get_traced_memory()[0]
+        self.top_sites = _top_sites(self._snapshot, config.MEMORY_TOP_SITES)
+        self._snapshot = None
+        if self._owns_tracing:
+            tracemalloc.stop()
+
+    def to_dict(self) -> Dict:
+        stages = sorted(self.stage_peaks.items(), key=lambda item: -item[1])
+        return {
+            "start_bytes": self.start_bytes,
+            "peak_bytes": self.peak_bytes,
+            "rss_start_bytes": self.rss_start,
+            "rss_peak_bytes": self.rss_peak,
+            "stages": {
+                name: {"peak_bytes": peak, "rss_bytes": self.stage_rss.get(name)}
+                for name, peak in stages
+            },
+            "top_sites": self.top_sites,
+            "snapshot_bytes": self._snapshot_bytes,
+        }
+
+
+def _top_sites(snapshot, limit: int) -> List[Dict]:
+    """The limit source lines holding the most memory in snapshot."""
+    snapshot = snapshot.filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__),
+    ])
+    sites = []
+    for stat in snapshot.statistics("lineno")[:limit]:
+        frame = stat.traceback[0]
+        filename = frame.filename
+        if filename.startswith(config.BASE_DIR + os.sep):
+            filename = os.path.relpath(filename, config.BASE_DIR)
+        sites.append({"site": "{}:{}".format(filename, frame.lineno),
+                      "bytes": stat.size, "count": stat.count})
+    return sites
@@ -0,0 +1,367 @@
+"""In-process ingest and request metrics, rendered in the Prometheus text format.
+
+Ingest code wraps each stage in stage(name) (or timed() for an iterator);
+the time recorded is exclusive of nested stages, so no time is counted
+twice (with INGEST_WORKERS > 1 the stages of an ingest add up over all
+workers, and may exceed its wall time). count() adds to counters (messages
+parsed, reused and linked, attachments, bytes read and written) and
+message() records the time of one message. Everything goes to the process-wide registry served by
+/api/metrics and, while an ingest_report() is active on the thread, to
+that report as well.
+
+Recording is a perf_counter() call and a dict update under a lock, cheap
+enough to stay on (config.METRICS_ENABLED switches it off). Memory
+profiling (pec_parser.memory) is not: it is opt-in per report.
+"""
+
+import heapq
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from pec_parser.memory import MemoryProfile
+import config
+
+
+# Histogram buckets (upper bounds, seconds)
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+MESSAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+
+# Counters every ingest report lists, even when zero
+REPORT_COUNTERS = ("messages", "reused", "linked", "attachments", "bytes_read", "bytes_written")
+
+# name -> (type, help) of every metric
+METRICS = {
+    "pec_ingest_stage_seconds_total": ("counter", "Time spent in each ingest stage, nested stages excluded."),
+    "pec_ingest_stage_calls_total": ("counter", "Number of times each ingest stage ran."),
+    "pec_ingest_messages_total": ("counter", "mbox messages parsed."),
+    "pec_ingest_reused_total": ("counter", "mbox messages taken from the fingerprint cache."),
+    "pec_ingest_linked_total": ("counter", "mbox messages linked to an email already stored instead of being stored again."),
+    "pec_ingest_attachments_total": ("counter", "Attachments extracted."),
+    "pec_ingest_bytes_read_total": ("counter", "mbox bytes parsed."),
+    "pec_ingest_bytes_written_total": ("counter", "Attachment and email document bytes written."),
+    "pec_ingest_message_seconds": ("histogram", "Time to parse and store one message."),
+    "pec_http_request_duration_seconds": ("histogram", "HTTP request duration by route."),
+}
+
+_lock = threading.Lock()
+_counters: Dict[Tuple[str, tuple], float] = {}
+_histograms: Dict[Tuple[str, tuple], "_Histogram"] = {}
+# Per thread: the active IngestReport and the stack of nested stage timers
+_local = threading.local()
+
+
+class _Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # One count per bucket, plus one for values above the last bound
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def merge(self, counts: List[int], total: float):
+        for i, n in enumerate(counts):
+            self.counts[i] += n
+        self.sum += total
+        self.count += sum(counts)
+
+
+class IngestReport:
+    """Stage durations, counters and slowest messages of one ingest (and
+    its memory use, if profiled)."""
+
+    def __init__(self, memory: bool = False):
+        self.started = time.perf_counter()
+        self.finished: Optional[float] = None
+        self.memory: Optional[MemoryProfile] = MemoryProfile() if memory else None
+        self.stages: Dict[str, List[float]] = {}
+        self.counters: Dict[str, float] = {}
+        self.message_seconds = _Histogram(MESSAGE_BUCKETS)
+        self._slowest: List[tuple] = []
+        self._lock = threading.Lock()
+
+    def add_stage(self, name: str, seconds: float, calls: int = 1):
+        with self._lock:
+            entry = self.stages.setdefault(name, [0.0, 0])
+            entry[0] += seconds
+            entry[1] += calls
+
+    def add(self, name: str, value: float):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def add_message(self, seconds: float, index: int, email_id: Optional[str]):
+        with self._lock:
+            self.message_seconds.observe(seconds)
+            self._keep_slow((seconds, index, email_id or ""))
+
+    def _keep_slow(self, item: tuple):
+        if len(self._slowest) < config.METRICS_SLOWEST:
+            heapq.heappush(self._slowest, item)
+        elif self._slowest and item > self._slowest[0]:
+            heapq.heapreplace(self._slowest, item)
+
+    def state(self) -> Dict:
+        """Plain-data copy, to hand a worker process's report to the parent."""
+        with self._lock:
+            return {
+                "stages": {name: list(entry) for name, entry in self.stages.items()},
+                "counters": dict(self.counters),
+                "message_counts": list(self.message_seconds.counts),
+                "message_sum": self.message_seconds.sum,
+                "slowest": list(self._slowest),
+            }
+
+    def to_dict(self) -> Dict:
+        end = self.finished or time.perf_counter()
+        with self._lock:
+            stages = sorted(self.stages.items(), key=lambda item: -item[1][0])
+            data = {
+                "seconds": round(end - self.started, 3),
+                "stages": {name: {"seconds": round(s, 4), "calls": n} for name, (s, n) in stages},
+                "counters": dict({name: 0 for name in REPORT_COUNTERS}, **self.counters),
+                "slowest_messages": [
+                    {"email_id": email_id or None, "index": index, "seconds": round(seconds, 4)}
+                    for seconds, index, email_id in sorted(self._slowest, reverse=True)
+                ],
+            }
+        if self.memory is not None:
+            data["memory"] = self.memory.to_dict()
+        return data
+
+
+def current_report() -> Optional[IngestReport]:
+    return getattr(_local, "report", None)
+
+
+@contextmanager
+def ingest_report(report: Optional[IngestReport] = None, memory: Optional[bool] = None):
+    """Collect this thread's ingest metrics into report (a new one if None,
+    finished when the block exits) for the duration of the block.
+
+    A new report profiles memory if memory (default config.MEMORY_PROFILE) is set.
+    """
+    own = report is None
+    if own:
+        if memory is None:
+            memory = config.MEMORY_PROFILE
+        report = IngestReport(memory=memory and config.METRICS_ENABLED)
+    previous = current_report()
+    _local.report = report
+    try:
+        yield report
+    finally:
+        _local.report = previous
+        if own:
+            report.finished = time.perf_counter()
+            if report.memory is not None:
+                report.memory.close()
+
+
+def _inc(name: str, value: float, labels: tuple = ()):
+    key = (name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def _observe(name: str, buckets, value: float, labels: tuple = ()):
+    key = (name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = _Histogram(buckets)
+        histogram.observe(value)
+
+
+def _record_stage(name: str, seconds: float):
+    labels = (("stage", name),)
+    with _lock:
+        for metric, value in (("pec_ingest_stage_seconds_total", seconds),
+                              ("pec_ingest_stage_calls_total", 1)):
+            key = (metric, labels)
+            _counters[key] = _counters.get(key, 0) + value
+    report = current_report()
+    if report is not None:
+        report.add_stage(name, seconds)
+
+
+def _stack() -> List[float]:
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+def _start(name: str) -> float:
+    report = current_report()
+    if report is not None and report.memory is not None:
+        report.memory.enter(name)
+    _stack().append(0.0)
+    return time.perf_counter()
+
+
+def _stop(name: str, started: float):
+    elapsed = time.perf_counter() - started
+    stack = _stack()
+    nested = stack.pop()
+    if stack:
+        stack[-1] += elapsed
+    _record_stage(name, elapsed - nested)
+    report = current_report()
+    if report is not None and report.memory is not None:
+        report.memory.exit(name)
+
+
+@contextmanager
+def stage(name: str):
+    """Time the block as ingest stage name."""
+    if not config.METRICS_ENABLED:
+        yield
+        return
+    started = _start(name)
+    try:
+        yield
+    finally:
+        _stop(name, started)
+
+
+def timed(iterable: Iterable, name: str) -> Iterator:
+    """Iterate iterable, timing each step as ingest stage name."""
+    if not config.METRICS_ENABLED:
+        yield from iterable
+        return
+    iterator = iter(iterable)
+    while True:
+        started = _start(name)
+        try:
+            item = next(iterator)
+        except StopIteration:
+            _stop(name, started)
+            return
+        except BaseException:
+            _stop(name, started)
+            raise
+        _stop(name, started)
+        yield item
+
+
+def count(name: str, value: float = 1):
+    """Add value to ingest counter name (pec_ingest_<name>_total)."""
+    if not config.METRICS_ENABLED:
+        return
+    _inc("pec_ingest_{}_total".format(name), value)
+    report = current_report()
+    if report is not None:
+        report.add(name, value)
+
+
+def message(seconds: float, index: int, email_id: Optional[str] = None):
+    """Record the time taken by one message."""
+    if not config.METRICS_ENABLED:
+        return
+    _observe("pec_ingest_message_seconds", MESSAGE_BUCKETS, seconds)
+    report = current_report()
+    if report is not None:
+        report.add_message(seconds, index, email_id)
+
+
+def merge(state: Dict):
+    """Add an IngestReport.state() recorded in another process, to the
+    registry and to this thread's report."""
+    if not config.METRICS_ENABLED:
+        return
+    report = current_report()
+    with _lock:
+        for name, (seconds, calls) in state["stages"].items():
+            labels = (("stage", name),)
+            for metric, value in (("pec_ingest_stage_seconds_total", seconds),
+                                  ("pec_ingest_stage_calls_total", calls)):
+                key = (metric, labels)
+                _counters[key] = _counters.get(key, 0) + value
+        for name, value in state["counters"].items():
+            key = ("pec_ingest_{}_total".format(name), ())
+            _counters[key] = _counters.get(key, 0) + value
+        key = ("pec_ingest_message_seconds", ())
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = _Histogram(MESSAGE_BUCKETS)
+        histogram.merge(state["message_counts"], state["message_sum"])
+    if report is not None:
+        for name, (seconds, calls) in state["stages"].items():
+            report.add_stage(name, seconds, calls)
+        for name, value in state["counters"].items():
+            report.add(name, value)
+        with report._lock:
+            report.message_seconds.merge(state["message_counts"], state["message_sum"])
+            for item in state["slowest"]:
+                report._keep_slow(tuple(item))
+
+
+def observe_request(route: str, method: str, status: int, seconds: float):
+    """Record the duration of one HTTP request."""
+    if not config.METRICS_ENABLED:
+        return
+    _observe("pec_http_request_duration_seconds", REQUEST_BUCKETS, seconds,
+             (("route", route), ("method", method), ("status", str(status))))
+
+
+def reset():
+    """Forget everything recorded so far (for tests)."""
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+
+def _format_labels(labels: tuple, extra: tuple = ()) -> str:
+    pairs = labels + extra
+    if not pairs:
+        return ""
+    return "{" + ",".join(
+        '{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in pairs
+    ) + "}"
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value))
+
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format."""
+    with _lock:
+        counters = sorted(_counters.items())
+        histograms = sorted(
+            (key, (h.buckets, list(h.counts), h.sum, h.count)) for key, h in _histograms.items()
+        )
+
+    lines = []
+    seen = set()
+
+    def header(name):
+        if name not in seen:
+            seen.add(name)
+            kind, help_text = METRICS.get(name, ("untyped", ""))
+            lines.append("# HELP {} {}".format(name, help_text))
+            lines.append("# TYPE {} {}".format(name, kind))
+
+    for (name, labels), value in counters:
+        header(name)
+        lines.append("{}{} {}".format(name, _format_labels(labels), _format_value(value)))
+    for (name, labels), (buckets, counts, total, n) in histograms:
+        header(name)
+        cumulative = 0
+        for bound, c in zip(buckets, counts):
+            cumulative += c
+            lines.append("{}_bucket{} {}".format(
+                name, _format_labels(labels, (("le", repr(bound)),)), cumulative))
+        lines.append("{}_bucket{} {}".format(name, _format_labels(labels, (("le", "+Inf"),)), n))
+        lines.append("{}_sum{} {}".format(name, _format_labels(labels), _format_value(total)))
+        lines.append("{}_count{} {}".format(name, _format_labels(labels), n))
+    return "\n".join(lines) + "\n"
@@ -1,4 +1,4 @@
-from dataclasses import dataclass, field, asdict
+from dataclasses import dataclass, field, asdict, fields
 from typing import Optional, List
 
 
@@ -9,6 +9,8 @@ class Attachment:
     size: int
     content_id: Optional[str] = None
     is_inline: bool = False
+    # SHA-256 of the payload in the blob store (None if stored per email)
+    blob: Optional[str] = None
 
     def to_dict(self):
         return asdict(self)
@@ -30,12 +32,66 @@ class ParsedEmail:
     pec_date: Optional[str] = None
     clean_subject: Optional[str] = None
     source_file: Optional[str] = None
+    # UTC epoch seconds of the Date header (else of the PEC date); date and
+    # pec_date are display strings
+    timestamp: Optional[int] = None
+    source_offset: Optional[int] = None
+    source_length: Optional[int] = None
+    # Headers-only (tier-one) record: body and attachments not extracted yet
+    body_pending: bool = False
+    # Other copies of a pending email's record, [source_file, offset, length]
+    # (lazy ingests of overlapping mboxes)
+    other_sources: List[list] = field(default_factory=list)
 
     def to_dict(self):
         d = asdict(self)
         d["attachments"] = [a.to_dict() for a in self.attachments]
         return d
 
+    @classmethod
+    def from_dict(cls, d) -> "ParsedEmail":
+        names = {f.name for f in fields(cls)} - {"attachments"}
+        email = cls(**{k: v for k, v in d.items() if k in names})
+        email.attachments = [Attachment(**a) for a in d.get("attachments") or []]
+        return email
+
+    def summary(self) -> "EmailSummary":
+        return EmailSummary(
+            email_id=self.email_id,
+            subject=self.subject,
+            sender=self.sender,
+            date=self.date,
+            clean_subject=self.clean_subject,
+            attachment_count=len(self.attachments),
+            pec_provider=self.pec_provider,
+            pec_type=self.pec_type,
+            source_file=self.source_file,
+            timestamp=self.timestamp,
+        )
+
+
+@dataclass
+class EmailSummary:
+    """Slim per-email record kept in memory for grouping and the catalog."""
+    email_id: str
+    subject: str
+    sender: str
+    date: str
+    clean_subject: Optional[str] = None
+    attachment_count: int = 0
+    pec_provider: Optional[str] = None
+    pec_type: Optional[str] = None
+    source_file: Optional[str] = None
+    timestamp: Optional[int] = None
+
+    def to_dict(self):
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, d) -> "EmailSummary":
+        names = {f.name for f in fields(cls)}
+        return cls(**{k: v for k, v in d.items() if k in names})
+
 
 @dataclass
 class EmailGroup:
@@ -1,26 +1,42 @@
 """Core PEC MIME navigation: extract real email content from PEC wrappers."""
 
 import hashlib
+import os
 import xml.etree.ElementTree as ET
+from datetime import datetime, timezone
 from email.utils import parsedate_to_datetime
 from typing import Optional, Tuple, Dict, List
 
 from pec_parser.encoding_utils import (
     decode_header_value,
     decode_payload,
+    iter_decoded_payload,
     extract_email_address,
     extract_all_recipients,
     safe_filename,
 )
 from pec_parser.models import ParsedEmail, Attachment
+from pec_parser.subject_cleaner import clean_subject
+from pec_parser import metrics
 
 
 # PEC infrastructure files to skip as attachments
 PEC_INFRA_FILES = {"smime.p7s", "daticert.xml", "postacert.eml"}
 
 
-def parse_pec_message(msg, index: int, source_file: str = "") -> Optional[ParsedEmail]:
-    """Parse a PEC-wrapped email message and return a ParsedEmail."""
+def parse_pec_message(msg, index: int, source_file: str = "",
+                      attachment_sink=None, headers_only: bool = False) -> Optional[ParsedEmail]:
+    """Parse a PEC-wrapped email message and return a ParsedEmail.
+
+    attachment_sink, if given, is called with the email id and must return an
+    object whose write(filename, chunks) stores each attachment from an
+    iterable of decoded chunks (and may return a blob digest); payloads are
+    decoded once, streaming, and measured on the way to the sink (straight
+    from the mbox when msg is a mbox_scanner.message_skeleton()).
+
+    headers_only skips the bodies: attachments are listed from their part
+    headers (size 0, nothing written) and the email is marked body_pending.
+    """
     email_id = "email_{:03d}".format(index)
 
     # Navigate PEC structure to find daticert.xml and postacert.eml
@@ -42,19 +58,24 @@ def parse_pec_message(msg, index: int, source_file: str = "") -> Optional[Parsed
 
     # Parse date
     date_display = date_str
+    timestamp = None
     try:
         dt = parsedate_to_datetime(date_str)
         date_display = dt.strftime("%d/%m/%Y %H:%M")
+        timestamp = _epoch(dt)
     except Exception:
         pass
-
-    # Extract body and attachments from inner message
-    body_text, body_html, attachments = _extract_body_and_attachments(inner_msg)
+    if timestamp is None:
+        timestamp = pec_meta.get("timestamp")
 
     # Use email_id as a stable hash-based id
     raw_id = message_id or "{}_{}_{}".format(sender, subject, date_str)
     stable_id = "email_" + hashlib.md5(raw_id.encode("utf-8", errors="replace")).hexdigest()[:12]
 
+    # Extract body and attachments from inner message
+    sink = attachment_sink(stable_id) if attachment_sink is not None and not headers_only else None
+    body_text, body_html, attachments = _extract_body_and_attachments(inner_msg, sink, headers_only)
+
     return ParsedEmail(
         email_id=stable_id,
         message_id=message_id,
@@ -68,10 +89,33 @@ def parse_pec_message(msg, index: int, source_file: str = "") -> Optional[Parsed
         pec_provider=pec_meta.get("gestore"),
         pec_type=pec_meta.get("tipo"),
         pec_date=pec_meta.get("data"),
+        clean_subject=clean_subject(subject),
         source_file=source_file or None,
+        timestamp=timestamp,
+        body_pending=headers_only,
     )
 
 
+def _epoch(dt: datetime) -> int:
+    """UTC epoch seconds of dt (naive datetimes are taken as UTC)."""
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp())
+
+
+def _pec_timestamp(giorno: str, ora: str, zona: str) -> Optional[int]:
+    """Epoch of a daticert.xml date: giorno "dd/mm/yyyy", ora "hh:mm:ss", zona "+0100"."""
+    try:
+        if zona:
+            dt = datetime.strptime("{} {} {}".format(giorno, ora, zona), "%d/%m/%Y %H:%M:%S %z")
+        else:
+            dt = datetime.strptime("{} {}".format(giorno, ora), "%d/%m/%Y %H:%M:%S")
+    except ValueError:
+        return None
+    return _epoch(dt)
+
+
+@metrics.stage("find_pec_parts")
 def _find_pec_parts(msg) -> Tuple[Optional[object], Optional[object]]:
     """Navigate PEC MIME tree to find daticert.xml and postacert.eml parts."""
     daticert = None
@@ -119,6 +163,7 @@ def _find_mixed_part(msg):
     return None
 
 
+@metrics.stage("parse_daticert")
 def _parse_daticert(part) -> Dict[str, str]:
     """Parse daticert.xml to extract PEC metadata."""
     meta = {}
@@ -152,22 +197,62 @@ def _parse_daticert(part) -> Dict[str, str]:
                 giorno = data_el.find("giorno")
                 ora = data_el.find("ora")
                 if giorno is not None and ora is not None:
-                    meta["data"] = "{} {}".format(
-                        giorno.text.strip() if giorno.text else "",
-                        ora.text.strip() if ora.text else "",
-                    )
+                    giorno_text = giorno.text.strip() if giorno.text else ""
+                    ora_text = ora.text.strip() if ora.text else ""
+                    meta["data"] = "{} {}".format(giorno_text, ora_text)
+                    meta["timestamp"] = _pec_timestamp(giorno_text, ora_text, data_el.get("zona", ""))
     except ET.ParseError:
         pass
     return meta
 
 
-def _extract_body_and_attachments(msg) -> Tuple[Optional[str], Optional[str], List[Attachment]]:
-    """Extract body text, body HTML, and real attachments from the inner email."""
+def _attachment_name(part, filename, is_inline_image) -> str:
+    """Filename an attachment is listed and stored under."""
+    if filename:
+        return safe_filename(filename)
+    if is_inline_image:
+        # Inline images often have no filename: name them after the Content-ID
+        cid = part.get("Content-ID", "").strip("<>")
+        ext = part.get_content_type().split("/")[1]
+        return safe_filename("inline_{}".format(cid or "image") + "." + ext)
+    return safe_filename(None)
+
+
+def _unique_name(name: str, used: set) -> str:
+    """Suffix a filename (doc_1.pdf, doc_2.pdf...) until it is not in used."""
+    if name in used:
+        base, ext = os.path.splitext(name)
+        counter = 1
+        while name in used:
+            name = "{}_{:d}{}".format(base, counter, ext)
+            counter += 1
+    used.add(name)
+    return name
+
+
+def _tally(chunks, total: List[int]):
+    """Pass chunks through, adding their lengths to total[0]."""
+    for chunk in chunks:
+        total[0] += len(chunk)
+        yield chunk
+
+
+def _extract_body_and_attachments(msg, sink=None, headers_only=False) -> Tuple[Optional[str], Optional[str], List[Attachment]]:
+    """Extract body text, body HTML, and real attachments from the inner email.
+
+    Single walk of the MIME tree: each attachment payload is decoded once in
+    chunks (iter_decoded_payload), measured for the metadata and, if a sink is
+    given, streamed to sink.write(), whose return value (a blob digest or
+    None) is kept on the Attachment.
+    With headers_only nothing is decoded: only the attachment list is built.
+    """
     body_text = None
     body_html = None
     attachments = []
 
     if not msg.is_multipart():
+        if headers_only:
+            return body_text, body_html, attachments
         ct = msg.get_content_type()
         if ct == "text/plain":
             body_text = decode_payload(msg)
@@ -175,6 +260,8 @@ def _extract_body_and_attachments(msg) -> Tuple[Optional[str], Optional[str], Li
             body_html = decode_payload(msg)
         return body_text, body_html, attachments
 
+    used_names = set()
+
     # Walk all parts
     for part in msg.walk():
         ct = part.get_content_type()
@@ -192,6 +279,8 @@ def _extract_body_and_attachments(msg) -> Tuple[Optional[str], Optional[str], Li
         is_attachment = "attachment" in cd.lower() or (filename and "inline" not in cd.lower())
         is_inline_image = "inline" in cd.lower() and ct.startswith("image/")
 
+        if ct in ("text/plain", "text/html") and not is_attachment and headers_only:
+            continue
         if ct == "text/plain" and not is_attachment:
             text = decode_payload(part)
             if text and (body_text is None or len(text) > len(body_text)):
@@ -202,9 +291,18 @@ def _extract_body_and_attachments(msg) -> Tuple[Optional[str], Optional[str], Li
                 body_html = html
         elif filename or is_attachment or is_inline_image:
             # It's an attachment
-            safe_name = safe_filename(filename)
-            payload = part.get_payload(decode=True)
-            size = len(payload) if payload else 0
+            safe_name = _unique_name(_attachment_name(part, filename, is_inline_image), used_names)
+            size = [0]
+            blob = None
+            if not headers_only and not part.is_multipart():
+                chunks = _tally(metrics.timed(iter_decoded_payload(part), "decode_payload"), size)
+                if sink is not None:
+                    with metrics.stage("save_attachments"):
+                        blob = sink.write(safe_name, chunks)
+                # Measure whatever the sink did not consume
+                for _ in chunks:
+                    pass
+                metrics.count("attachments")
             content_id = part.get("Content-ID", "")
             if content_id:
                 content_id = content_id.strip("<>")
@@ -212,9 +310,10 @@ def _extract_body_and_attachments(msg) -> Tuple[Optional[str], Optional[str], Li
             attachments.append(Attachment(
                 filename=safe_name,
                 content_type=ct,
-                size=size,
+                size=size[0],
                 content_id=content_id if content_id else None,
                 is_inline=is_inline_image,
+                blob=blob,
             ))
 
     return body_text, body_html, attachments
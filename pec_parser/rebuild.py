@@ -0,0 +1,232 @@
+"""Shadow rebuild: re-ingest every source into a fresh snapshot, then swap it in.
+
+DATA_DIR becomes a symlink to the live snapshot under SNAPSHOTS_DIR. A
+rebuild ingests into a staging snapshot in a separate process (so the live
+config and caches are untouched), then flips the symlink atomically: readers
+are served from the old snapshot until the flip and from the new one after.
+Writers (ingests, backfill, the follower, deletes) are held off by the
+writers gate for the whole rebuild, so none writes to the old snapshot
+after its catalog was read. Sources keep their source_id and uploaded_at.
+"""
+
+import ctypes
+import multiprocessing
+import os
+import shutil
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from pec_parser.mbox_reader import process_mbox, _init_worker
+from pec_parser.follow import _reset as reset_follow
+from pec_parser.lazy import flush_deferred, source_path
+from pec_parser import gate
+from storage.json_store import invalidate_catalog_cache, _write_lock
+import storage
+import config
+
+
+class RebuildConflict(Exception):
+    """The live catalog changed while the new snapshot was being built."""
+
+
+class MissingSourceFiles(Exception):
+    """Sources whose mbox file is gone: a rebuild would drop their emails."""
+
+    def __init__(self, source_files: List[str]):
+        super().__init__("mbox files missing: {}".format(", ".join(source_files)))
+        self.source_files = source_files
+
+
+def _snapshot_settings(snapshot_dir: str) -> Dict:
+    """The config settings, with every path under DATA_DIR moved under snapshot_dir."""
+    live = config.DATA_DIR.rstrip(os.sep)
+    settings = {}
+    for name in dir(config):
+        if not name.isupper():
+            continue
+        value = getattr(config, name)
+        if isinstance(value, str) and (value == live or value.startswith(live + os.sep)):
+            value = snapshot_dir + value[len(live):]
+        settings[name] = value
+    settings["INGEST_WORKERS"] = config.REBUILD_WORKERS
+    return settings
+
+
+def _source_files(catalog: Optional[Dict]) -> List[Tuple[str, bool]]:
+    """(path, followed) of the mbox files to re-ingest, in catalog order: the
+    configured mbox and every source (uploads and FOLLOW_PATHS files,
+    resolved like pec_parser.lazy.source_path); followed marks the sources
+    follow mode keeps a checkpoint for.
+
+    Raises MissingSourceFiles if the file of a source no longer exists.
+    """
+    mbox_name = os.path.basename(config.MBOX_PATH)
+    sources = (catalog or {}).get("sources", [])
+    followed = {s["source_file"] for s in sources if s.get("follow")}
+    names = [s["source_file"] for s in sources]
+    in_catalog = set(names)
+    if mbox_name not in names:
+        names.insert(0, mbox_name)
+
+    files = []
+    missing = []
+    for name in dict.fromkeys(names):
+        path = source_path(name)
+        if name in in_catalog and not os.path.exists(path):
+            # Re-ingesting without it would drop its emails from the catalog
+            missing.append(name)
+        else:
+            files.append((path, name in followed))
+    if missing:
+        raise MissingSourceFiles(missing)
+    return files
+
+
+def _build_snapshot(files: List[Tuple[str, bool]], identities: Dict[str, Dict]):
+    """Runs in the rebuild process, with config pointing at the staging dir.
+
+    identities maps source_file to the source_id and uploaded_at the
+    rebuilt source keeps.
+    """
+    for path, followed in files:
+        if followed:
+            # Also checkpoints the file, so the follower carries on from its end
+            reset_follow(path, os.stat(path))
+        else:
+            process_mbox(path, reuse=False)
+
+    def restore(catalog):
+        for source in catalog["sources"]:
+            source.update(identities.get(source["source_file"], {}))
+
+    storage.update_catalog(restore)
+
+
+def _stage_uploads(files: List[Tuple[str, bool]], settings: Dict) -> List[Tuple[str, bool]]:
+    """Hard-link (or copy) uploaded files into the staging uploads dir."""
+    staged = []
+    for path, followed in files:
+        if os.path.dirname(path) != config.UPLOADS_DIR.rstrip(os.sep):
+            staged.append((path, followed))
+            continue
+        os.makedirs(settings["UPLOADS_DIR"], exist_ok=True)
+        target = os.path.join(settings["UPLOADS_DIR"], os.path.basename(path))
+        try:
+            os.link(path, target)
+        except OSError:
+            shutil.copy2(path, target)
+        staged.append((target, followed))
+    return staged
+
+
+# renameat2() arguments (Linux)
+_AT_FDCWD = -100
+_RENAME_EXCHANGE = 2
+
+
+def _exchange(a: str, b: str) -> bool:
+    """Swap two paths in one atomic step; False where the OS cannot."""
+    try:
+        renameat2 = ctypes.CDLL(None, use_errno=True).renameat2
+    except (OSError, AttributeError):
+        return False
+    return renameat2(_AT_FDCWD, os.fsencode(a), _AT_FDCWD, os.fsencode(b), _RENAME_EXCHANGE) == 0
+
+
+def _flip(snapshot_dir: str):
+    """Point DATA_DIR at snapshot_dir with an atomic rename of a new symlink."""
+    data_dir = config.DATA_DIR.rstrip(os.sep)
+    tmp_link = data_dir + ".link.tmp"
+    if os.path.lexists(tmp_link):
+        os.remove(tmp_link)
+    os.symlink(snapshot_dir, tmp_link)
+    if os.path.isdir(data_dir) and not os.path.islink(data_dir):
+        # First rebuild: the plain data directory becomes a snapshot itself.
+        # A directory cannot be renamed over, so it is swapped with the link
+        # (without the swap, DATA_DIR is missing between the two renames)
+        initial = os.path.join(config.SNAPSHOTS_DIR, "snap_initial_" + uuid.uuid4().hex[:6])
+        if _exchange(tmp_link, data_dir):
+            os.rename(tmp_link, initial)
+            return
+        os.rename(data_dir, initial)
+    os.replace(tmp_link, data_dir)
+
+
+def live_snapshot() -> Optional[str]:
+    """The snapshot DATA_DIR points to (None while it is a plain directory)."""
+    data_dir = config.DATA_DIR.rstrip(os.sep)
+    if not os.path.islink(data_dir):
+        return None
+    return os.path.realpath(data_dir)
+
+
+def cleanup_snapshots():
+    """Delete old snapshots, keeping the live one and the SNAPSHOTS_KEEP newest others.
+
+    A few are kept so readers that started on an older snapshot can finish.
+    """
+    if not os.path.isdir(config.SNAPSHOTS_DIR):
+        return
+    live = live_snapshot()
+    old = []
+    for name in os.listdir(config.SNAPSHOTS_DIR):
+        path = os.path.join(config.SNAPSHOTS_DIR, name)
+        if name.endswith(".staging") or not os.path.isdir(path) or os.path.realpath(path) == live:
+            continue
+        old.append(path)
+    old.sort(key=os.path.getmtime, reverse=True)
+    for path in old[max(0, config.SNAPSHOTS_KEEP):]:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def rebuild_snapshot() -> str:
+    """Re-ingest all sources into a new snapshot and make it live.
+
+    Waits for running writers and holds new ones off until the flip (see
+    pec_parser.gate). Raises RebuildConflict (and discards the new snapshot)
+    if the catalog was changed anyway in the meantime. Returns the path of
+    the new snapshot.
+    """
+    with gate.exclusive():
+        # Deferred commits of on-access extractions belong to the old data
+        flush_deferred()
+        return _rebuild()
+
+
+def _rebuild() -> str:
+    stamp = storage.catalog_stamp()
+    catalog = storage.load_catalog()
+    files = _source_files(catalog)
+    identities = {
+        s["source_file"]: {"source_id": s["source_id"], "uploaded_at": s["uploaded_at"]}
+        for s in (catalog or {}).get("sources", [])
+    }
+
+    os.makedirs(config.SNAPSHOTS_DIR, exist_ok=True)
+    name = "snap_{}_{}".format(time.strftime("%Y%m%d%H%M%S"), uuid.uuid4().hex[:6])
+    staging = os.path.join(config.SNAPSHOTS_DIR, name + ".staging")
+    snapshot = os.path.join(config.SNAPSHOTS_DIR, name)
+    settings = _snapshot_settings(staging)
+
+    try:
+        os.makedirs(staging)
+        files = _stage_uploads(files, settings)
+        # A fresh interpreter: the staging config never leaks into this process
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"),
+                                 initializer=_init_worker, initargs=(settings,)) as pool:
+            pool.submit(_build_snapshot, files, identities).result()
+        os.rename(staging, snapshot)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+
+    with _write_lock:
+        if storage.catalog_stamp() != stamp:
+            shutil.rmtree(snapshot, ignore_errors=True)
+            raise RebuildConflict("catalog changed during the rebuild")
+        _flip(snapshot)
+    invalidate_catalog_cache()
+    cleanup_snapshots()
+    return snapshot
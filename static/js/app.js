@@ -1,8 +1,10 @@
 /* PEC Email Catalog - Frontend */
 
-let catalog = null;
+let sources = [];
 let currentEmailId = null;
 
+var EMAIL_FIELDS = "email_id,subject,sender,date,attachment_count";
+
 /* SVG Icons */
 var ICON_TRASH = '<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 20 20" fill="currentColor"><path fill-rule="evenodd" d="M8.75 1A2.75 2.75 0 006 3.75v.443c-.795.077-1.584.176-2.365.298a.75.75 0 10.23 1.482l.149-.022.841 10.518A2.75 2.75 0 007.596 19h4.807a2.75 2.75 0 002.742-2.53l.841-10.519.149.023a.75.75 0 00.23-1.482A41.03 41.03 0 0014 4.193V3.75A2.75 2.75 0 0011.25 1h-2.5zM10 4c.84 0 1.673.025 2.5.075V3.75c0-.69-.56-1.25-1.25-1.25h-2.5c-.69 0-1.25.56-1.25 1.25v.325C8.327 4.025 9.16 4 10 4zM8.58 7.72a.75.75 0 00-1.5.06l.3 7.5a.75.75 0 101.5-.06l-.3-7.5zm4.34.06a.75.75 0 10-1.5-.06l-.3 7.5a.75.75 0 101.5.06l.3-7.5z" clip-rule="evenodd"/></svg>';
 var ICON_PAPERCLIP = '<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 16 16" fill="currentColor"><path fill-rule="evenodd" d="M11.986 3A2.743 2.743 0 009.243.257a2.743 2.743 0 00-1.94.803L2.549 5.814a3.621 3.621 0 005.122 5.122l3.374-3.374a.75.75 0 00-1.06-1.06L6.61 9.875a2.121 2.121 0 01-3.001-3.001l4.754-4.754a1.243 1.243 0 011.758 1.758l-4.753 4.754a.364.364 0 01-.515-.515l3.374-3.374a.75.75 0 00-1.06-1.06L3.793 7.057a1.864 1.864 0 002.636 2.636l4.753-4.754A2.743 2.743 0 0011.986 3z" clip-rule="evenodd"/></svg>';
@@ -27,10 +29,7 @@ async function init() {
         var searchIcon = document.querySelector(".search-icon");
         if (searchIcon) searchIcon.innerHTML = ICON_SEARCH;
 
-        const resp = await fetch("/api/catalog");
-        catalog = await resp.json();
-        renderStats();
-        renderSources(catalog.sources);
+        await reloadCatalog();
         setupSearch();
         setupUpload();
     } catch (err) {
@@ -40,32 +39,45 @@ async function init() {
 
 async function reloadCatalog() {
     try {
-        const resp = await fetch("/api/catalog");
-        catalog = await resp.json();
+        const resp = await fetch("/api/sources");
+        sources = (await resp.json()).sources || [];
         renderStats();
-        renderSources(catalog.sources);
+        renderSources(sources);
     } catch (err) {
         console.error("Failed to reload catalog:", err);
     }
 }
 
+/* Fetch every page of a paginated /api/catalog query */
+async function fetchCatalogItems(params) {
+    var items = [];
+    var cursor = null;
+    do {
+        var url = "/api/catalog?limit=1000&" + params + (cursor ? "&cursor=" + cursor : "");
+        var resp = await fetch(url);
+        var data = await resp.json();
+        items = items.concat(data.items || []);
+        cursor = data.next_cursor;
+    } while (cursor);
+    return items;
+}
+
 function renderStats() {
-    var total = catalog.total_emails || 0;
-    var numSources = catalog.total_sources || (catalog.sources ? catalog.sources.length : 0);
+    var total = sources.reduce(function(sum, s) { return sum + s.email_count; }, 0);
     document.getElementById("stats").textContent =
-        total + " email in " + numSources + " file";
+        total + " email in " + sources.length + " file";
 }
 
-function renderSources(sources) {
+function renderSources(sourceList) {
     var container = document.getElementById("groups-list");
     container.innerHTML = "";
 
-    if (!sources || sources.length === 0) {
+    if (!sourceList || sourceList.length === 0) {
         container.innerHTML = '<div style="padding:32px 20px;color:#9ca3af;text-align:center;font-size:13px;">Nessuna sorgente disponibile.</div>';
         return;
     }
 
-    sources.forEach(function(source) {
+    sourceList.forEach(function(source) {
         // Source header
         var sourceHeader = document.createElement("div");
         sourceHeader.className = "source-header";
@@ -88,70 +100,31 @@ function renderSources(sources) {
         var sourceContent = document.createElement("div");
         sourceContent.className = "source-content";
 
-        // Build summary map for this source
-        var summaryMap = {};
-        (source.emails_summary || []).forEach(function(s) { summaryMap[s.email_id] = s; });
-
-        // Render groups inside this source
-        (source.groups || []).forEach(function(group) {
-            var header = document.createElement("div");
-            header.className = "group-header";
-            header.innerHTML =
-                '<span class="arrow">&#9654;</span>' +
-                '<span class="group-label" title="' + escapeHtml(group.label) + '">' +
-                    escapeHtml(group.label) +
-                '</span>' +
-                '<span class="count">' + group.email_ids.length + '</span>';
-
-            var emailsDiv = document.createElement("div");
-            emailsDiv.className = "group-emails";
-
-            group.email_ids.forEach(function(eid) {
-                var s = summaryMap[eid];
-                if (!s) return;
-                var item = document.createElement("div");
-                item.className = "email-item";
-                item.dataset.emailId = eid;
-
-                // Extract sender display name
-                var senderName = s.sender;
-                var atIdx = senderName.indexOf("@");
-                if (atIdx > 0) senderName = senderName.substring(0, atIdx);
-                // Capitalize first letter
-                senderName = senderName.charAt(0).toUpperCase() + senderName.slice(1);
-
-                var badges = '';
-                if (s.attachment_count > 0) {
-                    badges = '<div class="email-badges"><span class="att-badge">' +
-                        ICON_PAPERCLIP + ' ' + s.attachment_count + '</span></div>';
-                }
-
-                item.innerHTML =
-                    '<div class="email-sender">' +
-                        '<span class="email-sender-name">' + escapeHtml(senderName) + '</span>' +
-                        '<span class="email-date">' + escapeHtml(s.date) + '</span>' +
-                    '</div>' +
-                    '<div class="email-subject">' + escapeHtml(s.subject) + '</div>' +
-                    badges;
-
-                item.addEventListener("click", function() { loadEmail(eid); });
-                emailsDiv.appendChild(item);
-            });
-
-            header.addEventListener("click", function() {
-                header.classList.toggle("open");
-                emailsDiv.classList.toggle("open");
+        if (source.groups) {
+            // Groups already known (search results)
+            var summaryMap = {};
+            (source.emails_summary || []).forEach(function(s) { summaryMap[s.email_id] = s; });
+            source.groups.forEach(function(group) {
+                renderGroup(sourceContent, source, group, summaryMap);
             });
+        }
 
-            sourceContent.appendChild(header);
-            sourceContent.appendChild(emailsDiv);
-        });
-
-        // Toggle source expansion
-        sourceHeader.addEventListener("click", function(e) {
+        // Toggle source expansion, loading its groups the first time
+        var groupsLoaded = !!source.groups;
+        sourceHeader.addEventListener("click", async function(e) {
             if (e.target.closest(".delete-source-btn")) return;
             sourceHeader.classList.toggle("open");
             sourceContent.classList.toggle("open");
+            if (groupsLoaded) return;
+            groupsLoaded = true;
+            try {
+                var groups = await fetchCatalogItems(
+                    "view=groups&sort=-group_size&source_id=" + encodeURIComponent(source.source_id));
+                groups.forEach(function(group) { renderGroup(sourceContent, source, group, null); });
+            } catch (err) {
+                groupsLoaded = false;
+                console.error("Failed to load groups:", err);
+            }
         });
 
         // Delete button handler
@@ -166,6 +139,80 @@ function renderSources(sources) {
     });
 }
 
+function renderGroup(container, source, group, summaryMap) {
+    var count = group.email_ids ? group.email_ids.length : group.count;
+    var header = document.createElement("div");
+    header.className = "group-header";
+    header.innerHTML =
+        '<span class="arrow">&#9654;</span>' +
+        '<span class="group-label" title="' + escapeHtml(group.label) + '">' +
+            escapeHtml(group.label) +
+        '</span>' +
+        '<span class="count">' + count + '</span>';
+
+    var emailsDiv = document.createElement("div");
+    emailsDiv.className = "group-emails";
+
+    var emailsLoaded = false;
+    if (summaryMap) {
+        group.email_ids.forEach(function(eid) {
+            if (summaryMap[eid]) emailsDiv.appendChild(renderEmailItem(summaryMap[eid]));
+        });
+        emailsLoaded = true;
+    }
+
+    header.addEventListener("click", async function() {
+        header.classList.toggle("open");
+        emailsDiv.classList.toggle("open");
+        if (emailsLoaded) return;
+        emailsLoaded = true;
+        try {
+            var summaries = await fetchCatalogItems(
+                "sort=date&fields=" + EMAIL_FIELDS +
+                "&source_id=" + encodeURIComponent(source.source_id) +
+                "&group_id=" + encodeURIComponent(group.group_id));
+            summaries.forEach(function(s) { emailsDiv.appendChild(renderEmailItem(s)); });
+        } catch (err) {
+            emailsLoaded = false;
+            console.error("Failed to load group emails:", err);
+        }
+    });
+
+    container.appendChild(header);
+    container.appendChild(emailsDiv);
+}
+
+function renderEmailItem(s) {
+    var eid = s.email_id;
+    var item = document.createElement("div");
+    item.className = "email-item";
+    item.dataset.emailId = eid;
+
+    // Extract sender display name
+    var senderName = s.sender;
+    var atIdx = senderName.indexOf("@");
+    if (atIdx > 0) senderName = senderName.substring(0, atIdx);
+    // Capitalize first letter
+    senderName = senderName.charAt(0).toUpperCase() + senderName.slice(1);
+
+    var badges = '';
+    if (s.attachment_count > 0) {
+        badges = '<div class="email-badges"><span class="att-badge">' +
+            ICON_PAPERCLIP + ' ' + s.attachment_count + '</span></div>';
+    }
+
+    item.innerHTML =
+        '<div class="email-sender">' +
+            '<span class="email-sender-name">' + escapeHtml(senderName) + '</span>' +
+            '<span class="email-date">' + escapeHtml(s.date) + '</span>' +
+        '</div>' +
+        '<div class="email-subject">' + escapeHtml(s.subject) + '</div>' +
+        badges;
+
+    item.addEventListener("click", function() { loadEmail(eid); });
+    return item;
+}
+
 /* ─── Confirm modal ─── */
 
 function showConfirmModal(message) {
@@ -344,7 +391,7 @@ function setupSearch() {
         var q = input.value.trim();
         timer = setTimeout(function() {
             if (q.length < 2) {
-                renderSources(catalog.sources);
+                renderSources(sources);
                 document.getElementById("sidebar").classList.remove("search-active");
                 return;
             }
@@ -356,7 +403,7 @@ function setupSearch() {
         input.value = "";
         updateClearBtn();
         input.focus();
-        renderSources(catalog.sources);
+        renderSources(sources);
         document.getElementById("sidebar").classList.remove("search-active");
     });
 }
@@ -383,9 +430,17 @@ function setupUpload() {
             .then(function(data) {
                 if (data.error) {
                     alert("Errore: " + data.error);
-                } else {
-                    reloadCatalog();
+                    return;
                 }
+                return waitForJob(data.job_id, function(job) {
+                    btn.textContent = jobProgressText(job);
+                }).then(function(job) {
+                    if (job.status === "failed") {
+                        alert("Errore: " + job.error);
+                    } else {
+                        reloadCatalog();
+                    }
+                });
             })
             .catch(function(err) {
                 console.error("Upload failed:", err);
@@ -399,6 +454,42 @@ function setupUpload() {
     });
 }
 
+// Poll /api/jobs/<id> until the ingest job finishes; onProgress gets each status
+function waitForJob(jobId, onProgress) {
+    return new Promise(function(resolve, reject) {
+        function poll() {
+            fetch("/api/jobs/" + encodeURIComponent(jobId))
+                .then(function(resp) { return resp.json(); })
+                .then(function(job) {
+                    if (job.error && !job.status) {
+                        reject(new Error(job.error));
+                    } else if (job.status === "done" || job.status === "failed") {
+                        resolve(job);
+                    } else {
+                        onProgress(job);
+                        setTimeout(poll, 1000);
+                    }
+                })
+                .catch(reject);
+        }
+        poll();
+    });
+}
+
+function jobProgressText(job) {
+    if (job.status === "queued" || !job.phase) return "In coda...";
+    var text = "Elaborazione (" + job.phase + ")";
+    if (job.phase === "parse" && job.total) {
+        text += " " + job.processed + "/" + job.total;
+    } else if (job.phase === "parse" && job.bytes_total) {
+        text += " " + job.processed + " (" + Math.floor(100 * job.bytes_read / job.bytes_total) + "%)";
+    }
+    if (job.phase === "parse" && job.eta_seconds !== null) {
+        text += ", ~" + Math.ceil(job.eta_seconds) + "s";
+    }
+    return text + "...";
+}
+
 async function searchEmails(query) {
     try {
         var resp = await fetch("/api/search?q=" + encodeURIComponent(query));
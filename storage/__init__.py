@@ -0,0 +1,65 @@
+"""Catalog and email storage.
+
+The functions below dispatch to the backend selected by config.STORAGE_BACKEND
+("json": storage.json_store, "sqlite": storage.sqlite_store). Both implement
+the same contract.
+"""
+
+import importlib
+
+import config
+
+
+_BACKENDS = {
+    "json": "storage.json_store",
+    "sqlite": "storage.sqlite_store",
+}
+
+
+def get_backend():
+    """The storage module selected by config.STORAGE_BACKEND."""
+    try:
+        name = _BACKENDS[config.STORAGE_BACKEND]
+    except KeyError:
+        raise ValueError("Unknown STORAGE_BACKEND: {!r}".format(config.STORAGE_BACKEND))
+    return importlib.import_module(name)
+
+
+def save_email(email):
+    return get_backend().save_email(email)
+
+
+def email_batch():
+    return get_backend().email_batch()
+
+
+def load_email(email_id):
+    return get_backend().load_email(email_id)
+
+
+def delete_emails(email_ids):
+    return get_backend().delete_emails(email_ids)
+
+
+def iter_emails():
+    return get_backend().iter_emails()
+
+
+def save_catalog(sources, groups=None):
+    return get_backend().save_catalog(sources, groups)
+
+
+def load_catalog():
+    return get_backend().load_catalog()
+
+
+def update_catalog(mutate):
+    return get_backend().update_catalog(mutate)
+
+
+def delete_source(source_id):
+    return get_backend().delete_source(source_id)
+
+
+def catalog_stamp():
+    return get_backend().catalog_stamp()
@@ -0,0 +1,223 @@
+"""Content-addressed attachment store: one file per distinct payload.
+
+Blobs are keyed by the SHA-256 of their content and sharded as
+data/blobs/ab/cd/<digest>. The per-email manifest (filename -> blob) is the
+email's attachment list, whose entries carry the blob digest. The blobs
+each email uses are rows of a SQLite table (config.BLOB_REFS_PATH), indexed
+both ways, so a blob is deleted only when the last email using it goes
+away and an update touches only the rows of its emails.
+
+A blob orphaned while other writers run (one of them may be about to
+reference it again) is left on disk, as are the blobs of aborted or failed
+ingests: collect_blobs deletes every unreferenced blob.
+"""
+
+import hashlib
+import json
+import os
+import threading
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from pec_parser import gate, metrics
+from storage.sqlite_db import Database
+import config
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS refs (
+    email_id TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    PRIMARY KEY (email_id, digest)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS refs_digest ON refs (digest);
+"""
+
+_db = Database("BLOB_REFS_PATH", _SCHEMA)
+_refs_lock = threading.Lock()
+# Orphaned blobs left on disk because other writers were running
+_stranded: Set[str] = set()
+# References recorded with defer=True (emails extracted on access), applied
+# by the next update or flush_blob_refs, before any orphan is computed
+_deferred_refs: Dict[str, List[str]] = {}
+
+
+def blob_path(digest: str) -> str:
+    return os.path.join(config.BLOBS_DIR, digest[:2], digest[2:4], digest)
+
+
+def put_blob_stream(chunks: Iterable[bytes]) -> Tuple[str, int]:
+    """Store a payload arriving in chunks (if not already stored), hashing it
+    on the way; returns (digest, size). Memory is bounded by the chunk size.
+    """
+    os.makedirs(config.BLOBS_DIR, exist_ok=True)
+    # Unique temp name: several ingest processes may write the same blob
+    tmp_path = os.path.join(config.BLOBS_DIR, "incoming.{}.{}.tmp".format(
+        os.getpid(), threading.get_ident()))
+    sha = hashlib.sha256()
+    size = 0
+    try:
+        with open(tmp_path, "wb") as f:
+            for chunk in chunks:
+                sha.update(chunk)
+                f.write(chunk)
+                size += len(chunk)
+        digest = sha.hexdigest()
+        path = blob_path(digest)
+        if os.path.exists(path):
+            os.remove(tmp_path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return digest, size
+
+
+def put_blob(payload: bytes) -> str:
+    """Store payload (if not already stored) and return its digest."""
+    digest = hashlib.sha256(payload).hexdigest()
+    if os.path.exists(blob_path(digest)):
+        return digest
+    return put_blob_stream([payload])[0]
+
+
+def _legacy_refs_path() -> str:
+    return os.path.join(config.BLOBS_DIR, "refs.json")
+
+
+def _import_legacy_refs(conn):
+    """Move the references of a data directory written before the table
+    (data/blobs/refs.json, email_id -> digests) into it."""
+    path = _legacy_refs_path()
+    if not os.path.exists(path):
+        return
+    with open(path, "r", encoding="utf-8") as f:
+        refs = json.load(f)
+    _insert_refs(conn, refs)
+    os.remove(path)
+
+
+def _insert_refs(conn, refs: Dict[str, List[str]]):
+    conn.executemany(
+        "INSERT OR IGNORE INTO refs (email_id, digest) VALUES (?, ?)",
+        ((eid, digest) for eid, digests in refs.items() for digest in digests),
+    )
+
+
+def _referenced(conn, digest: str) -> bool:
+    return conn.execute("SELECT 1 FROM refs WHERE digest = ? LIMIT 1", (digest,)).fetchone() is not None
+
+
+def _remove_blob(digest: str):
+    try:
+        os.remove(blob_path(digest))
+    except FileNotFoundError:
+        pass
+
+
+@metrics.stage("blob_refs")
+def update_blob_refs(additions: Dict[str, List[str]], remove_ids: Iterable[str] = (),
+                     defer: bool = False) -> List[str]:
+    """Record the blobs used by each email (replacing what it used before) and
+    drop the emails in remove_ids; blobs no email references any more are
+    deleted, unless another writer is running (see collect_blobs). Returns
+    the digests that were deleted.
+
+    With defer, additions are only queued in memory until the next update or
+    flush_blob_refs.
+    """
+    if defer:
+        with _refs_lock:
+            _deferred_refs.update(additions)
+        return []
+    remove_ids = set(remove_ids)
+    with _refs_lock:
+        pending = {eid: digests for eid, digests in _deferred_refs.items() if eid not in remove_ids}
+        # Blobs of deferred references dropped before ever being written
+        released = {digest for eid, digests in _deferred_refs.items() if eid in remove_ids
+                    for digest in digests}
+        _deferred_refs.clear()
+        pending.update(additions)
+
+        with _db.transaction() as conn:
+            _import_legacy_refs(conn)
+            for eid in remove_ids | set(pending):
+                released.update(digest for (digest,) in conn.execute(
+                    "SELECT digest FROM refs WHERE email_id = ?", (eid,)))
+                conn.execute("DELETE FROM refs WHERE email_id = ?", (eid,))
+            _insert_refs(conn, pending)
+            orphaned = sorted(digest for digest in released if not _referenced(conn, digest))
+
+        if not orphaned:
+            return []
+        # New writers wait meanwhile; a running one may have found one of
+        # these blobs already stored and be about to reference it
+        with gate.alone() as alone:
+            if not alone:
+                _stranded.update(orphaned)
+                return []
+            for digest in orphaned:
+                _remove_blob(digest)
+        return orphaned
+
+
+def release_blob_refs(email_ids: Iterable[str]) -> List[str]:
+    """Drop the references of deleted emails, deleting orphaned blobs."""
+    email_ids = list(email_ids)
+    if not email_ids or not (_db.exists() or os.path.exists(_legacy_refs_path()) or _deferred_refs):
+        return []
+    return update_blob_refs({}, email_ids)
+
+
+def flush_blob_refs():
+    """Write the deferred references to the table, if any."""
+    if _deferred_refs:
+        update_blob_refs({})
+
+
+def blobs_stranded() -> bool:
+    """Whether orphaned blobs were left on disk since the last collection."""
+    return bool(_stranded)
+
+
+@metrics.stage("collect_blobs")
+def collect_blobs() -> List[str]:
+    """Delete every stored blob no email references (orphaned while other
+    writers ran, or written by an aborted or failed ingest) and leftover
+    temporary files. Run with the writers gate held exclusively: with an
+    ingest running, a blob it wrote may not be referenced yet. Returns the
+    digests deleted."""
+    if not os.path.isdir(config.BLOBS_DIR):
+        return []
+    removed = []
+    with _refs_lock:
+        _stranded.clear()
+        deferred = {digest for digests in _deferred_refs.values() for digest in digests}
+        with _db.transaction() as conn:
+            _import_legacy_refs(conn)
+        conn = _db.connect()
+        for root, _, files in os.walk(config.BLOBS_DIR):
+            for name in files:
+                if name.endswith(".tmp"):
+                    os.remove(os.path.join(root, name))
+                elif name not in deferred and not _referenced(conn, name):
+                    os.remove(os.path.join(root, name))
+                    removed.append(name)
+    return removed
+
+
+def resolve_attachment(data: Optional[Dict], filename: str) -> Optional[Dict]:
+    """The attachment entry named filename of an email document, with its
+    blob path under "path" (None if the email, the entry or its blob is
+    missing)."""
+    if data is None:
+        return None
+    for att in data.get("attachments", []):
+        if att.get("filename") == filename and att.get("blob"):
+            path = blob_path(att["blob"])
+            if not os.path.exists(path):
+                return None
+            return dict(att, path=path)
+    return None
@@ -1,63 +1,458 @@
 """Save/load catalog and email data as JSON files."""
 
+import bisect
 import hashlib
 import json
 import os
 import shutil
-from datetime import datetime
-from typing import List, Optional, Dict
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set
 
-from pec_parser.models import ParsedEmail, EmailGroup
+from pec_parser.models import ParsedEmail, EmailGroup, EmailSummary
+from pec_parser.grouper import GroupIndex
+from pec_parser.subject_cleaner import clean_subject
+from pec_parser.fingerprints import drop_fingerprints
+from pec_parser.dedup import forget_emails
+from pec_parser import metrics
+from storage.search_index import remove_from_search_index
+from storage.blob_store import release_blob_refs
+import storage
 import config
 
 
+class CatalogView:
+    """Parsed catalog plus structures derived from it, shared between requests.
+
+    Treat as read-only: instances are cached and handed to every caller.
+    """
+
+    def __init__(self, catalog: Dict):
+        self.catalog = catalog
+        self.summaries: List[Dict] = []
+        self.by_id: Dict[str, Dict] = {}
+        self.sources: List[Dict] = []
+        # Lowercased "subject sender clean_subject" per summary, for /api/search
+        self.search_text: Dict[str, str] = {}
+        # UTC epoch per email (None if unknown)
+        self.timestamps: Dict[str, Optional[int]] = {}
+        for source in catalog.get("sources", []):
+            for summary in source.get("emails_summary", []):
+                if summary["email_id"] not in self.by_id:
+                    self.by_id[summary["email_id"]] = summary
+                    self.summaries.append(summary)
+                    self.timestamps[summary["email_id"]] = summary_timestamp(summary)
+                    self.search_text[summary["email_id"]] = " ".join([
+                        summary.get("subject", ""),
+                        summary.get("sender", ""),
+                        summary.get("clean_subject", ""),
+                    ]).lower()
+            self.sources.append({
+                "source_id": source["source_id"],
+                "source_file": source["source_file"],
+                "uploaded_at": source.get("uploaded_at", ""),
+                "email_count": source["email_count"],
+            })
+        # Date index: dated summaries in chronological order, for range queries
+        dated = sorted(
+            (self.timestamps[s["email_id"]], n) for n, s in enumerate(self.summaries)
+            if self.timestamps[s["email_id"]] is not None
+        )
+        self._times: List[int] = [ts for ts, _ in dated]
+        self._by_time: List[Dict] = [self.summaries[n] for _, n in dated]
+        self.position: Dict[str, int] = {s["email_id"]: n for n, s in enumerate(self.summaries)}
+        # Facet indexes: facet -> value -> ids of the emails with that value
+        self.facets: Dict[str, Dict[str, Set[str]]] = {name: {} for name in FACETS}
+        for summary in self.summaries:
+            eid = summary["email_id"]
+            for name, value in facet_values(summary, self.timestamps[eid]).items():
+                self.facets[name].setdefault(value, set()).add(eid)
+        # Global groups split per source: lightweight entries and derived lookups
+        self.groups: List[Dict] = []
+        self.group_size: Dict[str, int] = {}
+        self.group_members: Dict[str, set] = {}
+        self.source_members: Dict[str, set] = {}
+        sources_of: Dict[str, List[Dict]] = {}
+        for source in catalog.get("sources", []):
+            self.source_members[source["source_id"]] = {
+                summary["email_id"] for summary in source.get("emails_summary", [])
+            }
+            for eid in self.source_members[source["source_id"]]:
+                sources_of.setdefault(eid, []).append(source)
+        source_order = {s["source_id"]: i for i, s in enumerate(catalog.get("sources", []))}
+        self.source_groups: Dict[str, List[Dict]] = {sid: [] for sid in source_order}
+        self.group_index = load_group_index(catalog)
+        for group in self.group_index.to_list():
+            self.group_members[group["group_id"]] = set(group["email_ids"])
+            per_source: Dict[str, List[str]] = {}
+            for eid in group["email_ids"]:
+                self.group_size[eid] = len(group["email_ids"])
+                for source in sources_of.get(eid, []):
+                    per_source.setdefault(source["source_id"], []).append(eid)
+            for sid in sorted(per_source, key=source_order.get):
+                ids = per_source[sid]
+                first = self.by_id.get(ids[0])
+                self.source_groups[sid].append({
+                    "group_id": group["group_id"],
+                    "label": group["label"],
+                    "count": len(ids),
+                    "date": first.get("date", "") if first else "",
+                    "timestamp": self.timestamps.get(ids[0]),
+                    "source_id": sid,
+                    "source_file": catalog["sources"][source_order[sid]]["source_file"],
+                    "email_ids": ids,
+                })
+        for sid in source_order:
+            # Multi-email groups first, then singletons; within each, by date
+            self.source_groups[sid].sort(key=lambda g: (-g["count"], _time_key(g["timestamp"])))
+            self.groups.extend(self.source_groups[sid])
+        self._ordered: Dict[tuple, List[Dict]] = {}
+        self._json = None
+
+    def to_json(self) -> str:
+        """The catalog serialized once for /api/catalog.
+
+        Each source still lists its share of the global groups, so clients
+        of the full dump see the same shape as before the global index.
+        """
+        if self._json is None:
+            payload = dict(self.catalog)
+            payload["groups"] = self.group_index.to_list()
+            payload["sources"] = [
+                dict(source, groups=[
+                    {"group_id": g["group_id"], "label": g["label"], "email_ids": g["email_ids"]}
+                    for g in self.source_groups[source["source_id"]]
+                ])
+                for source in self.catalog.get("sources", [])
+            ]
+            self._json = json.dumps(payload, ensure_ascii=False)
+        return self._json
+
+    def between(self, since: Optional[int] = None, until: Optional[int] = None) -> List[Dict]:
+        """Summaries dated since <= timestamp <= until (epoch seconds, either
+        bound optional), oldest first: a binary search on the date index."""
+        lo = 0 if since is None else bisect.bisect_left(self._times, since)
+        hi = len(self._times) if until is None else bisect.bisect_right(self._times, until)
+        return self._by_time[lo:hi]
+
+    def in_order(self, email_ids) -> List[Dict]:
+        """Summaries of email_ids, in catalog order."""
+        return [self.by_id[eid] for eid in sorted(email_ids, key=self.position.__getitem__)]
+
+    def facet_ids(self, filters: Dict[str, List[str]], skip: Optional[str] = None) -> Optional[Set[str]]:
+        """Ids matching every facet in filters (any of its values), by
+        intersecting the facet indexes; None when nothing is filtered.
+
+        skip leaves one facet's filter out.
+        """
+        result = None
+        for name, values in filters.items():
+            if name == skip or not values:
+                continue
+            index = self.facets[name]
+            ids = set().union(*(index.get(value, ()) for value in values))
+            result = ids if result is None else result & ids
+        return result
+
+    def facet_counts(self, filters: Dict[str, List[str]], base: Optional[Set[str]] = None) -> Dict[str, List[Dict]]:
+        """Per facet, the count of each value among the emails in base (all
+        if None) that match the filters on the other facets, so the
+        alternatives to a selected value keep their counts. Largest first.
+        """
+        counts = {}
+        for name in FACETS:
+            scope = self.facet_ids(filters, skip=name)
+            if base is not None:
+                scope = base if scope is None else scope & base
+            entries = []
+            for value, ids in self.facets[name].items():
+                count = len(ids) if scope is None else len(ids & scope)
+                if count:
+                    entries.append({"value": value, "count": count})
+            entries.sort(key=lambda e: (-e["count"], e["value"]))
+            counts[name] = entries
+        return counts
+
+    def ordered(self, kind: str, sort_key: str, reverse: bool = False,
+                source_id: Optional[str] = None, group_id: Optional[str] = None,
+                since: Optional[int] = None, until: Optional[int] = None) -> List[Dict]:
+        """Summaries (kind="emails") or group entries (kind="groups"), filtered and sorted.
+
+        sort_key is one of EMAIL_SORT_KEYS / GROUP_SORT_KEYS. since/until
+        restrict to a date range (groups: by the date of their first email).
+        Results are memoized per view, except for group_id and date filters.
+        """
+        memoize = group_id is None and since is None and until is None
+        memo_key = (kind, sort_key, reverse, source_id)
+        if memoize and memo_key in self._ordered:
+            return self._ordered[memo_key]
+
+        if kind == "groups":
+            items = self.groups
+            if since is not None or until is not None:
+                items = [g for g in items if g["timestamp"] is not None
+                         and (since is None or g["timestamp"] >= since)
+                         and (until is None or g["timestamp"] <= until)]
+            if source_id is not None:
+                items = [g for g in items if g["source_id"] == source_id]
+            if group_id is not None:
+                items = [g for g in items if g["group_id"] == group_id]
+            key_funcs = {
+                "date": lambda g: _time_key(g["timestamp"]),
+                "group_size": lambda g: g["count"],
+                "label": lambda g: g["label"].lower(),
+            }
+        else:
+            items = self.summaries
+            if since is not None or until is not None:
+                items = self.between(since, until)
+            if source_id is not None:
+                members = self.source_members.get(source_id, set())
+                items = [s for s in items if s["email_id"] in members]
+            if group_id is not None:
+                members = self.group_members.get(group_id, set())
+                items = [s for s in items if s["email_id"] in members]
+            key_funcs = {
+                "date": lambda s: _time_key(self.timestamps[s["email_id"]]),
+                "sender": lambda s: (s.get("sender") or "").lower(),
+                "group_size": lambda s: self.group_size.get(s["email_id"], 1),
+            }
+        result = sorted(items, key=key_funcs[sort_key], reverse=reverse)
+        if memoize:
+            self._ordered[memo_key] = result
+        return result
+
+
+EMAIL_SORT_KEYS = ("date", "sender", "group_size")
+GROUP_SORT_KEYS = ("date", "group_size", "label")
+
+
+# Facets of /api/facets and the facet filters of /api/search
+FACETS = ("sender", "sender_domain", "pec_provider", "pec_type", "has_attachments", "month")
+
+
+def facet_values(summary: Dict, timestamp: Optional[int]) -> Dict[str, str]:
+    """The value of each facet an email has (sender addresses lowercased,
+    has_attachments "true"/"false", month "YYYY-MM" in UTC)."""
+    values = {"has_attachments": "true" if summary.get("attachment_count") else "false"}
+    sender = (summary.get("sender") or "").lower()
+    if sender:
+        values["sender"] = sender
+        if "@" in sender:
+            values["sender_domain"] = sender.rsplit("@", 1)[1]
+    if summary.get("pec_provider"):
+        values["pec_provider"] = summary["pec_provider"]
+    if summary.get("pec_type"):
+        values["pec_type"] = summary["pec_type"]
+    if timestamp is not None:
+        values["month"] = datetime.fromtimestamp(timestamp, timezone.utc).strftime("%Y-%m")
+    return values
+
+
+def summary_timestamp(summary: Dict) -> Optional[int]:
+    """UTC epoch of a summary; summaries stored before timestamps existed
+    fall back to their "%d/%m/%Y %H:%M" display date, read as UTC."""
+    if summary.get("timestamp") is not None:
+        return summary["timestamp"]
+    try:
+        dt = datetime.strptime(summary.get("date") or "", "%d/%m/%Y %H:%M")
+    except ValueError:
+        return None
+    return int(dt.replace(tzinfo=timezone.utc).timestamp())
+
+
+def _time_key(timestamp: Optional[int]):
+    """Chronological sort key (undated last)."""
+    return (timestamp is None, timestamp or 0)
+
+
+# Catalog cache: reloaded when the stored catalog changes (storage.catalog_stamp(),
+# checked at most every CATALOG_CACHE_CHECK_INTERVAL seconds) or when this
+# process bumps the version after a write.
+_catalog_lock = threading.Lock()
+_catalog_cache = {"version": 0, "key": None, "checked_at": 0.0, "view": None}
+
+# Serializes catalog read-modify-write cycles within this process
+_write_lock = threading.RLock()
+
+
+def invalidate_catalog_cache():
+    """Force the next get_catalog_view() to reload the catalog."""
+    with _catalog_lock:
+        _catalog_cache["version"] += 1
+
+
+def _storage_location():
+    return (config.STORAGE_BACKEND, config.CATALOG_PATH, config.SQLITE_PATH)
+
+
+def get_catalog_view() -> Optional[CatalogView]:
+    """Return the cached CatalogView, or None if there is no catalog."""
+    with _catalog_lock:
+        version = _catalog_cache["version"]
+        now = time.monotonic()
+        key = _catalog_cache["key"]
+        location = _storage_location()
+        stale = (
+            key is None
+            or key[0] != version
+            or key[1] != location
+            or key[2] is None
+            or now - _catalog_cache["checked_at"] >= config.CATALOG_CACHE_CHECK_INTERVAL
+        )
+        if stale:
+            key = (version, location, storage.catalog_stamp())
+            _catalog_cache["checked_at"] = now
+        if key != _catalog_cache["key"]:
+            catalog = storage.load_catalog() if key[2] is not None else None
+            _catalog_cache["view"] = CatalogView(catalog) if catalog is not None else None
+            _catalog_cache["key"] = key
+        return _catalog_cache["view"]
+
+
 def generate_source_id(source_file: str) -> str:
     """Generate a unique source ID from filename + timestamp."""
     raw = source_file + datetime.now().isoformat()
     return "src_" + hashlib.md5(raw.encode()).hexdigest()[:12]
 
 
-def save_catalog(sources: List[Dict]):
-    """Save the full hierarchical catalog: catalog.json + individual email JSONs.
+def _write_json(path: str, data) -> int:
+    """Write a JSON file atomically (temp file + rename), so readers and
+    crashes never see a half-written file. Returns the bytes written."""
+    # Per writer, so two threads rewriting the same file never share one
+    tmp_path = "{}.{}.{}.tmp".format(path, os.getpid(), threading.get_ident())
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+            size = f.tell()
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return size
 
-    Each source dict must have:
-        source_id, source_file, uploaded_at, email_count,
-        groups (list of group dicts), emails_summary (list of summary dicts),
-        _emails (list of ParsedEmail objects, used to write individual JSONs, then stripped)
-    """
+
+def _normalize_catalog(catalog: Dict) -> Dict:
+    """Recompute the totals of a catalog dict in place."""
+    sources = catalog.setdefault("sources", [])
+    catalog["total_emails"] = sum(s["email_count"] for s in sources)
+    catalog["total_sources"] = len(sources)
+    return catalog
+
+
+@metrics.stage("save_catalog")
+def _write_catalog(catalog: Dict):
     os.makedirs(config.DATA_DIR, exist_ok=True)
+    _write_json(config.CATALOG_PATH, _normalize_catalog(catalog))
+    invalidate_catalog_cache()
+
+
+def catalog_stamp():
+    """Token that changes whenever catalog.json is rewritten (None if missing)."""
+    try:
+        st = os.stat(config.CATALOG_PATH)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+def save_email(email: ParsedEmail):
+    """Write a single email JSON (data/emails/<email_id>.json)."""
     os.makedirs(config.EMAILS_DIR, exist_ok=True)
+    path = os.path.join(config.EMAILS_DIR, email.email_id + ".json")
+    # Atomically: lazy extraction rewrites documents while requests read them
+    metrics.count("bytes_written", _write_json(path, email.to_dict()))
+
+
+@contextmanager
+def email_batch():
+    """Group the save_email calls of a block (a no-op: each email is its own file)."""
+    yield
 
-    total_emails = sum(s["email_count"] for s in sources)
 
-    # Write individual email JSONs (dedup by email_id)
+def _catalog_from_sources(sources: List[Dict], groups: Optional[List[Dict]],
+                          write_email: Callable[[ParsedEmail], None]) -> Dict:
+    """Catalog dict for save_catalog, writing any pending _emails on the way."""
     written = set()
     for source in sources:
         for email in source.pop("_emails", []):
             if email.email_id not in written:
-                path = os.path.join(config.EMAILS_DIR, email.email_id + ".json")
-                with open(path, "w", encoding="utf-8") as f:
-                    json.dump(email.to_dict(), f, ensure_ascii=False, indent=2)
+                write_email(email)
                 written.add(email.email_id)
 
-    catalog = {
-        "total_emails": total_emails,
-        "total_sources": len(sources),
-        "sources": sources,
-    }
+    catalog = {"sources": sources}
+    if groups is not None:
+        catalog["groups"] = groups
+    return _normalize_catalog(catalog)
+
+
+def save_catalog(sources: List[Dict], groups: Optional[List[Dict]] = None):
+    """Save the full hierarchical catalog: catalog.json (+ individual email JSONs).
+
+    groups is the global group index (GroupIndex.to_list()), stored once at
+    the top level instead of per source.
+
+    Each source dict must have:
+        source_id, source_file, uploaded_at, email_count,
+        emails_summary (list of summary dicts)
+    and may have:
+        _emails (list of ParsedEmail objects not yet written with save_email;
+        their JSONs are written, then the key is stripped)
+    """
+    os.makedirs(config.EMAILS_DIR, exist_ok=True)
+    catalog = _catalog_from_sources(sources, groups, save_email)
+    with _write_lock:
+        _write_catalog(catalog)
 
-    with open(config.CATALOG_PATH, "w", encoding="utf-8") as f:
-        json.dump(catalog, f, ensure_ascii=False, indent=2)
+
+def update_catalog(mutate: Callable[[Dict], object]):
+    """Apply mutate(catalog) to the stored catalog and save it, atomically.
+
+    mutate gets a fresh catalog dict (empty if none exists yet), edits it in
+    place and may return a value, which is passed back to the caller.
+    """
+    with _write_lock:
+        catalog = load_catalog() or {"sources": []}
+        result = mutate(catalog)
+        _write_catalog(catalog)
+    return result
 
 
 def load_catalog() -> Optional[Dict]:
-    """Load catalog.json if it exists."""
+    """Load catalog.json if it exists (fresh copy, safe to modify)."""
     if not os.path.exists(config.CATALOG_PATH):
         return None
     with open(config.CATALOG_PATH, "r", encoding="utf-8") as f:
         return json.load(f)
 
 
+def load_group_index(catalog: Optional[Dict]) -> GroupIndex:
+    """GroupIndex for a loaded catalog.
+
+    Catalogs written before the global index (groups stored per source) are
+    regrouped once from their summaries, in catalog order.
+    """
+    if catalog is None:
+        return GroupIndex()
+    if "groups" in catalog:
+        return GroupIndex(catalog["groups"])
+    index = GroupIndex()
+    for source in catalog.get("sources", []):
+        index.assign([EmailSummary.from_dict(d) for d in source.get("emails_summary", [])])
+    return index
+
+
+def group_subjects(summaries: Iterable[Dict]) -> Dict[str, str]:
+    """email_id -> clean subject of summary dicts, for GroupIndex.remove."""
+    return {
+        s["email_id"]: s.get("clean_subject") or clean_subject(s.get("subject", ""))
+        for s in summaries
+    }
+
+
 def load_email(email_id: str) -> Optional[Dict]:
     """Load a single email JSON by ID."""
     path = os.path.join(config.EMAILS_DIR, email_id + ".json")
@@ -67,31 +462,40 @@ def load_email(email_id: str) -> Optional[Dict]:
         return json.load(f)
 
 
-def delete_source(source_id: str) -> bool:
-    """Delete a source and its exclusive email data.
+def delete_emails(email_ids):
+    """Delete the stored documents of the given emails."""
+    for eid in email_ids:
+        email_path = os.path.join(config.EMAILS_DIR, eid + ".json")
+        if os.path.exists(email_path):
+            os.remove(email_path)
 
-    1. Load catalog, find and remove the source
-    2. Collect email_ids exclusive to the removed source
-    3. Delete their JSON files and attachment dirs
-    4. Delete uploaded .mbox file if it exists
-    5. Save updated catalog
-    Returns True if source was found and deleted.
-    """
-    catalog = load_catalog()
-    if catalog is None:
-        return False
 
-    sources = catalog.get("sources", [])
+def iter_emails() -> Iterator[Dict]:
+    """Yield every stored email document."""
+    if not os.path.isdir(config.EMAILS_DIR):
+        return
+    for name in os.listdir(config.EMAILS_DIR):
+        if not name.endswith(".json"):
+            continue
+        with open(os.path.join(config.EMAILS_DIR, name), "r", encoding="utf-8") as f:
+            yield json.load(f)
+
+
+def _detach_source(catalog: Dict, source_id: str):
+    """Remove a source from a catalog dict (in place), pruning the global groups.
+
+    Returns (source, exclusive_ids): the removed source (None if not found)
+    and the email_ids no remaining source references.
+    """
     target = None
     remaining = []
-    for s in sources:
-        if s["source_id"] == source_id:
+    for s in catalog.get("sources", []):
+        if s["source_id"] == source_id and target is None:
             target = s
         else:
             remaining.append(s)
-
     if target is None:
-        return False
+        return None, set()
 
     # email_ids in the removed source
     removed_ids = set()
@@ -104,27 +508,56 @@ def delete_source(source_id: str) -> bool:
         for summary in s.get("emails_summary", []):
             kept_ids.add(summary["email_id"])
 
-    # Only delete emails exclusive to the removed source
+    # Only emails exclusive to the removed source go away
     exclusive_ids = removed_ids - kept_ids
+    index = load_group_index(catalog)
+    index.remove(exclusive_ids,
+                 group_subjects(e for s in remaining for e in s.get("emails_summary", [])))
+
+    catalog["sources"] = remaining
+    catalog["groups"] = index.to_list()
+    _normalize_catalog(catalog)
+    return target, exclusive_ids
+
+
+def _remove_source_files(source: Dict, exclusive_ids):
+    """Delete attachment dirs, blob references, index postings and dedup
+    entries of removed emails, and the uploaded .mbox and fingerprint cache
+    of the source."""
     for eid in exclusive_ids:
-        email_path = os.path.join(config.EMAILS_DIR, eid + ".json")
-        if os.path.exists(email_path):
-            os.remove(email_path)
         att_dir = os.path.join(config.ATTACHMENTS_DIR, eid)
         if os.path.isdir(att_dir):
             shutil.rmtree(att_dir)
+    release_blob_refs(exclusive_ids)
+    remove_from_search_index(exclusive_ids)
+    forget_emails(exclusive_ids)
 
-    # Delete uploaded .mbox file
-    mbox_path = os.path.join(config.UPLOADS_DIR, target["source_file"])
+    mbox_path = os.path.join(config.UPLOADS_DIR, source["source_file"])
     if os.path.exists(mbox_path):
         os.remove(mbox_path)
+    drop_fingerprints(source["source_file"])
 
-    # Save updated catalog
-    catalog["sources"] = remaining
-    catalog["total_sources"] = len(remaining)
-    catalog["total_emails"] = sum(s["email_count"] for s in remaining)
 
-    with open(config.CATALOG_PATH, "w", encoding="utf-8") as f:
-        json.dump(catalog, f, ensure_ascii=False, indent=2)
+def delete_source(source_id: str) -> bool:
+    """Delete a source and its exclusive email data.
+
+    1. Load catalog, find and remove the source (and its exclusive emails
+       from the global group index)
+    2. Save the updated catalog
+    3. Delete the exclusive emails' JSON files and attachment dirs and prune
+       them from the search index
+    4. Delete uploaded .mbox file if it exists
+    Returns True if source was found and deleted.
+    """
+    with _write_lock:
+        catalog = load_catalog()
+        if catalog is None:
+            return False
+        target, exclusive_ids = _detach_source(catalog, source_id)
+        if target is None:
+            return False
+        _write_catalog(catalog)
 
+    delete_emails(exclusive_ids)
+    _remove_source_files(target, exclusive_ids)
     return True
@@ -0,0 +1,225 @@
+"""On-disk inverted full-text index: token -> email_id postings.
+
+Postings are rows of a SQLite table (config.SEARCH_INDEX_PATH) keyed by
+(token, email_id), with a secondary index on email_id: prefix lookups scan a
+key range, and re-indexing or removing an email touches only its own rows.
+"""
+
+import html
+import re
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, Optional, Set
+
+import config
+from pec_parser import metrics
+from storage.sqlite_db import Database
+import storage
+
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+_SCRIPT_STYLE_RE = re.compile(r"<(script|style)\b.*?</\1\s*>", re.IGNORECASE | re.DOTALL)
+_TAG_RE = re.compile(r"<[^>]+>")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS postings (
+    token TEXT NOT NULL,
+    email_id TEXT NOT NULL,
+    PRIMARY KEY (token, email_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS postings_email_id ON postings (email_id);
+"""
+
+# Sorts after every character a token can hold (upper bound of prefix scans)
+_MAX_CHAR = chr(0x10FFFF)
+
+_db = Database("SEARCH_INDEX_PATH", _SCHEMA)
+# Serializes index updates in-process (ingest jobs and the lazy-extraction
+# backfill run in separate threads), so they never hit the busy timeout
+_write_lock = threading.Lock()
+# Postings merged with defer=True (emails extracted on access), written by
+# the next merge, removal or flush_search_index
+_deferred_lock = threading.Lock()
+_deferred: Dict[str, Set[str]] = {}
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    """Split text into lowercase word tokens."""
+    if not text:
+        return []
+    return _TOKEN_RE.findall(text.lower())
+
+
+def strip_html(raw: Optional[str]) -> str:
+    """Remove tags (and script/style content) from an HTML body."""
+    if not raw:
+        return ""
+    text = _SCRIPT_STYLE_RE.sub(" ", raw)
+    text = _TAG_RE.sub(" ", text)
+    return html.unescape(text)
+
+
+def email_tokens(email) -> Set[str]:
+    """Collect the distinct tokens of an email (ParsedEmail or email dict)."""
+    if isinstance(email, dict):
+        get = email.get
+    else:
+        def get(name, default=None):
+            return getattr(email, name, default)
+
+    tokens = set()
+    tokens.update(tokenize(get("subject", "")))
+    tokens.update(tokenize(get("sender", "")))
+    for recipient in get("recipients", None) or []:
+        tokens.update(tokenize(recipient))
+    tokens.update(tokenize(get("body_text", "")))
+    tokens.update(tokenize(strip_html(get("body_html", ""))))
+    return tokens
+
+
+def _delete_postings(conn: sqlite3.Connection, email_ids: Iterable[str]):
+    # Through the email_id index: only the rows of these emails are touched
+    conn.executemany("DELETE FROM postings WHERE email_id = ?", ((eid,) for eid in email_ids))
+
+
+def _insert_postings(conn: sqlite3.Connection, additions: Dict[str, Set[str]]):
+    conn.executemany(
+        "INSERT OR IGNORE INTO postings (token, email_id) VALUES (?, ?)",
+        ((token, eid) for token, ids in additions.items() for eid in ids),
+    )
+
+
+def add_postings(additions: Dict[str, Set[str]], email):
+    """Accumulate an email's tokens into an in-memory token -> ids mapping."""
+    eid = email["email_id"] if isinstance(email, dict) else email.email_id
+    for token in email_tokens(email):
+        additions.setdefault(token, set()).add(eid)
+
+
+def _take_deferred(drop_ids: Set[str]) -> Dict[str, Set[str]]:
+    """Empty the deferred postings, returning those not of drop_ids."""
+    with _deferred_lock:
+        taken = {token: ids - drop_ids for token, ids in _deferred.items()}
+        _deferred.clear()
+    return {token: ids for token, ids in taken.items() if ids}
+
+
+@metrics.stage("search_index")
+def merge_search_index(additions: Dict[str, Set[str]], remove_ids: Iterable[str] = (),
+                       defer: bool = False):
+    """Merge accumulated postings into the index, first dropping remove_ids and
+    every id being (re-)indexed, so re-indexing an email replaces its postings.
+
+    With defer, additions are only queued in memory until the next merge,
+    removal or flush_search_index.
+    """
+    if defer:
+        with _deferred_lock:
+            for token, ids in additions.items():
+                _deferred.setdefault(token, set()).update(ids)
+        return
+    remove_ids = set(remove_ids)
+
+    with _write_lock:
+        pending = _take_deferred(remove_ids)
+        for token, ids in additions.items():
+            pending.setdefault(token, set()).update(ids)
+        stale = set(remove_ids)
+        for ids in pending.values():
+            stale.update(ids)
+        with _db.transaction() as conn:
+            _delete_postings(conn, stale)
+            _insert_postings(conn, pending)
+
+
+class PostingsBatch:
+    """Postings of the emails an ingest parses, merged into the index every
+    config.SEARCH_INDEX_BATCH emails so they never cover a whole mbox.
+
+    Without autoflush they are kept until flush() (e.g. by a worker process
+    that hands them to its parent).
+    """
+
+    def __init__(self, autoflush: bool = True):
+        self.autoflush = autoflush
+        self.postings: Dict[str, Set[str]] = {}
+        self.emails = 0
+
+    def add(self, email):
+        add_postings(self.postings, email)
+        self._added(1)
+
+    def update(self, postings: Dict[str, Set[str]], emails: int):
+        """Take the postings of emails parsed elsewhere."""
+        for token, ids in postings.items():
+            self.postings.setdefault(token, set()).update(ids)
+        self._added(emails)
+
+    def _added(self, emails: int):
+        self.emails += emails
+        if self.autoflush and self.emails >= config.SEARCH_INDEX_BATCH:
+            self.flush()
+
+    def flush(self, remove_ids: Iterable[str] = ()):
+        """Merge the held postings into the index (see merge_search_index)."""
+        postings, self.postings, self.emails = self.postings, {}, 0
+        merge_search_index(postings, remove_ids)
+
+
+def update_search_index(emails: Iterable, remove_ids: Iterable[str] = ()):
+    """Index a batch of emails (ParsedEmail or dicts)."""
+    additions: Dict[str, Set[str]] = {}
+    for email in emails:
+        add_postings(additions, email)
+    merge_search_index(additions, remove_ids)
+
+
+def remove_from_search_index(email_ids: Iterable[str]):
+    """Drop the given email_ids from all postings."""
+    email_ids = set(email_ids)
+    if not email_ids or not (_db.exists() or _deferred):
+        return
+    merge_search_index({}, remove_ids=email_ids)
+
+
+def flush_search_index():
+    """Write the deferred postings to the index, if any."""
+    if _deferred:
+        merge_search_index({})
+
+
+def rebuild_search_index():
+    """Rebuild the index from the stored email documents, in one transaction
+    (searches see the previous postings until it commits)."""
+    with _write_lock, _db.transaction() as conn:
+        # The stored documents already hold what deferred postings index
+        _take_deferred(set())
+        conn.execute("DELETE FROM postings")
+        for email in storage.iter_emails():
+            additions: Dict[str, Set[str]] = {}
+            add_postings(additions, email)
+            _insert_postings(conn, additions)
+
+
+def search_index_exists() -> bool:
+    return _db.exists()
+
+
+def search_email_ids(query: str) -> Set[str]:
+    """Return email_ids containing every query token (as a word prefix)."""
+    tokens = tokenize(query)
+    if not tokens or not search_index_exists():
+        return set()
+    conn = _db.connect()
+
+    result: Optional[Set[str]] = None
+    for token in sorted(set(tokens), key=len, reverse=True):
+        # Every indexed token starting with token sorts in [token, token + _MAX_CHAR)
+        matches = {eid for (eid,) in conn.execute(
+            "SELECT email_id FROM postings WHERE token >= ? AND token < ?",
+            (token, token + _MAX_CHAR),
+        )}
+        result = matches if result is None else result & matches
+        if not result:
+            return set()
+    return result
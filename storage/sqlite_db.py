@@ -0,0 +1,74 @@
+"""Small SQLite side databases (WAL mode) kept next to the email store."""
+
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Callable, Iterator, Optional
+
+import config
+
+
+def _file_id(path: str):
+    try:
+        return os.stat(path).st_ino
+    except FileNotFoundError:
+        return None
+
+
+class Database:
+    """One SQLite file, at the path of a config setting (read at each use, so
+    tests and rebuilds can move it), created with schema on first use; migrate,
+    if given, is then called with each new connection to upgrade older files.
+
+    Connections are per thread and process, reopened when the file is
+    replaced (e.g. when the data directory is wiped).
+    """
+
+    def __init__(self, path_setting: str, schema: str,
+                 migrate: Optional[Callable[[sqlite3.Connection], None]] = None):
+        self.path_setting = path_setting
+        self.schema = schema
+        self.migrate = migrate
+        self._local = threading.local()
+
+    @property
+    def path(self) -> str:
+        return getattr(config, self.path_setting)
+
+    def exists(self) -> bool:
+        return os.path.exists(self.path)
+
+    def file_id(self):
+        """Inode of the file (None if missing): changes when it is replaced."""
+        return _file_id(self.path)
+
+    def connect(self) -> sqlite3.Connection:
+        path = self.path
+        key = (path, os.getpid(), _file_id(path))
+        if getattr(self._local, "key", None) == key:
+            return self._local.conn
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Autocommit mode: transactions are opened explicitly by transaction()
+        conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(self.schema)
+        if self.migrate is not None:
+            self.migrate(conn)
+        self._local.conn = conn
+        self._local.key = (path, os.getpid(), _file_id(path))
+        return conn
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """Write transaction (taken immediately, so concurrent writers queue up)."""
+        conn = self.connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
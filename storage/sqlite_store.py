@@ -0,0 +1,316 @@
+"""Save/load catalog and email data in a SQLite database (WAL mode).
+
+Same contract as storage.json_store. Sources, summaries, groups and email
+documents live in one database file (config.SQLITE_PATH); catalog updates and
+deletes each run in a single transaction.
+"""
+
+import copy
+import json
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional
+
+from pec_parser.models import ParsedEmail
+from pec_parser import metrics
+from storage.json_store import (
+    _catalog_from_sources,
+    _detach_source,
+    _normalize_catalog,
+    _remove_source_files,
+    invalidate_catalog_cache,
+)
+from storage.sqlite_db import Database
+import config
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sources (
+    source_id TEXT PRIMARY KEY,
+    position INTEGER NOT NULL,
+    source_file TEXT NOT NULL,
+    doc TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS summaries (
+    source_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    email_id TEXT NOT NULL,
+    timestamp INTEGER,
+    doc TEXT NOT NULL,
+    PRIMARY KEY (source_id, position)
+);
+CREATE INDEX IF NOT EXISTS summaries_email_id ON summaries (email_id);
+CREATE TABLE IF NOT EXISTS groups (
+    group_id TEXT PRIMARY KEY,
+    position INTEGER NOT NULL,
+    doc TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS emails (
+    email_id TEXT PRIMARY KEY,
+    source_file TEXT,
+    timestamp INTEGER,
+    doc TEXT NOT NULL
+);
+"""
+
+# Databases written before the timestamp columns have a date column (the
+# display string) instead, left in place but no longer indexed
+_MIGRATIONS = [
+    ("summaries", "timestamp", "INTEGER"),
+    ("emails", "timestamp", "INTEGER"),
+]
+_INDEXES = """
+DROP INDEX IF EXISTS summaries_date;
+DROP INDEX IF EXISTS emails_date;
+CREATE INDEX IF NOT EXISTS summaries_timestamp ON summaries (timestamp);
+CREATE INDEX IF NOT EXISTS emails_timestamp ON emails (timestamp);
+"""
+
+
+def _migrate(conn: sqlite3.Connection):
+    """Add the columns missing from an older database (filled from the
+    documents) and its current indexes."""
+    indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    if "emails_timestamp" in indexes and "emails_date" not in indexes:
+        return
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for table, column, kind in _MIGRATIONS:
+            columns = {row[1] for row in conn.execute("PRAGMA table_info({})".format(table))}
+            if column not in columns:
+                conn.execute("ALTER TABLE {} ADD COLUMN {} {}".format(table, column, kind))
+                conn.execute("UPDATE {0} SET {1} = json_extract(doc, '$.{1}')".format(table, column))
+        for statement in filter(str.strip, _INDEXES.split(";")):
+            conn.execute(statement)
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+
+_db = Database("SQLITE_PATH", _SCHEMA, migrate=_migrate)
+# Per thread: its pending email_batch, if any
+_local = threading.local()
+
+
+def _read_catalog(conn: sqlite3.Connection) -> Optional[Dict]:
+    meta = dict(conn.execute("SELECT key, value FROM meta"))
+    if "version" not in meta:
+        return None
+
+    summaries: Dict[str, List[Dict]] = {}
+    for source_id, doc in conn.execute(
+        "SELECT source_id, doc FROM summaries ORDER BY source_id, position"
+    ):
+        summaries.setdefault(source_id, []).append(json.loads(doc))
+
+    sources = []
+    for source_id, doc in conn.execute("SELECT source_id, doc FROM sources ORDER BY position"):
+        source = json.loads(doc)
+        source["emails_summary"] = summaries.get(source_id, [])
+        sources.append(source)
+
+    catalog = {"sources": sources}
+    if meta.get("grouped") == "1":
+        catalog["groups"] = [
+            json.loads(doc) for (doc,) in conn.execute("SELECT doc FROM groups ORDER BY position")
+        ]
+    return _normalize_catalog(catalog)
+
+
+@metrics.stage("save_catalog")
+def _write_catalog(conn: sqlite3.Connection, old: Optional[Dict], catalog: Dict):
+    """Store catalog, touching only the rows that differ from old."""
+    old = old or {}
+    old_sources = {s["source_id"]: (i, s) for i, s in enumerate(old.get("sources", []))}
+    new_ids = {s["source_id"] for s in catalog["sources"]}
+
+    for source_id in set(old_sources) - new_ids:
+        conn.execute("DELETE FROM sources WHERE source_id = ?", (source_id,))
+        conn.execute("DELETE FROM summaries WHERE source_id = ?", (source_id,))
+
+    for position, source in enumerate(catalog["sources"]):
+        source_id = source["source_id"]
+        previous = old_sources.get(source_id)
+        if previous == (position, source):
+            continue
+        doc = {k: v for k, v in source.items() if k != "emails_summary"}
+        conn.execute(
+            "INSERT OR REPLACE INTO sources (source_id, position, source_file, doc) VALUES (?, ?, ?, ?)",
+            (source_id, position, source["source_file"], json.dumps(doc, ensure_ascii=False)),
+        )
+        summaries = source.get("emails_summary", [])
+        if previous is not None and previous[1].get("emails_summary") == summaries:
+            continue
+        conn.execute("DELETE FROM summaries WHERE source_id = ?", (source_id,))
+        conn.executemany(
+            "INSERT INTO summaries (source_id, position, email_id, timestamp, doc) VALUES (?, ?, ?, ?, ?)",
+            [
+                (source_id, i, s["email_id"], s.get("timestamp"), json.dumps(s, ensure_ascii=False))
+                for i, s in enumerate(summaries)
+            ],
+        )
+
+    groups = catalog.get("groups")
+    old_groups = {g["group_id"]: (i, g) for i, g in enumerate(old.get("groups", []))}
+    new_group_ids = {g["group_id"] for g in groups or []}
+    conn.executemany(
+        "DELETE FROM groups WHERE group_id = ?",
+        [(gid,) for gid in set(old_groups) - new_group_ids],
+    )
+    conn.executemany(
+        "INSERT OR REPLACE INTO groups (group_id, position, doc) VALUES (?, ?, ?)",
+        [
+            (g["group_id"], i, json.dumps(g, ensure_ascii=False))
+            for i, g in enumerate(groups or [])
+            if old_groups.get(g["group_id"]) != (i, g)
+        ],
+    )
+
+    conn.execute(
+        "INSERT OR REPLACE INTO meta (key, value) VALUES ('grouped', ?)",
+        ("1" if groups is not None else "0",),
+    )
+    conn.execute(
+        "INSERT INTO meta (key, value) VALUES ('version', '1') "
+        "ON CONFLICT (key) DO UPDATE SET value = CAST(value AS INTEGER) + 1"
+    )
+
+
+def catalog_stamp():
+    """Token that changes with every committed catalog write (None if no catalog)."""
+    if not _db.exists():
+        return None
+    row = _db.connect().execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+    if row is None:
+        return None
+    return (_db.file_id(), row[0])
+
+
+_INSERT_EMAIL = "INSERT OR REPLACE INTO emails (email_id, source_file, timestamp, doc) VALUES (?, ?, ?, ?)"
+
+
+def save_email(email: ParsedEmail):
+    """Upsert a single email document (buffered inside an email_batch)."""
+    doc = json.dumps(email.to_dict(), ensure_ascii=False)
+    row = (email.email_id, email.source_file, email.timestamp, doc)
+    batch = getattr(_local, "batch", None)
+    if batch is not None:
+        batch[email.email_id] = row
+        if len(batch) >= config.SQLITE_EMAIL_BATCH:
+            _flush_batch()
+    else:
+        _db.connect().execute(_INSERT_EMAIL, row)
+    metrics.count("bytes_written", len(doc.encode("utf-8")))
+
+
+def _flush_batch():
+    with _db.transaction() as conn:
+        conn.executemany(_INSERT_EMAIL, _local.batch.values())
+    _local.batch = {}
+
+
+@contextmanager
+def email_batch():
+    """Write the documents this thread saves in the block SQLITE_EMAIL_BATCH
+    at a time, each batch in a single transaction (the rest when the block
+    ends without an error). load_email sees the buffered ones."""
+    if getattr(_local, "batch", None) is not None:
+        yield
+        return
+    _local.batch = {}
+    try:
+        yield
+        if _local.batch:
+            _flush_batch()
+    finally:
+        _local.batch = None
+
+
+def save_catalog(sources: List[Dict], groups: Optional[List[Dict]] = None):
+    """Replace the stored catalog with sources (and the global groups).
+
+    Same input as json_store.save_catalog, including pending _emails.
+    """
+    catalog = _catalog_from_sources(sources, groups, save_email)
+    with _db.transaction() as conn:
+        _write_catalog(conn, _read_catalog(conn), catalog)
+    invalidate_catalog_cache()
+
+
+def update_catalog(mutate: Callable[[Dict], object]):
+    """Apply mutate(catalog) to the stored catalog in one transaction.
+
+    mutate gets a fresh catalog dict (empty if none exists yet), edits it in
+    place and may return a value, which is passed back to the caller.
+    """
+    with _db.transaction() as conn:
+        old = _read_catalog(conn)
+        catalog = copy.deepcopy(old) if old is not None else {"sources": []}
+        result = mutate(catalog)
+        _write_catalog(conn, old, _normalize_catalog(catalog))
+    invalidate_catalog_cache()
+    return result
+
+
+def load_catalog() -> Optional[Dict]:
+    """Load the catalog if one was saved (fresh copy, safe to modify)."""
+    if not _db.exists():
+        return None
+    return _read_catalog(_db.connect())
+
+
+def load_email(email_id: str) -> Optional[Dict]:
+    """Load a single email document by ID."""
+    batch = getattr(_local, "batch", None)
+    if batch and email_id in batch:
+        return json.loads(batch[email_id][3])
+    if not _db.exists():
+        return None
+    row = _db.connect().execute("SELECT doc FROM emails WHERE email_id = ?", (email_id,)).fetchone()
+    return json.loads(row[0]) if row else None
+
+
+def delete_emails(email_ids):
+    """Delete the stored documents of the given emails."""
+    if not _db.exists():
+        return
+    with _db.transaction() as conn:
+        conn.executemany("DELETE FROM emails WHERE email_id = ?", [(eid,) for eid in email_ids])
+
+
+def iter_emails() -> Iterator[Dict]:
+    """Yield every stored email document."""
+    if not _db.exists():
+        return
+    for (doc,) in _db.connect().execute("SELECT doc FROM emails"):
+        yield json.loads(doc)
+
+
+def delete_source(source_id: str) -> bool:
+    """Delete a source and its exclusive emails in one transaction, then
+    their attachment dirs, search postings and uploaded .mbox.
+
+    Returns True if source was found and deleted.
+    """
+    if not _db.exists():
+        return False
+    with _db.transaction() as conn:
+        old = _read_catalog(conn)
+        if old is None:
+            return False
+        catalog = copy.deepcopy(old)
+        target, exclusive_ids = _detach_source(catalog, source_id)
+        if target is None:
+            return False
+        conn.executemany("DELETE FROM emails WHERE email_id = ?", [(eid,) for eid in exclusive_ids])
+        _write_catalog(conn, old, catalog)
+    invalidate_catalog_cache()
+
+    _remove_source_files(target, exclusive_ids)
+    return True
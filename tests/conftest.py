@@ -10,3 +10,33 @@ MBOX_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file_
 @pytest.fixture
 def mbox_path():
     return MBOX_PATH
+
+
+def use_data_dir(monkeypatch, tmp_path):
+    """Point every data path in config at tmp_path/data (and the snapshots
+    at tmp_path/snapshots). Returns the data directory."""
+    import config
+
+    data_dir = str(tmp_path / "data")
+    monkeypatch.setattr(config, "DATA_DIR", data_dir)
+    monkeypatch.setattr(config, "CATALOG_PATH", os.path.join(data_dir, "catalog.json"))
+    monkeypatch.setattr(config, "EMAILS_DIR", os.path.join(data_dir, "emails"))
+    monkeypatch.setattr(config, "ATTACHMENTS_DIR", os.path.join(data_dir, "attachments"))
+    monkeypatch.setattr(config, "BLOBS_DIR", os.path.join(data_dir, "blobs"))
+    monkeypatch.setattr(config, "BLOB_REFS_PATH", os.path.join(data_dir, "blob_refs.db"))
+    monkeypatch.setattr(config, "UPLOADS_DIR", os.path.join(data_dir, "uploads"))
+    monkeypatch.setattr(config, "SEARCH_INDEX_PATH", os.path.join(data_dir, "search_index.db"))
+    monkeypatch.setattr(config, "SQLITE_PATH", os.path.join(data_dir, "catalog.db"))
+    monkeypatch.setattr(config, "FINGERPRINTS_DIR", os.path.join(data_dir, "fingerprints"))
+    monkeypatch.setattr(config, "DEDUP_INDEX_PATH", os.path.join(data_dir, "dedup.db"))
+    monkeypatch.setattr(config, "SNAPSHOTS_DIR", str(tmp_path / "snapshots"))
+    return data_dir
+
+
+@pytest.fixture
+def tmp_data_dir(tmp_path, monkeypatch):
+    """Point every data path in config at an empty temporary directory."""
+    yield use_data_dir(monkeypatch, tmp_path)
+    # Commits deferred by on-access extractions land in this test's data
+    from pec_parser.lazy import flush_deferred
+    flush_deferred()
@@ -10,15 +10,21 @@ MBOX_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file_
 
 
 @pytest.fixture(scope="module")
-def client():
-    """Create test client and ensure catalog exists."""
-    if not os.path.exists(config.CATALOG_PATH):
+def client(tmp_path_factory):
+    """Create test client over a catalog of test.mbox in a data directory
+    of its own (uploads and deletes never touch data/)."""
+    from tests.conftest import use_data_dir
+
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        use_data_dir(monkeypatch, tmp_path_factory.mktemp("app"))
         process_mbox(MBOX_PATH)
 
-    from app import app
-    app.config["TESTING"] = True
-    with app.test_client() as client:
-        yield client
+        from app import app
+        from pec_parser.lazy import flush_deferred
+        app.config["TESTING"] = True
+        with app.test_client() as client:
+            yield client
+        flush_deferred()
 
 
 def test_index(client):
@@ -74,6 +80,62 @@ def test_api_search_empty(client):
     assert data["results"] == []
 
 
+def test_api_search_rebuilds_missing_index_in_background(client):
+    from pec_parser.jobs import submit_index_rebuild
+
+    # "corpo" only appears in the bodies, found through the index
+    indexed = client.get("/api/search?q=corpo").get_json()["results"]
+    assert indexed
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(config.SEARCH_INDEX_PATH + suffix):
+            os.remove(config.SEARCH_INDEX_PATH + suffix)
+
+    resp = client.get("/api/search?q=corpo")
+    assert resp.status_code == 200
+    submit_index_rebuild().result(timeout=30)
+    assert client.get("/api/search?q=corpo").get_json()["results"] == indexed
+
+
+def test_download_attachment_from_blob(client):
+    from storage import load_email
+    from storage.json_store import get_catalog_view
+
+    for summary in get_catalog_view().summaries:
+        if summary.get("attachment_count"):
+            att = load_email(summary["email_id"])["attachments"][0]
+            break
+    resp = client.get("/attachment/{}/{}".format(summary["email_id"], att["filename"]))
+    assert resp.status_code == 200
+    assert len(resp.data) == att["size"]
+    assert "attachment" in resp.headers["Content-Disposition"]
+    resp = client.get("/inline/{}/{}".format(summary["email_id"], att["filename"]))
+    assert resp.status_code == 200
+    assert "attachment" not in resp.headers.get("Content-Disposition", "")
+    resp.close()
+
+
+def test_attachment_loads_email_once(client, monkeypatch):
+    import storage
+    from pec_parser import lazy
+    from storage.json_store import get_catalog_view
+
+    summary = next(s for s in get_catalog_view().summaries if s.get("attachment_count"))
+    att = storage.load_email(summary["email_id"])["attachments"][0]
+    loads = []
+    real_load = storage.load_email
+
+    def load_email(email_id):
+        loads.append(email_id)
+        return real_load(email_id)
+
+    monkeypatch.setattr(storage, "load_email", load_email)
+    monkeypatch.setattr(lazy, "load_email", load_email)
+    resp = client.get("/attachment/{}/{}".format(summary["email_id"], att["filename"]))
+    assert resp.status_code == 200
+    resp.close()
+    assert loads == [summary["email_id"]]
+
+
 def test_attachment_not_found(client):
     resp = client.get("/attachment/nonexistent/file.pdf")
     assert resp.status_code == 404
@@ -108,27 +170,80 @@ def test_api_upload_wrong_extension(client):
     assert "error" in resp.get_json()
 
 
+def _upload_and_wait(client, name):
+    from pec_parser.jobs import wait_for_job
+    with open(MBOX_PATH, "rb") as f:
+        data = {"file": (f, name)}
+        resp = client.post("/api/upload", data=data, content_type="multipart/form-data")
+    assert resp.status_code == 202
+    job_id = resp.get_json()["job_id"]
+    wait_for_job(job_id, timeout=60)
+    return client.get("/api/jobs/{}".format(job_id)).get_json()
+
+
 def test_api_upload_mbox(client):
-    """Upload the same test.mbox and verify it creates a new source."""
+    """Upload the same test.mbox and verify its job creates a new source."""
     with open(MBOX_PATH, "rb") as f:
         data = {"file": (f, "uploaded.mbox")}
         resp = client.post("/api/upload", data=data, content_type="multipart/form-data")
-    assert resp.status_code == 200
-    result = resp.get_json()
-    assert result["status"] == "ok"
+    assert resp.status_code == 202
+    queued = resp.get_json()
+    assert queued["status"] == "queued"
+    assert queued["source_file"] == "uploaded.mbox"
+
+    from pec_parser.jobs import wait_for_job
+    wait_for_job(queued["job_id"], timeout=60)
+    job = client.get("/api/jobs/{}".format(queued["job_id"])).get_json()
+    assert job["status"] == "done", job["error"]
+    assert job["phase"] == "save"
+    assert job["processed"] == job["total"] == 19
+    result = job["result"]
     assert result["new_emails"] == 19
     assert result["source_file"] == "uploaded.mbox"
     assert "source_id" in result
     assert "uploaded_at" in result
 
 
-def test_api_delete_source(client):
-    """Upload an mbox, then delete the source, verify it's gone."""
+def test_api_upload_same_name_keeps_earlier_file(client):
+    first = _upload_and_wait(client, "twice.mbox")["result"]
+    second = _upload_and_wait(client, "twice.mbox")["result"]
+    assert first["source_file"] == "twice.mbox"
+    assert second["source_file"] == "twice_2.mbox"
+    assert os.path.exists(os.path.join(config.UPLOADS_DIR, "twice.mbox"))
+    assert os.path.exists(os.path.join(config.UPLOADS_DIR, "twice_2.mbox"))
+
+
+def test_api_upload_stream(client):
     with open(MBOX_PATH, "rb") as f:
-        data = {"file": (f, "to_delete.mbox")}
-        resp = client.post("/api/upload", data=data, content_type="multipart/form-data")
+        resp = client.post("/api/upload/stream?filename=streamed.mbox", data=f.read(),
+                           content_type="application/octet-stream")
     assert resp.status_code == 200
-    source_id = resp.get_json()["source_id"]
+    result = resp.get_json()
+    assert result["new_emails"] == 19
+    assert result["source_file"] == "streamed.mbox"
+    # Linked by the stream's parser thread (the fixture ingested the same
+    # messages), into the request's report
+    assert result["report"]["counters"]["linked"] == 19
+    assert result["report"]["counters"]["messages"] == 0
+    assert "fingerprint" in result["report"]["stages"]
+    assert os.path.exists(os.path.join(config.UPLOADS_DIR, "streamed.mbox"))
+
+    resp = client.post("/api/upload/stream?filename=test.txt", data=b"x")
+    assert resp.status_code == 400
+
+
+def test_api_job_not_found(client):
+    resp = client.get("/api/jobs/nonexistent")
+    assert resp.status_code == 404
+
+
+def test_api_delete_source(client):
+    """Upload an mbox, then delete the source, verify it's gone."""
+    job = _upload_and_wait(client, "to_delete.mbox")
+    assert job["status"] == "done"
+    # Same messages as the fixture's source: linked, not parsed again
+    assert job["result"]["report"]["counters"]["linked"] == 19
+    source_id = job["result"]["source_id"]
 
     # Verify source exists in catalog
     resp = client.get("/api/catalog")
@@ -159,3 +274,106 @@ def test_catalog_has_source_file(client):
     for source in data["sources"]:
         for summary in source["emails_summary"]:
             assert "source_file" in summary
+
+
+def test_catalog_pagination_covers_all_emails(client):
+    seen = []
+    cursor = None
+    while True:
+        url = "/api/catalog?limit=5&fields=email_id,date"
+        if cursor:
+            url += "&cursor=" + cursor
+        data = client.get(url).get_json()
+        assert len(data["items"]) <= 5
+        for item in data["items"]:
+            assert set(item) == {"email_id", "date"}
+        seen.extend(item["email_id"] for item in data["items"])
+        cursor = data["next_cursor"]
+        if cursor is None:
+            break
+    assert len(seen) == len(set(seen)) == data["total"]
+
+
+def test_catalog_sort_by_date(client):
+    from datetime import datetime
+    data = client.get("/api/catalog?sort=date&limit=1000").get_json()
+    dates = [datetime.strptime(i["date"], "%d/%m/%Y %H:%M") for i in data["items"]]
+    assert dates == sorted(dates)
+
+
+def test_catalog_groups_view(client):
+    data = client.get("/api/catalog?view=groups").get_json()
+    assert data["view"] == "groups"
+    groups = data["items"]
+    assert groups
+    assert "email_ids" not in groups[0]
+    counts = [g["count"] for g in groups]
+    assert counts == sorted(counts, reverse=True)
+
+    group = groups[0]
+    members = client.get("/api/catalog?group_id={}&source_id={}&limit=1000".format(
+        group["group_id"], group["source_id"])).get_json()
+    assert members["total"] == group["count"]
+
+
+def test_catalog_bad_params(client):
+    assert client.get("/api/catalog?sort=subject").status_code == 400
+    assert client.get("/api/catalog?view=threads").status_code == 400
+    assert client.get("/api/catalog?limit=abc").status_code == 400
+
+
+def test_catalog_and_search_date_range(client):
+    items = client.get("/api/catalog?limit=1000&fields=email_id,timestamp").get_json()["items"]
+    stamps = sorted(i["timestamp"] for i in items)
+    since, until = stamps[2], stamps[-3]
+    data = client.get("/api/catalog?from={}&to={}&limit=1000&fields=email_id,timestamp".format(
+        since, until)).get_json()
+    assert data["total"] == sum(since <= t <= until for t in stamps)
+    assert all(since <= i["timestamp"] <= until for i in data["items"])
+
+    day = client.get("/api/catalog?from=2024-01-03&to=2024-01-03&limit=1000").get_json()
+    assert day["total"] >= 1
+    assert all(i["date"].startswith("03/01/2024") for i in day["items"])
+
+    everything = client.get("/api/search?q=pec").get_json()["results"]
+    ranged = client.get("/api/search?q=pec&from=2024-01-03T00:00:00&to=2024-01-03").get_json()["results"]
+    assert {r["email_id"] for r in ranged} == {
+        r["email_id"] for r in everything if r["date"].startswith("03/01/2024")
+    }
+
+    assert client.get("/api/catalog?from=yesterday").status_code == 400
+    assert client.get("/api/search?q=pec&to=2024-13-01").status_code == 400
+
+
+def test_facets_and_faceted_search(client):
+    data = client.get("/api/facets").get_json()
+    assert data["total"] == 19
+    providers = data["facets"]["pec_provider"]
+    assert providers and sum(p["count"] for p in providers) <= 19
+    provider = providers[0]
+
+    results = client.get("/api/search?pec_provider={}".format(provider["value"])).get_json()["results"]
+    assert len(results) == provider["count"]
+    assert all(r["pec_provider"] == provider["value"] for r in results)
+
+    with_attachments = client.get("/api/search?has_attachments=true").get_json()["results"]
+    assert with_attachments and all(r["attachment_count"] for r in with_attachments)
+
+    narrowed = client.get("/api/facets?pec_provider={}&has_attachments=true".format(
+        provider["value"])).get_json()
+    both = client.get("/api/search?pec_provider={}&has_attachments=true".format(
+        provider["value"])).get_json()["results"]
+    assert narrowed["total"] == len(both)
+    month = data["facets"]["month"][0]["value"]
+    assert all(r["date"][3:10] == "{}/{}".format(month[5:], month[:4])
+               for r in client.get("/api/search?q=pec&month=" + month).get_json()["results"])
+
+
+def test_api_metrics(client):
+    client.get("/api/catalog")
+    resp = client.get("/api/metrics")
+    assert resp.status_code == 200
+    assert resp.mimetype == "text/plain"
+    text = resp.get_data(as_text=True)
+    assert "# TYPE pec_http_request_duration_seconds histogram" in text
+    assert 'pec_http_request_duration_seconds_count{route="/api/catalog",method="GET",status="200"}' in text
@@ -38,3 +38,100 @@ def test_save_attachments(clean_attachments):
                     assert os.path.getsize(fpath) > 0
     mbox.close()
     assert total_saved >= 1, "Expected at least 1 attachment saved"
+
+
+def test_sink_stores_listed_attachments(tmp_data_dir):
+    """One walk: every listed attachment is written under its listed filename."""
+    from pec_parser.attachment_handler import AttachmentWriter
+
+    mbox = mailbox.mbox(MBOX_PATH)
+    checked = 0
+    for i, msg in enumerate(mbox):
+        parsed = parse_pec_message(msg, i, attachment_sink=AttachmentWriter)
+        att_dir = os.path.join(config.ATTACHMENTS_DIR, parsed.email_id)
+        for att in parsed.attachments:
+            fpath = os.path.join(att_dir, att.filename)
+            assert os.path.exists(fpath), "Attachment {} not found".format(fpath)
+            assert os.path.getsize(fpath) == att.size
+            checked += 1
+    mbox.close()
+    assert checked >= 1
+
+
+def test_duplicate_and_inline_names(tmp_data_dir):
+    import email
+    from pec_parser.attachment_handler import AttachmentWriter
+
+    raw = (
+        "From: a@example.com\n"
+        "Subject: dup\n"
+        "Content-Type: multipart/mixed; boundary=\"b\"\n\n"
+        "--b\nContent-Type: text/plain\n\nciao\n"
+        "--b\nContent-Type: application/pdf\nContent-Disposition: attachment; filename=\"doc.pdf\"\n"
+        "Content-Transfer-Encoding: base64\n\nJVBERi0xLjQ=\n"
+        "--b\nContent-Type: application/pdf\nContent-Disposition: attachment; filename=\"doc.pdf\"\n"
+        "Content-Transfer-Encoding: base64\n\nJVBERi0xLjU=\n"
+        "--b\nContent-Type: image/png\nContent-Disposition: inline\nContent-ID: <logo1>\n"
+        "Content-Transfer-Encoding: base64\n\niVBORw0KGgo=\n"
+        "--b--\n"
+    )
+    parsed = parse_pec_message(email.message_from_string(raw), 0, attachment_sink=AttachmentWriter)
+    names = [a.filename for a in parsed.attachments]
+    assert names == ["doc.pdf", "doc_1.pdf", "inline_logo1.png"]
+    att_dir = os.path.join(config.ATTACHMENTS_DIR, parsed.email_id)
+    assert sorted(os.listdir(att_dir)) == sorted(names)
+    assert parsed.attachments[2].content_id == "logo1"
+    assert parsed.attachments[2].is_inline
+
+
+def test_blob_writer_stores_identical_payloads_once(tmp_data_dir):
+    import email
+    from pec_parser.attachment_handler import BlobWriter
+    from storage.blob_store import blob_path
+
+    raw = (
+        "From: a@example.com\n"
+        "Subject: {}\n"
+        "Content-Type: multipart/mixed; boundary=\"b\"\n\n"
+        "--b\nContent-Type: text/plain\n\nciao\n"
+        "--b\nContent-Type: application/pdf\nContent-Disposition: attachment; filename=\"doc.pdf\"\n"
+        "Content-Transfer-Encoding: base64\n\nJVBERi0xLjQ=\n"
+        "--b--\n"
+    )
+    first = parse_pec_message(email.message_from_string(raw.format("one")), 0, attachment_sink=BlobWriter)
+    second = parse_pec_message(email.message_from_string(raw.format("two")), 1, attachment_sink=BlobWriter)
+    assert first.email_id != second.email_id
+    digest = first.attachments[0].blob
+    assert digest and second.attachments[0].blob == digest
+    with open(blob_path(digest), "rb") as f:
+        assert f.read() == b"%PDF-1.4"
+    blob_files = [name for _, _, files in os.walk(config.BLOBS_DIR) for name in files]
+    assert blob_files == [digest]
+
+
+def test_attachments_stream_in_chunks(tmp_data_dir, monkeypatch):
+    import base64
+    import email
+    import hashlib
+    from pec_parser.attachment_handler import BlobWriter
+    from storage.blob_store import blob_path
+
+    monkeypatch.setattr(config, "DECODE_CHUNK_SIZE", 64)
+    payload = os.urandom(5000)
+    raw = (
+        "From: a@example.com\n"
+        "Subject: big\n"
+        "Content-Type: multipart/mixed; boundary=\"b\"\n\n"
+        "--b\nContent-Type: text/plain\n\nciao\n"
+        "--b\nContent-Type: application/pdf\nContent-Disposition: attachment; filename=\"scan.pdf\"\n"
+        "Content-Transfer-Encoding: base64\n\n{}\n"
+        "--b--\n"
+    ).format(base64.encodebytes(payload).decode("ascii"))
+    parsed = parse_pec_message(email.message_from_string(raw), 0, attachment_sink=BlobWriter)
+    att = parsed.attachments[0]
+    assert att.size == len(payload)
+    assert att.blob == hashlib.sha256(payload).hexdigest()
+    with open(blob_path(att.blob), "rb") as f:
+        assert f.read() == payload
+    # Only the blob is left behind, no temp files
+    assert [name for _, _, files in os.walk(config.BLOBS_DIR) for name in files] == [att.blob]
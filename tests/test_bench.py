@@ -0,0 +1,74 @@
+import os
+
+import pytest
+
+import config
+from bench.corpus import generate_mbox
+from bench.load import parse_mix, percentile, run_load
+from bench.run import compare, run_suite
+from pec_parser.mbox_reader import _parse_mbox_emails, process_mbox
+
+
+def test_corpus_is_deterministic(tmp_path):
+    a, b, c = (str(tmp_path / name) for name in ("a.mbox", "b.mbox", "c.mbox"))
+    generate_mbox(a, 20, seed=1)
+    generate_mbox(b, 20, seed=1)
+    generate_mbox(c, 20, seed=2)
+    with open(a, "rb") as fa, open(b, "rb") as fb, open(c, "rb") as fc:
+        first = fa.read()
+        assert first == fb.read()
+        assert first != fc.read()
+
+
+def test_corpus_parses_as_pec(tmp_data_dir, tmp_path):
+    path = str(tmp_path / "corpus.mbox")
+    generate_mbox(path, 60, seed=0, large_kb=64, large_every=30)
+    summaries = _parse_mbox_emails(path).summaries
+    assert len(summaries) == 60
+    assert len({s.pec_type for s in summaries}) > 2
+    assert all(s.pec_provider and s.timestamp for s in summaries)
+    assert any(s.attachment_count > 1 for s in summaries)
+    assert any(not s.subject.isascii() for s in summaries)
+
+
+def test_run_suite_and_compare(tmp_data_dir, tmp_path):
+    path = str(tmp_path / "corpus.mbox")
+    generate_mbox(path, 10, seed=0, large_every=0)
+    report = run_suite(path)
+    assert report["messages"] == 10
+    assert set(report["stages"]) == {"parse", "group", "save_catalog", "delete_source"}
+    # The suite runs in its own data dir
+    assert not os.path.exists(config.CATALOG_PATH)
+
+    assert compare(report, report, 0.3) == []
+    faster = {"stages": {stage: {"messages_per_s": r["messages_per_s"] * 2}
+                         for stage, r in report["stages"].items()}}
+    regressions = compare(report, faster, 0.3)
+    assert len(regressions) == 4 and regressions[0].startswith("parse:")
+    assert compare(report, faster, 0.6) == []
+
+
+def test_percentile_and_mix():
+    values = [float(v) for v in range(1, 101)]
+    assert percentile(values, 50) == 50
+    assert percentile(values, 99) == 99
+    assert percentile([], 95) == 0
+    assert parse_mix("search=3,email") == {"search": 3, "email": 1}
+    with pytest.raises(ValueError):
+        parse_mix("search=3,nope=1")
+    with pytest.raises(ValueError):
+        parse_mix("search=0")
+
+
+def test_run_load_reports_every_endpoint(tmp_data_dir, tmp_path):
+    path = str(tmp_path / "corpus.mbox")
+    generate_mbox(path, 30, seed=0, large_every=0)
+    process_mbox(path)
+    report = run_load(clients=2, requests=40, warmup=0)
+    endpoints = report["endpoints"]
+    assert endpoints["all"]["requests"] == 80
+    assert endpoints["all"]["errors"] == 0
+    assert {"catalog", "email", "search", "sources"} <= set(endpoints)
+    for stats in endpoints.values():
+        assert stats["p50_ms"] <= stats["p95_ms"] <= stats["p99_ms"]
+    assert endpoints["catalog"]["bytes"] > 0
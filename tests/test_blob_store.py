@@ -0,0 +1,73 @@
+import json
+import os
+import threading
+
+import config
+from pec_parser import gate
+from storage.blob_store import (
+    blob_path,
+    blobs_stranded,
+    collect_blobs,
+    put_blob,
+    release_blob_refs,
+    update_blob_refs,
+)
+
+
+def test_shared_blob_deleted_with_last_reference(tmp_data_dir):
+    shared, own = put_blob(b"shared"), put_blob(b"own")
+    update_blob_refs({"email_a": [shared, own], "email_b": [shared]})
+    assert release_blob_refs(["email_a"]) == [own]
+    assert os.path.exists(blob_path(shared)) and not os.path.exists(blob_path(own))
+    # Re-recording an email replaces what it used before
+    update_blob_refs({"email_b": []})
+    assert not os.path.exists(blob_path(shared))
+
+
+def test_orphan_kept_while_other_writers_run(tmp_data_dir):
+    digest = put_blob(b"payload")
+    update_blob_refs({"email_a": [digest]})
+
+    entered, done = threading.Event(), threading.Event()
+
+    def writer():
+        with gate.writing():
+            entered.set()
+            done.wait(5)
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    entered.wait(5)
+    try:
+        # The running writer may have found the blob stored and reuse it
+        assert release_blob_refs(["email_a"]) == []
+        assert os.path.exists(blob_path(digest)) and blobs_stranded()
+    finally:
+        done.set()
+        thread.join()
+
+    with gate.exclusive():
+        assert collect_blobs() == [digest]
+    assert not os.path.exists(blob_path(digest)) and not blobs_stranded()
+
+
+def test_collect_blobs_deletes_unreferenced(tmp_data_dir):
+    kept, leaked = put_blob(b"kept"), put_blob(b"written by a failed ingest")
+    update_blob_refs({"email_a": [kept]})
+    deferred = put_blob(b"extracted on access")
+    update_blob_refs({"email_b": [deferred]}, defer=True)
+    tmp_path = os.path.join(config.BLOBS_DIR, "incoming.1.2.tmp")
+    open(tmp_path, "wb").close()
+
+    assert collect_blobs() == [leaked]
+    assert os.path.exists(blob_path(kept)) and os.path.exists(blob_path(deferred))
+    assert not os.path.exists(tmp_path)
+
+
+def test_legacy_refs_json_is_imported(tmp_data_dir):
+    digest = put_blob(b"old")
+    with open(os.path.join(config.BLOBS_DIR, "refs.json"), "w", encoding="utf-8") as f:
+        json.dump({"email_a": [digest]}, f)
+    assert collect_blobs() == []
+    assert not os.path.exists(os.path.join(config.BLOBS_DIR, "refs.json"))
+    assert release_blob_refs(["email_a"]) == [digest]
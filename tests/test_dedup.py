@@ -0,0 +1,156 @@
+import json
+import os
+import shutil
+import sqlite3
+
+import pytest
+
+import config
+import storage
+from pec_parser import metrics
+from pec_parser.dedup import file_emails, file_hash, lookup, message_hash
+from pec_parser.lazy import backfill_source
+from pec_parser.mbox_reader import process_mbox_incremental, process_mbox_stream
+from pec_parser.mbox_scanner import iter_message_spans
+
+MBOX_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "test.mbox")
+
+
+@pytest.fixture
+def uploads(tmp_data_dir):
+    os.makedirs(config.UPLOADS_DIR)
+    return config.UPLOADS_DIR
+
+
+def _records():
+    with open(MBOX_PATH, "rb") as f:
+        data = f.read()
+    return [data[o:o + n] for o, n in iter_message_spans(data)]
+
+
+def _write(directory, name, records):
+    path = os.path.join(directory, name)
+    with open(path, "wb") as f:
+        f.write(b"".join(records))
+    return path
+
+
+def _ingest(path, **kwargs):
+    with metrics.ingest_report() as report:
+        emails, entry = process_mbox_incremental(path, **kwargs)
+    return emails, entry, report.to_dict()
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_overlapping_upload_links_known_messages(uploads, monkeypatch, workers):
+    monkeypatch.setattr(config, "INGEST_WORKERS", workers)
+    monkeypatch.setattr(config, "INGEST_SHARD_SIZE", 4)
+    records = _records()
+    january, _, first = _ingest(_write(uploads, "january.mbox", records[:8]), lazy=False)
+    assert first["counters"]["linked"] == 0
+
+    q1, entry, report = _ingest(_write(uploads, "q1.mbox", records), lazy=False)
+    # Only the messages january.mbox did not hold are parsed
+    assert report["counters"]["linked"] == len(january)
+    assert report["counters"]["messages"] == len(records) - 8
+    assert entry["email_count"] == len(q1)
+    assert [e.email_id for e in q1[:len(january)]] == [e.email_id for e in january]
+    assert all(e.source_file == "q1.mbox" for e in q1)
+
+    # Same summaries as parsing everything again
+    shutil.copy(os.path.join(uploads, "q1.mbox"), os.path.join(uploads, "again.mbox"))
+    again, _ = process_mbox_incremental(os.path.join(uploads, "again.mbox"), lazy=False, dedup=False)
+    assert [(e.email_id, e.subject, e.attachment_count) for e in q1] == \
+        [(e.email_id, e.subject, e.attachment_count) for e in again]
+
+
+def test_identical_reupload_links_the_whole_file(uploads):
+    path = _write(uploads, "first.mbox", _records())
+    emails, _, _ = _ingest(path, lazy=False)
+    shutil.copy(path, os.path.join(uploads, "copy.mbox"))
+
+    copied, entry, report = _ingest(os.path.join(uploads, "copy.mbox"), lazy=False)
+    assert [e.email_id for e in copied] == [e.email_id for e in emails]
+    assert report["counters"]["linked"] == len(emails)
+    assert report["counters"]["messages"] == 0
+    assert "mime_parse" not in report["stages"]
+    sources = storage.load_catalog()["sources"]
+    assert [s["email_count"] for s in sources] == [len(emails), len(emails)]
+
+
+def test_same_message_id_is_linked_without_storing(uploads):
+    records = _records()
+    emails, _, _ = _ingest(_write(uploads, "a.mbox", records), lazy=False)
+    # Other raw bytes (mbox From_ lines), same Message-IDs
+    changed = [b"From relay@example.com Mon Jan  1 00:00:00 2024\n" + r.split(b"\n", 1)[1]
+               for r in records]
+    linked, _, report = _ingest(_write(uploads, "b.mbox", changed), lazy=False)
+    assert [e.email_id for e in linked] == [e.email_id for e in emails]
+    assert report["counters"]["linked"] == len(emails)
+    assert "save_email" not in report["stages"]
+
+
+def test_stream_upload_links_known_messages(uploads):
+    emails, _, _ = _ingest(_write(uploads, "a.mbox", _records()), lazy=False)
+    with open(MBOX_PATH, "rb") as f:
+        data = f.read()
+    with metrics.ingest_report() as report:
+        streamed, entry = process_mbox_stream([data[:5000], data[5000:]],
+                                              os.path.join(uploads, "b.mbox"))
+    assert [e.email_id for e in streamed] == [e.email_id for e in emails]
+    assert report.to_dict()["counters"]["linked"] == len(emails)
+    # The streamed file is now known as a whole
+    _, _, again = _ingest(os.path.join(uploads, "b.mbox"), lazy=False)
+    assert "mime_parse" not in again["stages"]
+
+
+def test_pending_emails_are_not_linked(uploads):
+    path = _write(uploads, "lazy.mbox", _records())
+    emails, _, _ = _ingest(path, lazy=True)
+    shutil.copy(path, os.path.join(uploads, "copy.mbox"))
+    _, _, report = _ingest(os.path.join(uploads, "copy.mbox"), lazy=True)
+    assert report["counters"]["linked"] == 0
+
+    backfill_source("copy.mbox")
+    shutil.copy(path, os.path.join(uploads, "third.mbox"))
+    _, _, report = _ingest(os.path.join(uploads, "third.mbox"), lazy=True)
+    assert report["counters"]["linked"] == len(emails)
+
+
+def _index_rows():
+    """email_ids of the messages and files tables of the dedup index."""
+    conn = sqlite3.connect(config.DEDUP_INDEX_PATH)
+    try:
+        return ({eid for (eid,) in conn.execute("SELECT email_id FROM messages")},
+                [eid for (eid,) in conn.execute("SELECT email_id FROM files ORDER BY digest, position")])
+    finally:
+        conn.close()
+
+
+def test_deleted_emails_leave_the_index(uploads):
+    path = _write(uploads, "a.mbox", _records())
+    emails, entry, _ = _ingest(path, lazy=False)
+    messages, files = _index_rows()
+    assert messages >= {e.email_id for e in emails}
+    assert file_emails(file_hash(path)) == files == [e.email_id for e in emails]
+
+    assert storage.delete_source(entry["source_id"])
+    messages, files = _index_rows()
+    assert not {e.email_id for e in emails} & messages
+    assert files == []
+
+    _, _, report = _ingest(_write(uploads, "b.mbox", _records()), lazy=False)
+    assert report["counters"]["linked"] == 0
+    assert report["counters"]["messages"] == len(_records())
+
+
+def test_legacy_dedup_json_is_imported(uploads):
+    records = _records()
+    with open(os.path.join(config.DATA_DIR, "dedup.json"), "w", encoding="utf-8") as f:
+        json.dump({"messages": {message_hash(records[0]): "email_a", message_hash(records[1]): None},
+                   "files": {"f00d": ["email_a"]}}, f)
+    assert lookup(message_hash(records[0])) == (True, "email_a")
+    assert lookup(message_hash(records[1])) == (True, None)
+    assert lookup(message_hash(records[2])) == (False, None)
+    assert file_emails("f00d") == ["email_a"]
+    assert not os.path.exists(os.path.join(config.DATA_DIR, "dedup.json"))
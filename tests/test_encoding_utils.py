@@ -1,6 +1,9 @@
+import pytest
+
 from pec_parser.encoding_utils import (
     decode_header_value,
     extract_email_address,
+    iter_decoded_payload,
     safe_filename,
 )
 
@@ -55,3 +58,49 @@ def test_safe_filename_rfc2047():
 
 def test_safe_filename_none():
     assert safe_filename(None) == "unnamed"
+
+
+@pytest.mark.parametrize("cte", ["base64", "quoted-printable", "8bit"])
+def test_iter_decoded_payload_matches_get_payload(cte):
+    import email
+    from email.message import EmailMessage
+
+    payload = bytes(range(256)) * 300 + "perché = è\n".encode("utf-8") * 50
+    if cte == "8bit":
+        payload = payload.replace(b"\r", b"").replace(b"\n", b"\r\n")
+    msg = EmailMessage()
+    msg.set_content(payload, maintype="application", subtype="octet-stream", cte=cte)
+    part = email.message_from_bytes(msg.as_bytes())
+
+    expected = part.get_payload(decode=True)
+    for chunk_size in (4, 77, 1000, 10 ** 6):
+        chunks = list(iter_decoded_payload(part, chunk_size))
+        assert b"".join(chunks) == expected
+        if chunk_size == 1000:
+            assert max(len(c) for c in chunks) <= chunk_size
+
+
+@pytest.mark.parametrize("body", [
+    b"QUJD\nRA",            # unpadded last quantum
+    b"QUJDRA==RUZH",        # data after the padding is ignored
+    b"QU=JD",               # padding too early is skipped
+    b"QUJDR",               # one character too many: returned as is
+    b"QU*J\r\nD!R",         # junk between characters
+    b"",
+])
+def test_iter_decoded_payload_matches_get_payload_on_malformed_base64(body):
+    import email
+    import random
+
+    cases = [body]
+    rng = random.Random(body)
+    alphabet = b"ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/"
+    cases += [bytes(rng.choice(alphabet + b"===\r\n\n !") for _ in range(rng.randrange(40)))
+              for _ in range(300)]
+    for case in cases:
+        part = email.message_from_bytes(
+            b"Content-Type: application/octet-stream\n"
+            b"Content-Transfer-Encoding: base64\n\n" + case)
+        expected = part.get_payload(decode=True)
+        for chunk_size in (4, 5, 7, 1000):
+            assert b"".join(iter_decoded_payload(part, chunk_size)) == expected, case
@@ -0,0 +1,88 @@
+import mmap
+import os
+
+import pytest
+
+import storage
+from pec_parser import follow
+from pec_parser.follow import follow_once
+from pec_parser.mbox_scanner import iter_message_spans
+from storage.search_index import search_email_ids
+
+MBOX_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "test.mbox")
+
+
+@pytest.fixture
+def records():
+    with open(MBOX_PATH, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return [mm[o:o + n] for o, n in iter_message_spans(mm)]
+
+
+def _source(source_file):
+    catalog = storage.load_catalog()
+    return next(s for s in catalog["sources"] if s["source_file"] == source_file), catalog
+
+
+def test_follow_parses_only_appended_messages(tmp_data_dir, records, monkeypatch):
+    path = os.path.join(os.path.dirname(tmp_data_dir), "growing.mbox")
+    half = len(records) // 2
+    with open(path, "wb") as f:
+        f.write(b"".join(records[:half]))
+    assert follow_once(path) == half
+
+    parsed = []
+    parse_record = follow._parse_record
+    monkeypatch.setattr(follow, "_parse_record",
+                        lambda raw, *args: parsed.append(raw) or parse_record(raw, *args))
+
+    # A message still being written is left for the next poll
+    last = records[half]
+    with open(path, "ab") as f:
+        f.write(last[:len(last) // 2])
+    assert follow_once(path) == 0
+    assert parsed == []
+
+    with open(path, "ab") as f:
+        f.write(last[len(last) // 2:] + b"".join(records[half + 1:]))
+    assert follow_once(path) == len(records) - half
+    assert len(parsed) == len(records) - half
+    assert follow_once(path) == 0
+
+    source, catalog = _source("growing.mbox")
+    assert source["email_count"] == len(records)
+    assert source["follow"]["offset"] == os.path.getsize(path)
+    grouped = {eid for g in catalog["groups"] for eid in g["email_ids"]}
+    assert grouped == {e["email_id"] for e in source["emails_summary"]}
+    new_email = source["emails_summary"][-1]
+    assert storage.load_email(new_email["email_id"])["email_id"] == new_email["email_id"]
+    word = new_email["subject"].split()[0]
+    assert new_email["email_id"] in search_email_ids(word)
+
+
+def test_follow_reparses_replaced_file(tmp_data_dir, records):
+    path = os.path.join(os.path.dirname(tmp_data_dir), "rotated.mbox")
+    with open(path, "wb") as f:
+        f.write(b"".join(records))
+    follow_once(path)
+
+    # Rotation: a new (shorter) file under the same name
+    os.remove(path)
+    with open(path, "wb") as f:
+        f.write(records[0])
+    assert follow_once(path) == 1
+    source, _ = _source("rotated.mbox")
+    assert source["email_count"] == 1
+    assert source["follow"]["messages"] == 1
+
+
+def test_no_follower_in_worker_processes(tmp_data_dir):
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    from pec_parser.mbox_reader import _init_worker
+
+    # Like a rebuild's spawned worker, which re-imports the app
+    settings = {"FOLLOW_PATHS": [MBOX_PATH], "FOLLOW_INTERVAL": 60.0}
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"),
+                             initializer=_init_worker, initargs=(settings,)) as pool:
+        assert pool.submit(follow.start_follower).result() is None
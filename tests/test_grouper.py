@@ -45,3 +45,174 @@ def test_group_count_reasonable(parsed_emails):
     groups = group_emails(parsed_emails)
     # Should be roughly 8-14 groups
     assert 5 <= len(groups) <= 17
+
+
+def _greedy_reference(keys, threshold):
+    """The original O(k^2) pairwise greedy merge, as lists of key indexes."""
+    import difflib
+    merged = [False] * len(keys)
+    groups = []
+    for i, key_i in enumerate(keys):
+        if merged[i]:
+            continue
+        current = [i]
+        merged[i] = True
+        for j in range(i + 1, len(keys)):
+            if merged[j]:
+                continue
+            if difflib.SequenceMatcher(None, key_i, keys[j]).ratio() >= threshold:
+                current.append(j)
+                merged[j] = True
+        groups.append(current)
+    return groups
+
+
+def _blocked(keys, threshold):
+    from pec_parser.grouper import SubjectMatcher
+    matcher = SubjectMatcher(threshold)
+    groups = []
+    for i, key in enumerate(keys):
+        idx = matcher.find(key)
+        if idx is None:
+            matcher.add(key)
+            groups.append([i])
+        else:
+            groups[idx].append(i)
+    return groups
+
+
+def test_blocking_matches_pairwise_greedy():
+    import random
+    rng = random.Random(7)
+    words = ["fattura", "convocazione", "assemblea", "sollecito", "pagamento", "marzo",
+             "pratica", "n.", "2024", "diffida", "verbale", "contratto", "a", "di", "del"]
+    keys = set()
+    while len(keys) < 200:
+        base = " ".join(rng.choice(words) for _ in range(rng.randint(1, 8)))
+        # Random single-character edits to create near-duplicates
+        chars = list(base)
+        for _ in range(rng.randint(0, 3)):
+            if chars and rng.random() < 0.5:
+                del chars[rng.randrange(len(chars))]
+            else:
+                chars.insert(rng.randrange(len(chars) + 1), rng.choice("abcdeo 0123"))
+        keys.add("".join(chars))
+    keys = sorted(keys)
+    rng.shuffle(keys)
+    keys += ["", "x", "xy", "a" * 250, "a" * 240 + "b" * 10]
+    for threshold in (0.85, 0.6):
+        assert _blocked(keys, threshold) == _greedy_reference(keys, threshold)
+
+
+def test_blocking_matches_on_mbox(parsed_emails):
+    from pec_parser.subject_cleaner import clean_subject
+    keys = list(dict.fromkeys(clean_subject(e.subject).lower() for e in parsed_emails))
+    assert _blocked(keys, 0.85) == _greedy_reference(keys, 0.85)
+
+
+def _scaling_keys(n, alphabet):
+    import random
+    rng = random.Random(n)
+    if alphabet == "words":
+        words = ["fattura", "sollecito", "pagamento", "marzo", "pratica", "n.", "diffida",
+                 "verbale", "di", "del", "notifica", "ricorso", "comune", "protocollo"]
+        return [" ".join(rng.choice(words) for _ in range(rng.randint(3, 8))) +
+                " " + str(rng.randint(0, 9999)) for _ in range(n)]
+    return ["".join(rng.choice(alphabet) for _ in range(rng.randint(20, 60))) for _ in range(n)]
+
+
+@pytest.mark.parametrize("alphabet", ["words", "ab"])
+def test_blocking_scales_near_linearly(alphabet):
+    import time
+    from pec_parser.grouper import SubjectMatcher
+
+    def seconds(keys):
+        matcher = SubjectMatcher(0.85, stopgram_seeds=32)
+        start = time.process_time()
+        for key in keys:
+            if matcher.find(key) is None:
+                matcher.add(key)
+        return time.process_time() - start
+
+    small = seconds(_scaling_keys(600, alphabet))
+    large = seconds(_scaling_keys(2400, alphabet))
+    # 4x the subjects: ~4x the time (a quadratic lookup takes ~16x)
+    assert large < 8 * small
+
+
+def test_stopgrams_keep_near_duplicates_together():
+    import random
+    rng = random.Random(5)
+    keys = []
+    for key in _scaling_keys(400, "words"):
+        typo = list(key)
+        typo.insert(rng.randrange(len(typo) + 1), rng.choice("abc 012"))
+        keys += [key, "".join(typo)]
+    keys = list(dict.fromkeys(keys))
+    rng.shuffle(keys)
+
+    def groups(matcher):
+        seeds = {}
+        for i, key in enumerate(keys):
+            idx = matcher.find(key)
+            seeds.setdefault(matcher.add(key) if idx is None else idx, []).append(i)
+        return {tuple(g) for g in seeds.values()}
+
+    from pec_parser.grouper import SubjectMatcher
+    exact = groups(SubjectMatcher(0.85, stopgram_seeds=len(keys)))
+    blocked = groups(SubjectMatcher(0.85, stopgram_seeds=32))
+    assert len(exact & blocked) >= 0.95 * len(exact)
+
+
+def test_group_index_matches_batch(parsed_emails):
+    from pec_parser.grouper import GroupIndex
+    batch = {frozenset(g.email_ids) for g in group_emails(parsed_emails)}
+
+    index = GroupIndex()
+    half = len(parsed_emails) // 2
+    index.assign(parsed_emails[:half])
+    # Reload from the stored form, as the next upload would
+    index = GroupIndex(index.to_list())
+    index.assign(parsed_emails[half:])
+    assert {frozenset(g["email_ids"]) for g in index.to_list()} == batch
+
+
+def test_group_index_remove(parsed_emails):
+    from pec_parser.grouper import GroupIndex
+    index = GroupIndex()
+    index.assign(parsed_emails)
+    group = index.group_of(parsed_emails[0].email_id)
+    group_id, members = group["group_id"], list(group["email_ids"])
+    index.remove(members, {})
+    assert index.group_of(parsed_emails[0].email_id) is None
+    assert group_id not in [g["group_id"] for g in index.to_list()]
+    assert sum(len(g["email_ids"]) for g in index.to_list()) == len(parsed_emails) - len(members)
+
+
+def test_group_index_remove_recomputes_label():
+    from pec_parser.grouper import GroupIndex
+    from pec_parser.models import EmailSummary
+
+    def summary(email_id, subject):
+        return EmailSummary(email_id=email_id, subject=subject, sender="", date="")
+
+    emails = [
+        summary("email_a", "Sollecito pagamento fattura"),
+        summary("email_b", "R: Sollecito pagamento fattura 2024/117"),
+        summary("email_c", "Re: sollecito pagamento fatture"),
+    ]
+    index = GroupIndex()
+    index.assign(emails)
+    group = index.group_of("email_a")
+    assert group["email_ids"] == ["email_a", "email_b", "email_c"]
+    assert group["label"] == "Sollecito pagamento fattura 2024/117"
+
+    index.remove(["email_a", "email_b"], {e.email_id: e.clean_subject for e in emails})
+    group = index.group_of("email_c")
+    assert group["label"] == "sollecito pagamento fatture"
+    assert group["key"] == "sollecito pagamento fatture"
+    assert group["keys"] == ["sollecito pagamento fatture"]
+    # New emails are compared against the recomputed seed
+    index = GroupIndex(index.to_list())
+    index.assign([summary("email_d", "Sollecito pagamento fatture")])
+    assert index.group_of("email_d")["group_id"] == group["group_id"]
@@ -1,6 +1,5 @@
 import os
 import json
-import shutil
 import pytest
 
 from pec_parser.mbox_reader import process_mbox
@@ -11,13 +10,14 @@ MBOX_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file_
 
 
 @pytest.fixture(scope="module")
-def processed():
-    """Process mbox once for all tests in this module."""
-    # Clean data dir
-    if os.path.exists(config.DATA_DIR):
-        shutil.rmtree(config.DATA_DIR)
-    emails, sources = process_mbox(MBOX_PATH)
-    return emails, sources
+def processed(tmp_path_factory):
+    """Process mbox once for all tests in this module, into a data directory
+    of its own."""
+    from tests.conftest import use_data_dir
+
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        use_data_dir(monkeypatch, tmp_path_factory.mktemp("json_store"))
+        yield process_mbox(MBOX_PATH)
 
 
 def test_catalog_created(processed):
@@ -29,8 +29,8 @@ def test_catalog_content(processed):
     assert catalog is not None
     assert catalog["total_emails"] == 19
     assert catalog["total_sources"] >= 1
-    source = catalog["sources"][0]
-    assert len(source["groups"]) >= 5
+    assert len(catalog["groups"]) >= 5
+    assert "groups" not in catalog["sources"][0]
 
 
 def test_individual_emails_saved(processed):
@@ -51,3 +51,119 @@ def test_load_email(processed):
 def test_load_nonexistent():
     data = load_email("nonexistent_id")
     assert data is None
+
+
+def test_catalog_view_cached_and_invalidated(tmp_data_dir):
+    from storage.json_store import get_catalog_view, save_catalog, delete_source
+
+    assert get_catalog_view() is None
+    emails, sources = process_mbox(MBOX_PATH)
+    view = get_catalog_view()
+    assert view is get_catalog_view()
+    assert len(view.by_id) == len(view.summaries)
+    assert view.sources[0]["email_count"] == len(emails)
+    dump = json.loads(view.to_json())
+    catalog = load_catalog()
+    assert dump["groups"] == catalog["groups"]
+    assert [dict(s, groups=None) for s in dump["sources"]] == \
+        [dict(s, groups=None) for s in catalog["sources"]]
+    assert sum(len(g["email_ids"]) for g in dump["sources"][0]["groups"]) == len(emails)
+
+    save_catalog(load_catalog()["sources"])
+    assert get_catalog_view() is not view
+
+    view = get_catalog_view()
+    delete_source(view.sources[0]["source_id"])
+    assert get_catalog_view().sources == []
+
+
+def test_catalog_view_sees_external_writes(tmp_data_dir, monkeypatch):
+    from storage.json_store import get_catalog_view
+
+    monkeypatch.setattr(config, "CATALOG_CACHE_CHECK_INTERVAL", 0)
+    process_mbox(MBOX_PATH)
+    view = get_catalog_view()
+    catalog = load_catalog()
+    catalog["sources"] = []
+    with open(config.CATALOG_PATH, "w", encoding="utf-8") as f:
+        json.dump(catalog, f)
+    assert get_catalog_view() is not view
+    assert get_catalog_view().sources == []
+
+
+def test_catalog_view_date_index(tmp_data_dir):
+    from storage.json_store import CatalogView
+
+    def summary(eid, date, timestamp=None):
+        return {"email_id": eid, "subject": eid, "sender": "", "date": date, "timestamp": timestamp}
+
+    view = CatalogView({"sources": [{
+        "source_id": "s", "source_file": "s.mbox", "email_count": 4,
+        "emails_summary": [
+            summary("dec", "10/12/2023 08:00", 1702195200),
+            summary("jan", "02/01/2024 08:00", 1704182400),
+            # Stored before timestamps existed: the display date is used
+            summary("legacy", "05/01/2024 00:00"),
+            summary("undated", "not a date"),
+        ],
+    }]})
+    chronological = [s["email_id"] for s in view.ordered("emails", "date")]
+    assert chronological == ["dec", "jan", "legacy", "undated"]
+    assert [s["email_id"] for s in view.between(1704067200)] == ["jan", "legacy"]
+    assert [s["email_id"] for s in view.between(until=1704182400)] == ["dec", "jan"]
+    assert [s["email_id"] for s in view.ordered("emails", "date", reverse=True, since=1702195200,
+                                                until=1704412800)] == ["legacy", "jan", "dec"]
+
+
+def test_catalog_view_facets(tmp_data_dir):
+    from storage.json_store import CatalogView
+
+    def summary(eid, sender, provider, pec_type, attachments, timestamp):
+        return {"email_id": eid, "subject": eid, "sender": sender, "date": "",
+                "pec_provider": provider, "pec_type": pec_type,
+                "attachment_count": attachments, "timestamp": timestamp}
+
+    view = CatalogView({"sources": [{
+        "source_id": "s", "source_file": "s.mbox", "email_count": 3,
+        "emails_summary": [
+            summary("a", "Anna@Comune.it", "Aruba", "posta-certificata", 1, 1709251200),  # 2024-03-01
+            summary("b", "bruno@comune.it", "Poste", "errore-consegna", 0, 1709251200),
+            summary("c", "carla@ditta.it", "Aruba", "posta-certificata", 2, 1704067200),  # 2024-01-01
+        ],
+    }]})
+    assert view.facets["sender_domain"] == {"comune.it": {"a", "b"}, "ditta.it": {"c"}}
+    assert view.facets["month"] == {"2024-03": {"a", "b"}, "2024-01": {"c"}}
+    assert view.facet_ids({}) is None
+    assert view.facet_ids({"pec_provider": ["Aruba"], "month": ["2024-03"]}) == {"a"}
+    assert view.facet_ids({"pec_type": ["errore-consegna", "posta-certificata"]}) == {"a", "b", "c"}
+
+    counts = view.facet_counts({"pec_provider": ["Aruba"]})
+    # The selected facet keeps the counts of its alternatives
+    assert counts["pec_provider"] == [{"value": "Aruba", "count": 2}, {"value": "Poste", "count": 1}]
+    assert counts["has_attachments"] == [{"value": "true", "count": 2}]
+    assert view.facet_counts({}, base={"b"})["sender"] == [{"value": "bruno@comune.it", "count": 1}]
+
+
+def test_email_rewrites_are_atomic(tmp_data_dir):
+    import threading
+    from pec_parser.models import ParsedEmail
+    from storage.json_store import save_email
+
+    email = ParsedEmail(email_id="email_big", message_id="", subject="", sender="",
+                        recipients=[], date="", body_text="x" * (2 * 1024 * 1024))
+    save_email(email)
+    stop = threading.Event()
+
+    def rewrite():
+        while not stop.is_set():
+            save_email(email)
+
+    writer = threading.Thread(target=rewrite)
+    writer.start()
+    try:
+        for _ in range(50):
+            assert load_email("email_big")["email_id"] == "email_big"
+    finally:
+        stop.set()
+        writer.join()
+    assert os.listdir(config.EMAILS_DIR) == ["email_big.json"]
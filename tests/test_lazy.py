@@ -0,0 +1,188 @@
+import os
+import shutil
+import sqlite3
+
+import pytest
+
+import config
+import storage
+from pec_parser.lazy import backfill_source, ensure_extracted, flush_deferred
+from pec_parser.mbox_reader import process_mbox_incremental
+from pec_parser.mbox_scanner import iter_message_spans, message_from_record, message_skeleton
+from pec_parser.pec_extractor import parse_pec_message
+from storage.blob_store import blob_path
+from storage.search_index import search_email_ids
+
+MBOX_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "test.mbox")
+
+
+@pytest.fixture
+def lazy_source(tmp_data_dir):
+    os.makedirs(config.UPLOADS_DIR)
+    path = os.path.join(config.UPLOADS_DIR, "lazy.mbox")
+    shutil.copy(MBOX_PATH, path)
+    emails, entry = process_mbox_incremental(path, lazy=True)
+    return emails, entry
+
+
+def _full_parse():
+    with open(MBOX_PATH, "rb") as f:
+        data = f.read()
+    return {
+        parsed.email_id: parsed
+        for parsed in (parse_pec_message(message_from_record(data[o:o + n]), i)
+                       for i, (o, n) in enumerate(iter_message_spans(data)))
+    }
+
+
+def test_skeleton_matches_full_parse():
+    with open(MBOX_PATH, "rb") as f:
+        data = f.read()
+    for offset, length in iter_message_spans(data):
+        raw = data[offset:offset + length]
+        for record in (raw, raw.replace(b"\n", b"\r\n")):
+            full = [(p.get_content_type(), p.get_filename()) for p in message_from_record(record).walk()]
+            light = [(p.get_content_type(), p.get_filename()) for p in message_skeleton(record).walk()]
+            assert light == full
+
+
+def test_lazy_ingest_stores_headers_only(lazy_source):
+    emails, entry = lazy_source
+    full = _full_parse()
+    assert entry["email_count"] == len(full)
+    for summary in emails:
+        doc = storage.load_email(summary.email_id)
+        assert doc["body_pending"]
+        assert doc["body_text"] is None
+        expected = full[summary.email_id]
+        assert doc["subject"] == expected.subject
+        assert doc["pec_provider"] == expected.pec_provider
+        assert [a["filename"] for a in doc["attachments"]] == [a.filename for a in expected.attachments]
+        assert summary.attachment_count == len(expected.attachments)
+    assert not os.path.exists(config.BLOBS_DIR) or not any(
+        files for _, _, files in os.walk(config.BLOBS_DIR)
+    )
+
+
+def test_extract_on_access(lazy_source):
+    emails, _ = lazy_source
+    full = _full_parse()
+    summary = next(s for s in emails if s.attachment_count)
+    doc = ensure_extracted(summary.email_id)
+    assert not doc["body_pending"]
+    expected = full[summary.email_id]
+    assert doc["body_text"] == expected.body_text
+    assert [a["size"] for a in doc["attachments"]] == [a.size for a in expected.attachments]
+    assert all(os.path.exists(blob_path(a["blob"])) for a in doc["attachments"])
+    # Cached: the stored document is now the full one
+    assert storage.load_email(summary.email_id) == doc
+
+
+def test_slow_extraction_does_not_block_other_emails(lazy_source, monkeypatch):
+    import threading
+    from pec_parser import lazy
+
+    emails, _ = lazy_source
+    slow_id, other_id = emails[0].email_id, emails[1].email_id
+    entered, release = threading.Event(), threading.Event()
+    real_extract = lazy._extract
+
+    def extract(doc, *args):
+        if doc["email_id"] == slow_id:
+            entered.set()
+            release.wait(5)
+        return real_extract(doc, *args)
+
+    monkeypatch.setattr(lazy, "_extract", extract)
+    slow = threading.Thread(target=ensure_extracted, args=(slow_id,))
+    slow.start()
+    try:
+        assert entered.wait(5)
+        assert not ensure_extracted(other_id)["body_pending"]
+        assert not release.is_set()
+    finally:
+        release.set()
+        slow.join()
+    assert not storage.load_email(slow_id)["body_pending"]
+    assert lazy._extract_locks == {}
+
+
+def _stamp(path):
+    # With the write-ahead log of an SQLite file
+    stamps = []
+    for name in (path, path + "-wal"):
+        if os.path.exists(name):
+            st = os.stat(name)
+            stamps.append((st.st_ino, st.st_mtime_ns, st.st_size))
+    return stamps
+
+
+def test_extract_on_access_defers_global_writes(lazy_source):
+    emails, _ = lazy_source
+    summary = next(s for s in emails if s.attachment_count)
+    before = _stamp(config.BLOB_REFS_PATH), _stamp(config.SEARCH_INDEX_PATH)
+    doc = ensure_extracted(summary.email_id)
+    assert (_stamp(config.BLOB_REFS_PATH), _stamp(config.SEARCH_INDEX_PATH)) == before
+
+    flush_deferred()
+    conn = sqlite3.connect(config.BLOB_REFS_PATH)
+    try:
+        refs = {d for (d,) in conn.execute("SELECT digest FROM refs WHERE email_id = ?", (summary.email_id,))}
+    finally:
+        conn.close()
+    assert refs == {a["blob"] for a in doc["attachments"]}
+    body_word = next(w for w in doc["body_text"].split() if w.isalpha() and len(w) > 4)
+    assert summary.email_id in search_email_ids(body_word)
+
+
+def test_delete_before_flush_drops_deferred_commits(lazy_source):
+    emails, entry = lazy_source
+    summary = next(s for s in emails if s.attachment_count)
+    doc = ensure_extracted(summary.email_id)
+    assert storage.delete_source(entry["source_id"])
+    flush_deferred()
+    assert not any(os.path.exists(blob_path(a["blob"])) for a in doc["attachments"])
+    body_word = next(w for w in doc["body_text"].split() if w.isalpha() and len(w) > 4)
+    assert summary.email_id not in search_email_ids(body_word)
+
+
+def test_backfill_source(lazy_source):
+    emails, entry = lazy_source
+    ensure_extracted(emails[0].email_id)
+    assert backfill_source(entry["source_file"]) == len(emails) - 1
+    assert not any(storage.load_email(s.email_id)["body_pending"] for s in emails)
+    assert backfill_source(entry["source_file"]) == 0
+
+    # Body tokens reach the search index once extracted
+    last = _full_parse()[emails[-1].email_id]
+    body_word = next(w for w in last.body_text.split() if w.isalpha() and len(w) > 4)
+    assert emails[-1].email_id in search_email_ids(body_word)
+
+
+@pytest.mark.parametrize("deleted", ["first", "second"])
+def test_overlapping_lazy_upload_keeps_every_copy(lazy_source, deleted):
+    emails, first = lazy_source
+    path = os.path.join(config.UPLOADS_DIR, "overlap.mbox")
+    shutil.copy(MBOX_PATH, path)
+    _, second = process_mbox_incremental(path, lazy=True)
+    summary = next(s for s in emails if s.attachment_count)
+    doc = storage.load_email(summary.email_id)
+    # The pending record still points at the first upload; the copy is added
+    assert doc["source_file"] == "lazy.mbox"
+    assert [span[0] for span in doc["other_sources"]] == ["overlap.mbox"]
+
+    # Either upload can go: the body is read from the surviving one
+    assert storage.delete_source((first if deleted == "first" else second)["source_id"])
+    doc = ensure_extracted(summary.email_id)
+    assert not doc["body_pending"]
+    assert doc["body_text"] == _full_parse()[summary.email_id].body_text
+    assert doc["source_file"] == ("overlap.mbox" if deleted == "first" else "lazy.mbox")
+
+
+def test_backfill_extracts_copies_in_other_sources(lazy_source):
+    emails, _ = lazy_source
+    path = os.path.join(config.UPLOADS_DIR, "overlap.mbox")
+    shutil.copy(MBOX_PATH, path)
+    process_mbox_incremental(path, lazy=True)
+    assert backfill_source("overlap.mbox") == len(emails)
+    assert not any(storage.load_email(s.email_id)["body_pending"] for s in emails)
@@ -0,0 +1,221 @@
+import json
+import os
+import shutil
+
+from pec_parser.mbox_reader import process_mbox
+import config
+
+MBOX_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "test.mbox")
+
+
+def _snapshot():
+    """Catalog + email JSONs + attachment/blob listing, minus per-run source metadata."""
+    with open(config.CATALOG_PATH, "r", encoding="utf-8") as f:
+        catalog = json.load(f)
+    for source in catalog["sources"]:
+        source.pop("source_id")
+        source.pop("uploaded_at")
+    emails = {}
+    for name in sorted(os.listdir(config.EMAILS_DIR)):
+        with open(os.path.join(config.EMAILS_DIR, name), "rb") as f:
+            emails[name] = f.read()
+    attachments = []
+    for directory in (config.ATTACHMENTS_DIR, config.BLOBS_DIR):
+        for root, _, files in os.walk(directory):
+            for name in files:
+                path = os.path.join(root, name)
+                attachments.append((os.path.relpath(path, config.DATA_DIR), os.path.getsize(path)))
+    return catalog, emails, sorted(attachments)
+
+
+def test_parallel_ingest_matches_serial(tmp_data_dir, monkeypatch):
+    monkeypatch.setattr(config, "INGEST_WORKERS", 1)
+    serial_emails, _ = process_mbox(MBOX_PATH)
+    serial = _snapshot()
+
+    shutil.rmtree(config.DATA_DIR)
+
+    monkeypatch.setattr(config, "INGEST_WORKERS", 3)
+    monkeypatch.setattr(config, "INGEST_SHARD_SIZE", 4)
+    parallel_emails, _ = process_mbox(MBOX_PATH)
+
+    assert [e.to_dict() for e in parallel_emails] == [e.to_dict() for e in serial_emails]
+    assert _snapshot() == serial
+
+
+def test_streaming_ingest_keeps_only_summaries(tmp_data_dir):
+    from pec_parser.models import EmailSummary
+    from storage.json_store import load_email
+
+    summaries, sources = process_mbox(MBOX_PATH)
+    assert summaries and all(isinstance(s, EmailSummary) for s in summaries)
+    assert "_emails" not in sources[0]
+    data = load_email(summaries[0].email_id)
+    assert data["body_text"] or data["body_html"]
+    assert data["source_offset"] == 0
+    assert data["source_length"] > 0
+    assert data["clean_subject"] == summaries[0].clean_subject
+
+
+def test_postings_merged_in_batches(tmp_data_dir, monkeypatch):
+    from storage import search_index
+    from storage.search_index import search_email_ids
+
+    monkeypatch.setattr(config, "SEARCH_INDEX_BATCH", 3)
+    held = []
+    real_flush = search_index.PostingsBatch.flush
+
+    def flush(self, remove_ids=()):
+        held.append(len({eid for ids in self.postings.values() for eid in ids}))
+        real_flush(self, remove_ids)
+
+    monkeypatch.setattr(search_index.PostingsBatch, "flush", flush)
+    summaries, _ = process_mbox(MBOX_PATH)
+    assert len(held) > 2 and max(held) <= 3
+    assert search_email_ids(summaries[-1].subject.split()[-1]) >= {summaries[-1].email_id}
+
+
+def test_upload_joins_existing_global_groups(tmp_data_dir):
+    from pec_parser.mbox_reader import process_mbox_incremental
+    from storage.json_store import load_catalog, delete_source
+
+    process_mbox(MBOX_PATH)
+    groups_before = {g["group_id"]: len(g["email_ids"]) for g in load_catalog()["groups"]}
+
+    # Same messages from another file: every email lands in an existing group
+    copy_path = os.path.join(config.DATA_DIR, "copy.mbox")
+    shutil.copy(MBOX_PATH, copy_path)
+    _, entry = process_mbox_incremental(copy_path)
+    catalog = load_catalog()
+    assert {g["group_id"] for g in catalog["groups"]} == set(groups_before)
+
+    delete_source(entry["source_id"])
+    assert {g["group_id"]: len(g["email_ids"]) for g in load_catalog()["groups"]} == groups_before
+
+
+def test_blobs_shared_and_collected(tmp_data_dir):
+    from pec_parser.mbox_reader import process_mbox_incremental
+    from storage.blob_store import blob_path
+    from storage.json_store import delete_source, load_email
+
+    emails, sources = process_mbox(MBOX_PATH)
+    digests = {a["blob"] for e in emails for a in load_email(e.email_id)["attachments"]}
+    assert digests and all(os.path.exists(blob_path(d)) for d in digests)
+    assert not os.path.exists(config.ATTACHMENTS_DIR)
+
+    copy_path = os.path.join(config.DATA_DIR, "copy.mbox")
+    shutil.copy(MBOX_PATH, copy_path)
+    _, entry = process_mbox_incremental(copy_path)
+    delete_source(entry["source_id"])
+    assert all(os.path.exists(blob_path(d)) for d in digests)
+
+    delete_source(sources[0]["source_id"])
+    assert not any(os.path.exists(blob_path(d)) for d in digests)
+
+
+def test_incremental_ingest_reports_progress(tmp_data_dir):
+    from pec_parser.mbox_reader import process_mbox_incremental
+
+    calls = []
+    emails, _ = process_mbox_incremental(MBOX_PATH, progress=lambda *args: calls.append(args))
+    phases = list(dict.fromkeys(call[0] for call in calls))
+    assert phases == ["scan", "parse", "attachments", "grouping", "save"]
+    size = os.path.getsize(MBOX_PATH)
+    # One scan: progress goes by bytes until the message count is known
+    assert ("parse", 0, None, 0, size) in calls
+    read = [call[3] for call in calls if call[0] == "parse" and call[2] is None]
+    assert read == sorted(read) and 0 < read[-1] <= size
+    assert ("parse", len(emails), len(emails), size, size) in calls
+
+
+def test_serial_ingest_scans_once(tmp_data_dir, monkeypatch):
+    from pec_parser import mbox_reader
+
+    monkeypatch.setattr(config, "INGEST_WORKERS", 1)
+    scans = []
+    real_scan = mbox_reader.scan_mbox
+    monkeypatch.setattr(mbox_reader, "scan_mbox", lambda *args: scans.append(args) or real_scan(*args))
+    monkeypatch.setattr(mbox_reader, "_message_spans", lambda path: scans.append(path) or [])
+    mbox_reader.process_mbox_incremental(MBOX_PATH, progress=lambda *args: None)
+    assert len(scans) == 1
+
+
+def test_streaming_upload_matches_incremental(tmp_data_dir):
+    from pec_parser.mbox_reader import process_mbox_incremental, process_mbox_stream
+    from storage.json_store import load_email
+
+    expected, _ = process_mbox_incremental(MBOX_PATH)
+    expected_docs = {e.email_id: load_email(e.email_id) for e in expected}
+
+    with open(MBOX_PATH, "rb") as f:
+        data = f.read()
+    os.makedirs(config.UPLOADS_DIR)
+    save_path = os.path.join(config.UPLOADS_DIR, os.path.basename(MBOX_PATH))
+    chunks = (data[i:i + 1000] for i in range(0, len(data), 1000))
+    emails, entry = process_mbox_stream(chunks, save_path)
+
+    assert [e.to_dict() for e in emails] == [e.to_dict() for e in expected]
+    assert {e.email_id: load_email(e.email_id) for e in emails} == expected_docs
+    assert entry["email_count"] == len(expected)
+    with open(save_path, "rb") as f:
+        assert f.read() == data
+
+
+def _count_parsed(monkeypatch):
+    import pec_parser.mbox_reader as mbox_reader
+    calls = []
+    real = mbox_reader._parse_record
+
+    def counting(*args):
+        calls.append(args[2])
+        return real(*args)
+
+    monkeypatch.setattr(mbox_reader, "_parse_record", counting)
+    return calls
+
+
+def test_reparse_only_parses_changed_messages(tmp_data_dir, monkeypatch):
+    from pec_parser.mbox_scanner import iter_message_spans
+    from storage.json_store import load_catalog, load_email
+
+    with open(MBOX_PATH, "rb") as f:
+        data = f.read()
+    spans = list(iter_message_spans(data))
+    archive = os.path.join(os.path.dirname(tmp_data_dir), "archive.mbox")
+    cut = spans[-3][0]
+    with open(archive, "wb") as f:
+        f.write(data[:cut])
+
+    first, _ = process_mbox(archive)
+    assert len(first) == len(spans) - 3
+
+    # Appended messages are the only ones parsed
+    with open(archive, "wb") as f:
+        f.write(data)
+    calls = _count_parsed(monkeypatch)
+    emails, _ = process_mbox(archive)
+    assert calls == [offset for offset, _ in spans[-3:]]
+    assert [e.email_id for e in emails[:len(first)]] == [e.email_id for e in first]
+    assert len(emails) == len(spans)
+
+    # Nothing changed: nothing parsed, same catalog
+    catalog = load_catalog()
+    calls.clear()
+    process_mbox(archive)
+    assert calls == []
+    assert [s["emails_summary"] for s in load_catalog()["sources"]] == \
+        [s["emails_summary"] for s in catalog["sources"]]
+
+    # A vanished message is removed
+    with open(archive, "wb") as f:
+        f.write(data[:spans[-1][0]])
+    emails, _ = process_mbox(archive)
+    assert calls == []
+    gone = set(s["email_id"] for s in catalog["sources"][0]["emails_summary"]) - \
+        set(e.email_id for e in emails)
+    assert len(gone) == 1
+    assert load_email(gone.pop()) is None
+
+    # full reparse parses everything again
+    process_mbox(archive, reuse=False)
+    assert len(calls) == len(spans) - 1
@@ -0,0 +1,159 @@
+import mailbox
+import os
+import pytest
+
+from pec_parser.encoding_utils import iter_decoded_payload
+from pec_parser.mbox_scanner import (
+    scan_mbox,
+    iter_message_spans,
+    message_from_record,
+    message_skeleton,
+    read_record,
+)
+
+MBOX_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "test.mbox")
+
+SAMPLE = (
+    b"From a@example.com Mon Jan  1 00:00:00 2024\n"
+    b"Subject: first\n"
+    b"\n"
+    b"body one\n"
+    b">From the quoted line\n"
+    b"\n"
+    b"From b@example.com Mon Jan  1 00:00:01 2024\n"
+    b"Subject: second\n"
+    b"\n"
+    b"body two\n"
+)
+
+
+def test_spans_cover_file():
+    spans = list(iter_message_spans(SAMPLE))
+    assert len(spans) == 2
+    assert spans[0][0] == 0
+    assert spans[0][0] + spans[0][1] == spans[1][0]
+    assert spans[1][0] + spans[1][1] == len(SAMPLE)
+
+
+def test_spans_from_middle_offset():
+    spans = list(iter_message_spans(SAMPLE, start=10))
+    assert len(spans) == 1
+    assert SAMPLE[spans[0][0]:].startswith(b"From b@example.com")
+
+
+def test_scan_records(tmp_path):
+    path = tmp_path / "sample.mbox"
+    path.write_bytes(SAMPLE)
+    records = [(r.offset, r.length, bytes(r.data)) for r in scan_mbox(str(path))]
+    assert len(records) == 2
+    msg = message_from_record(records[0][2])
+    assert msg["Subject"] == "first"
+    assert msg.get_payload() == "body one\n>From the quoted line\n"
+    offset, length, data = records[1]
+    assert read_record(str(path), offset, length) == data
+
+
+def test_scan_empty_file(tmp_path):
+    path = tmp_path / "empty.mbox"
+    path.write_bytes(b"")
+    assert list(scan_mbox(str(path))) == []
+
+
+def test_matches_stdlib_mailbox():
+    mbox = mailbox.mbox(MBOX_PATH)
+    expected = [msg.as_bytes() for msg in mbox]
+    mbox.close()
+    scanned = [message_from_record(r.data).as_bytes() for r in scan_mbox(MBOX_PATH)]
+    assert scanned == expected
+
+
+@pytest.mark.parametrize("chunk_size", [1, 5, 7, 4096, 10 ** 9])
+def test_splitter_matches_spans(chunk_size):
+    from pec_parser.mbox_scanner import MboxSplitter
+
+    with open(MBOX_PATH, "rb") as f:
+        data = b"garbage before\n" + f.read()
+    expected = [(offset, data[offset:offset + length])
+                for offset, length in iter_message_spans(data)]
+
+    splitter = MboxSplitter()
+    records = []
+    for pos in range(0, len(data), chunk_size):
+        records.extend(splitter.feed(data[pos:pos + chunk_size]))
+    records.extend(splitter.close())
+    assert records == expected
+
+
+def test_splitter_without_messages():
+    from pec_parser.mbox_scanner import MboxSplitter
+
+    splitter = MboxSplitter()
+    assert splitter.feed(b"no messages Fro") == []
+    assert splitter.feed(b"m here\n") == []
+    assert splitter.close() == []
+
+
+NESTED = (
+    b"From a@example.com Mon Jan  1 00:00:00 2024\r\n"
+    b"Content-Type: multipart/mixed; boundary=\"b\"\r\n"
+    b"\r\n"
+    b"preamble\r\n"
+    b"--b\r\n"
+    b"Content-Type: multipart/alternative; boundary=\"b-alt\"\r\n"
+    b"\r\n"
+    b"--b-alt\r\n"
+    b"Content-Type: text/plain; charset=latin-1\r\n"
+    b"Content-Transfer-Encoding: 8bit\r\n"
+    b"\r\n"
+    b"perch\xe8\r\n"
+    b"--b-alt--\r\n"
+    b"--b \r\n"
+    b"Content-Type: application/octet-stream\r\n"
+    b"Content-Transfer-Encoding: base64\r\n"
+    b"\r\n"
+    b"QUJD\r\nRA\r\n"
+    b"--b\r\n"
+    b"Content-Type: text/plain\r\n"
+    b"\r\n"
+    b"no closing delimiter\r\n"
+)
+
+
+UNCLOSED = (
+    b"From a@example.com Mon Jan  1 00:00:00 2024\n"
+    b"Content-Type: multipart/mixed; boundary=\"b\"\n"
+    b"\n"
+    b"--b\n"
+    b"Content-Type: multipart/mixed; boundary=\"c\"\n"
+    b"\n"
+    b"--c\n"
+    b"\n"
+    b"ended by the outer delimiter\n"
+    b"\n"
+    b"--b\n"
+    b"\n"
+    b"ended by the message\n"
+    b"\n"
+)
+
+
+@pytest.mark.parametrize("raw", [NESTED, UNCLOSED])
+def test_skeleton_splits_like_the_email_package(raw):
+    full, light = message_from_record(raw), message_skeleton(raw)
+    assert ([p.get_content_type() for p in light.walk()]
+            == [p.get_content_type() for p in full.walk()])
+    leaves = [(f, l) for f, l in zip(full.walk(), light.walk()) if not f.is_multipart()]
+    assert leaves
+    for f, l in leaves:
+        assert isinstance(l.raw_body(), memoryview)
+        assert b"".join(iter_decoded_payload(l, 4)) == f.get_payload(decode=True)
+        assert l.get_payload(decode=True) == f.get_payload(decode=True)
+
+
+def test_skeleton_does_not_copy_the_record():
+    data = bytearray(NESTED)
+    msg = message_skeleton(data)
+    start = data.index(b"QUJD")
+    data[start:start + 4] = b"RUZH"
+    attachment = list(msg.walk())[-2]
+    assert attachment.get_payload(decode=True) == b"EFGD"
@@ -0,0 +1,79 @@
+import os
+import random
+import tracemalloc
+
+import pytest
+
+import config
+from bench.corpus import generate_mbox, generate_message
+from pec_parser import metrics
+from pec_parser.lazy import ensure_extracted
+from pec_parser.mbox_reader import process_mbox, process_mbox_incremental
+
+
+def test_memory_profile_in_ingest_report(tmp_data_dir, mbox_path):
+    with metrics.ingest_report() as plain:
+        process_mbox(mbox_path)
+    assert "memory" not in plain.to_dict()
+
+    with metrics.ingest_report(memory=True) as report:
+        process_mbox(mbox_path, reuse=False)
+    assert not tracemalloc.is_tracing()
+    memory = report.to_dict()["memory"]
+    assert memory["peak_bytes"] > memory["start_bytes"]
+    assert memory["stages"]["mime_parse"]["peak_bytes"] > 0
+    # Stage peaks include nested stages, so none exceeds the overall peak
+    assert all(s["peak_bytes"] <= memory["peak_bytes"] for s in memory["stages"].values())
+    assert memory["top_sites"] and all(":" in s["site"] for s in memory["top_sites"])
+
+
+@pytest.fixture(scope="module")
+def large_mbox(tmp_path_factory):
+    # Many large attachments: memory must follow the largest message, not
+    # the size of the mailbox or of its attachments combined
+    path = str(tmp_path_factory.mktemp("memory") / "large.mbox")
+    generate_mbox(path, 120, seed=3, large_kb=512, large_every=2)
+    return path
+
+
+@pytest.mark.parametrize("ingest, budget", [
+    ("process_mbox", "INGEST_MEMORY_BUDGET"),
+    ("incremental", "INGEST_MEMORY_BUDGET"),
+    ("lazy", "LAZY_INGEST_MEMORY_BUDGET"),
+])
+def test_ingest_stays_within_memory_budget(tmp_data_dir, large_mbox, ingest, budget):
+    budget = getattr(config, budget)
+    assert os.path.getsize(large_mbox) > 2 * config.INGEST_MEMORY_BUDGET
+    with metrics.ingest_report(memory=True) as report:
+        if ingest == "process_mbox":
+            process_mbox(large_mbox)
+        else:
+            process_mbox_incremental(large_mbox, lazy=ingest == "lazy")
+    memory = report.to_dict()["memory"]
+    used = memory["peak_bytes"] - memory["start_bytes"]
+    assert used < budget, memory["top_sites"]
+
+
+@pytest.mark.parametrize("lazy", [False, True])
+@pytest.mark.parametrize("large_kb", [2 * 1024, 24 * 1024])
+def test_large_attachment_memory_does_not_grow_with_its_size(tmp_data_dir, lazy, large_kb):
+    os.makedirs(config.UPLOADS_DIR)
+    path = os.path.join(config.UPLOADS_DIR, "large.mbox")
+    with open(path, "wb") as f:
+        f.write(generate_message(random.Random(0), 0, large_kb=large_kb, large_every=1).encode("utf-8"))
+
+    tracemalloc.start()
+    try:
+        if lazy:
+            emails, _ = process_mbox_incremental(path, lazy=True)
+        tracemalloc.reset_peak()
+        start = tracemalloc.get_traced_memory()[0]
+        if lazy:
+            # The record is parsed on access, straight from the mbox
+            assert not ensure_extracted(emails[0].email_id)["body_pending"]
+        else:
+            process_mbox(path)
+        used = tracemalloc.get_traced_memory()[1] - start
+    finally:
+        tracemalloc.stop()
+    assert used < config.MESSAGE_MEMORY_BUDGET
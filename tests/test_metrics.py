@@ -0,0 +1,102 @@
+import time
+
+import pytest
+
+import config
+from pec_parser import metrics
+from pec_parser.mbox_reader import process_mbox
+
+
+@pytest.fixture(autouse=True)
+def fresh_registry():
+    metrics.reset()
+    yield
+    metrics.reset()
+
+
+def test_nested_stages_are_exclusive():
+    with metrics.ingest_report() as report:
+        with metrics.stage("outer"):
+            time.sleep(0.02)
+            with metrics.stage("inner"):
+                time.sleep(0.03)
+    stages = report.to_dict()["stages"]
+    assert list(stages) == ["inner", "outer"]
+    assert 0.015 <= stages["outer"]["seconds"] < 0.03
+    assert stages["inner"]["seconds"] >= 0.03
+
+
+def test_timed_iterator_and_counters():
+    with metrics.ingest_report() as report:
+        assert list(metrics.timed(iter([1, 2, 3]), "scan")) == [1, 2, 3]
+        metrics.count("attachments", 2)
+        for i, seconds in enumerate([0.5, 0.1, 0.3]):
+            metrics.message(seconds, i, "email_{}".format(i))
+    data = report.to_dict()
+    # One call per item, plus the final one that ends the iteration
+    assert data["stages"]["scan"]["calls"] == 4
+    assert data["counters"]["attachments"] == 2
+    assert data["counters"]["messages"] == 0
+    assert [m["email_id"] for m in data["slowest_messages"]] == ["email_0", "email_2", "email_1"]
+
+    text = metrics.render()
+    assert "# TYPE pec_ingest_attachments_total counter" in text
+    assert 'pec_ingest_stage_calls_total{stage="scan"} 4.0' in text
+    assert 'pec_ingest_message_seconds_bucket{le="0.25"} 1' in text
+    assert 'pec_ingest_message_seconds_bucket{le="+Inf"} 3' in text
+    assert "pec_ingest_message_seconds_count 3" in text
+
+
+def test_request_histogram_labels_are_escaped():
+    metrics.observe_request('/x/"<id>"', "GET", 200, 0.02)
+    text = metrics.render()
+    assert 'route="/x/\\"<id>\\"",method="GET",status="200",le="0.025"} 1' in text
+    assert 'le="0.01"} 0' in text
+
+
+def test_merge_adds_a_worker_report():
+    with metrics.ingest_report() as worker:
+        with metrics.stage("mime_parse"):
+            pass
+        metrics.count("messages", 5)
+        metrics.message(0.2, 7, "email_x")
+    state = worker.state()
+    metrics.reset()
+
+    with metrics.ingest_report() as report:
+        metrics.merge(state)
+    data = report.to_dict()
+    assert data["counters"]["messages"] == 5
+    assert data["stages"]["mime_parse"]["calls"] == 1
+    assert data["slowest_messages"][0]["email_id"] == "email_x"
+    assert "pec_ingest_messages_total 5.0" in metrics.render()
+
+
+def test_ingest_report_of_process_mbox(tmp_data_dir, mbox_path, monkeypatch):
+    monkeypatch.setattr(config, "METRICS_SLOWEST", 3)
+    with metrics.ingest_report() as report:
+        emails, _ = process_mbox(mbox_path)
+    data = report.to_dict()
+    assert data["counters"]["messages"] >= len(emails)
+    assert data["counters"]["bytes_read"] > 0
+    assert data["counters"]["bytes_written"] > 0
+    for name in ("scan", "mime_parse", "find_pec_parts", "parse_daticert", "decode_payload",
+                 "save_email", "grouping", "save_catalog"):
+        assert name in data["stages"]
+    assert len(data["slowest_messages"]) == 3
+
+    # A second run takes everything from the fingerprint cache
+    with metrics.ingest_report() as again:
+        process_mbox(mbox_path)
+    assert again.to_dict()["counters"]["reused"] == data["counters"]["messages"]
+
+
+def test_disabled(monkeypatch):
+    monkeypatch.setattr(config, "METRICS_ENABLED", False)
+    with metrics.ingest_report() as report:
+        with metrics.stage("scan"):
+            pass
+        metrics.count("messages")
+        metrics.observe_request("/", "GET", 200, 0.1)
+    assert report.to_dict()["stages"] == {}
+    assert metrics.render() == "\n"
@@ -97,3 +97,21 @@ def test_source_file_populated(parsed_emails):
         assert email.source_file == "test.mbox", (
             "Email {} missing source_file".format(email.email_id)
         )
+
+
+def test_timestamps_are_utc_epochs(parsed_emails):
+    from datetime import datetime, timezone
+    for e in parsed_emails:
+        # test.mbox dates are all +0000, so the display string is UTC too
+        assert datetime.fromtimestamp(e.timestamp, timezone.utc).strftime("%d/%m/%Y %H:%M") == e.date
+        assert e.summary().timestamp == e.timestamp
+
+
+def test_timestamp_falls_back_to_pec_date(all_messages):
+    import email
+    raw = all_messages[0].as_bytes()
+    raw = b"\n".join(line for line in raw.split(b"\n") if not line.startswith(b"Date:"))
+    parsed = parse_pec_message(email.message_from_bytes(raw), 0)
+    # daticert.xml: 01/01/2024 10:00:00 +0100
+    assert parsed.timestamp == 1704099600
+    assert parsed.pec_date == "01/01/2024 10:00:00"
@@ -0,0 +1,143 @@
+import os
+import shutil
+import threading
+import time
+
+import pytest
+
+import config
+import storage
+from pec_parser.mbox_reader import process_mbox, process_mbox_incremental
+from pec_parser import gate
+from pec_parser.rebuild import rebuild_snapshot, live_snapshot, RebuildConflict
+
+MBOX_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "test.mbox")
+
+
+@pytest.fixture
+def live_data(tmp_data_dir, monkeypatch):
+    monkeypatch.setattr(config, "MBOX_PATH", MBOX_PATH)
+    monkeypatch.setattr(config, "REBUILD_WORKERS", 1)
+    process_mbox(MBOX_PATH)
+    os.makedirs(config.UPLOADS_DIR)
+    upload = os.path.join(config.UPLOADS_DIR, "uploaded.mbox")
+    shutil.copy(MBOX_PATH, upload)
+    process_mbox_incremental(upload)
+    return tmp_data_dir
+
+
+def test_rebuild_swaps_in_new_snapshot(live_data):
+    from storage.json_store import get_catalog_view
+
+    before = get_catalog_view()
+    assert live_snapshot() is None
+
+    snapshot = rebuild_snapshot()
+    assert os.path.islink(config.DATA_DIR)
+    assert live_snapshot() == os.path.realpath(snapshot)
+
+    catalog = storage.load_catalog()
+    assert [s["source_file"] for s in catalog["sources"]] == ["test.mbox", "uploaded.mbox"]
+    # Links to sources stay valid
+    assert [(s["source_id"], s["uploaded_at"]) for s in catalog["sources"]] == \
+        [(s["source_id"], s["uploaded_at"]) for s in before.catalog["sources"]]
+    assert catalog["total_emails"] == before.catalog["total_emails"]
+    assert get_catalog_view() is not before
+    email_id = catalog["sources"][0]["emails_summary"][0]["email_id"]
+    assert storage.load_email(email_id)["email_id"] == email_id
+    assert os.path.exists(os.path.join(config.UPLOADS_DIR, "uploaded.mbox"))
+
+    # The previous data is kept as one older snapshot; older ones are collected
+    rebuild_snapshot()
+    latest = rebuild_snapshot()
+    kept = sorted(os.listdir(config.SNAPSHOTS_DIR))
+    assert len(kept) == 1 + config.SNAPSHOTS_KEEP
+    assert os.path.basename(latest) in kept
+
+
+def test_failed_rebuild_keeps_live_data(live_data, monkeypatch):
+    catalog = storage.load_catalog()
+    # Found, but unreadable: the build itself fails
+    unreadable = os.path.join(live_data, "unreadable", "test.mbox")
+    os.makedirs(unreadable)
+    monkeypatch.setattr(config, "MBOX_PATH", unreadable)
+    with pytest.raises(Exception):
+        rebuild_snapshot()
+    assert live_snapshot() is None
+    assert storage.load_catalog() == catalog
+    assert os.listdir(config.SNAPSHOTS_DIR) == []
+
+
+def test_rebuild_reports_missing_source_files(live_data):
+    from pec_parser.rebuild import MissingSourceFiles
+
+    catalog = storage.load_catalog()
+    os.remove(os.path.join(config.UPLOADS_DIR, "uploaded.mbox"))
+    with pytest.raises(MissingSourceFiles) as excinfo:
+        rebuild_snapshot()
+    assert excinfo.value.source_files == ["uploaded.mbox"]
+    assert live_snapshot() is None
+    assert storage.load_catalog() == catalog
+
+
+def test_rebuild_conflict(live_data, monkeypatch):
+    catalog = storage.load_catalog()
+    stamps = iter([("before",), ("after",)])
+    monkeypatch.setattr(storage, "catalog_stamp", lambda: next(stamps))
+    with pytest.raises(RebuildConflict):
+        rebuild_snapshot()
+    assert live_snapshot() is None
+    assert storage.load_catalog() == catalog
+
+
+def test_rebuild_keeps_followed_sources(live_data, tmp_path, monkeypatch):
+    from pec_parser.follow import follow_once
+
+    # A followed file outside UPLOADS_DIR
+    live = str(tmp_path / "live.mbox")
+    shutil.copy(MBOX_PATH, live)
+    monkeypatch.setattr(config, "FOLLOW_PATHS", [live])
+    assert follow_once(live) > 0
+    before = {s["source_file"]: s for s in storage.load_catalog()["sources"]}
+
+    rebuild_snapshot()
+    after = {s["source_file"]: s for s in storage.load_catalog()["sources"]}
+    assert list(after) == ["test.mbox", "uploaded.mbox", "live.mbox"]
+    assert after["live.mbox"]["email_count"] == before["live.mbox"]["email_count"]
+    # The checkpoint moved with it: nothing is ingested again
+    assert after["live.mbox"]["follow"] == before["live.mbox"]["follow"]
+    assert follow_once(live) == 0
+
+
+def test_rebuild_waits_for_running_writers(live_data):
+    entered, release = threading.Event(), threading.Event()
+
+    def writer():
+        with gate.writing():
+            entered.set()
+            release.wait()
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    entered.wait()
+    result = {}
+    rebuild = threading.Thread(target=lambda: result.update(snapshot=rebuild_snapshot()))
+    rebuild.start()
+    time.sleep(0.3)
+    # Nothing is read or swapped while an ingest may still be writing
+    assert rebuild.is_alive()
+    assert live_snapshot() is None
+    assert not os.path.exists(config.SNAPSHOTS_DIR)
+
+    release.set()
+    thread.join()
+    rebuild.join()
+    assert live_snapshot() == os.path.realpath(result["snapshot"])
+
+
+def test_writers_stay_out_of_a_rebuild():
+    with gate.exclusive():
+        with gate.writing(wait=False) as entered:
+            assert not entered
+    with gate.writing(wait=False) as entered:
+        assert entered
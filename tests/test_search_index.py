@@ -0,0 +1,102 @@
+import json
+import os
+import sqlite3
+
+from pec_parser.models import ParsedEmail
+from storage.search_index import (
+    tokenize,
+    strip_html,
+    update_search_index,
+    remove_from_search_index,
+    rebuild_search_index,
+    search_email_ids,
+)
+import config
+
+
+def _email(email_id, subject="", body_text=None, body_html=None, recipients=None):
+    return ParsedEmail(
+        email_id=email_id,
+        message_id="<{}@example.com>".format(email_id),
+        subject=subject,
+        sender="mario.rossi@example.com",
+        recipients=recipients or ["ufficio@pec.example.it"],
+        date="01/02/2024 10:00",
+        body_text=body_text,
+        body_html=body_html,
+    )
+
+
+def test_tokenize():
+    assert tokenize("Fattura N. 12, caffè!") == ["fattura", "n", "12", "caffè"]
+    assert tokenize(None) == []
+
+
+def test_strip_html():
+    text = strip_html("<style>p {color: red}</style><p>Gentile&nbsp;<b>cliente</b></p>")
+    assert "color" not in text
+    assert "cliente" in text
+    assert "<b>" not in text
+
+
+def test_search_body_and_recipients(tmp_data_dir):
+    update_search_index([
+        _email("email_a", subject="Fattura", body_text="Allego la fattura di marzo"),
+        _email("email_b", subject="Convocazione", body_html="<div>Assemblea <span>condominiale</span></div>",
+               recipients=["amministratore@condominio.it"]),
+    ])
+    assert search_email_ids("marzo") == {"email_a"}
+    assert search_email_ids("condominiale") == {"email_b"}
+    assert search_email_ids("amministratore") == {"email_b"}
+    assert search_email_ids("mario") == {"email_a", "email_b"}
+    # Tags are not indexed
+    assert search_email_ids("span") == set()
+
+
+def test_search_prefix_and_conjunction(tmp_data_dir):
+    update_search_index([
+        _email("email_a", body_text="Allego la fattura di marzo"),
+        _email("email_b", body_text="Allego il preventivo"),
+    ])
+    assert search_email_ids("fatt") == {"email_a"}
+    assert search_email_ids("allego preventivo") == {"email_b"}
+    assert search_email_ids("fattura preventivo") == set()
+    assert search_email_ids("!!") == set()
+
+
+def test_reindex_replaces_postings(tmp_data_dir):
+    update_search_index([_email("email_a", body_text="vecchio testo")])
+    update_search_index([_email("email_a", body_text="nuovo testo")])
+    assert search_email_ids("vecchio") == set()
+    assert search_email_ids("nuovo") == {"email_a"}
+
+
+def test_remove_from_index(tmp_data_dir):
+    update_search_index([
+        _email("email_a", body_text="diffida"),
+        _email("email_b", body_text="diffida"),
+    ])
+    remove_from_search_index(["email_a"])
+    assert search_email_ids("diffida") == {"email_b"}
+    conn = sqlite3.connect(config.SEARCH_INDEX_PATH)
+    try:
+        assert conn.execute("SELECT COUNT(*) FROM postings WHERE email_id = 'email_a'").fetchone() == (0,)
+    finally:
+        conn.close()
+
+
+def test_rebuild_from_email_files(tmp_data_dir):
+    os.makedirs(config.EMAILS_DIR)
+    email = _email("email_c", body_text="sollecito pagamento")
+    with open(os.path.join(config.EMAILS_DIR, "email_c.json"), "w", encoding="utf-8") as f:
+        json.dump(email.to_dict(), f)
+    rebuild_search_index()
+    assert search_email_ids("sollecito") == {"email_c"}
+
+
+def test_merge_keeps_other_emails_postings(tmp_data_dir):
+    update_search_index([_email("email_{}".format(i), body_text="protocollo {}".format(i))
+                         for i in range(50)])
+    update_search_index([_email("email_7", body_text="rettifica")], remove_ids=["email_8"])
+    assert search_email_ids("protocollo") == {"email_{}".format(i) for i in range(50)} - {"email_7", "email_8"}
+    assert search_email_ids("rettifica") == {"email_7"}
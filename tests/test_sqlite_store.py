@@ -0,0 +1,133 @@
+import os
+import shutil
+import sqlite3
+
+import pytest
+
+import config
+import storage
+from pec_parser.mbox_reader import process_mbox, process_mbox_incremental
+
+MBOX_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "test.mbox")
+
+
+@pytest.fixture
+def sqlite_backend(tmp_data_dir, monkeypatch):
+    monkeypatch.setattr(config, "STORAGE_BACKEND", "sqlite")
+    return tmp_data_dir
+
+
+def _without_source_metadata(catalog):
+    for source in catalog["sources"]:
+        source.pop("source_id")
+        source.pop("uploaded_at")
+    return catalog
+
+
+def test_same_catalog_as_json_backend(tmp_data_dir, monkeypatch):
+    emails, _ = process_mbox(MBOX_PATH)
+    json_catalog = _without_source_metadata(storage.load_catalog())
+    json_emails = {e.email_id: storage.load_email(e.email_id) for e in emails}
+
+    shutil.rmtree(config.DATA_DIR)
+    monkeypatch.setattr(config, "STORAGE_BACKEND", "sqlite")
+    process_mbox(MBOX_PATH)
+
+    assert not os.path.exists(config.CATALOG_PATH)
+    assert _without_source_metadata(storage.load_catalog()) == json_catalog
+    assert {eid: storage.load_email(eid) for eid in json_emails} == json_emails
+    assert sorted(e["email_id"] for e in storage.iter_emails()) == sorted(json_emails)
+
+    conn = sqlite3.connect(config.SQLITE_PATH)
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    conn.close()
+
+
+def test_delete_source(sqlite_backend):
+    from storage.json_store import get_catalog_view
+
+    emails, sources = process_mbox(MBOX_PATH)
+    copy_path = os.path.join(config.DATA_DIR, "copy.mbox")
+    shutil.copy(MBOX_PATH, copy_path)
+    _, entry = process_mbox_incremental(copy_path)
+    assert get_catalog_view().catalog["total_sources"] == 2
+
+    # Emails shared with the remaining source are kept
+    assert storage.delete_source(entry["source_id"])
+    assert storage.load_email(emails[0].email_id) is not None
+    assert not storage.delete_source(entry["source_id"])
+
+    assert storage.delete_source(sources[0]["source_id"])
+    assert storage.load_email(emails[0].email_id) is None
+    catalog = storage.load_catalog()
+    assert catalog["sources"] == [] and catalog["groups"] == []
+    assert get_catalog_view().sources == []
+
+
+def test_failed_update_rolls_back(sqlite_backend):
+    process_mbox(MBOX_PATH)
+    before = storage.load_catalog()
+
+    def mutate(catalog):
+        catalog["sources"].clear()
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        storage.update_catalog(mutate)
+    assert storage.load_catalog() == before
+
+
+def test_timestamp_columns_are_indexed(sqlite_backend):
+    emails, _ = process_mbox(MBOX_PATH)
+    conn = sqlite3.connect(config.SQLITE_PATH)
+    try:
+        indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+        assert {"summaries_timestamp", "emails_timestamp"} <= indexes
+        assert "emails_date" not in indexes
+        stored = dict(conn.execute("SELECT email_id, timestamp FROM emails"))
+    finally:
+        conn.close()
+    assert stored == {e.email_id: e.timestamp for e in emails}
+
+
+def test_email_batch_commits_once_per_batch(sqlite_backend, monkeypatch):
+    from pec_parser.models import ParsedEmail
+    from storage import sqlite_store
+
+    monkeypatch.setattr(config, "SQLITE_EMAIL_BATCH", 3)
+    commits = []
+    real_flush = sqlite_store._flush_batch
+    monkeypatch.setattr(sqlite_store, "_flush_batch", lambda: commits.append(1) or real_flush())
+    with storage.email_batch():
+        for n in range(7):
+            storage.save_email(ParsedEmail(email_id="email_{}".format(n), message_id="", subject="",
+                                           sender="", recipients=[], date="", timestamp=n))
+        # Buffered ones are visible to the ingest writing them
+        assert storage.load_email("email_6")["timestamp"] == 6
+    assert len(commits) == 3
+    assert sorted(e["email_id"] for e in storage.iter_emails()) == ["email_{}".format(n) for n in range(7)]
+
+
+def test_old_database_is_migrated(sqlite_backend):
+    emails, _ = process_mbox(MBOX_PATH)
+    conn = sqlite3.connect(config.SQLITE_PATH)
+    # The schema before the timestamp columns
+    for table in ("summaries", "emails"):
+        conn.execute("DROP INDEX {}_timestamp".format(table))
+        conn.execute("ALTER TABLE {} DROP COLUMN timestamp".format(table))
+        conn.execute("ALTER TABLE {} ADD COLUMN date TEXT".format(table))
+        conn.execute("CREATE INDEX {0}_date ON {0} (date)".format(table))
+    conn.commit()
+    conn.close()
+    shutil.copy(config.SQLITE_PATH, config.SQLITE_PATH + ".old")
+    os.replace(config.SQLITE_PATH + ".old", config.SQLITE_PATH)
+
+    assert storage.load_email(emails[0].email_id)["email_id"] == emails[0].email_id
+    conn = sqlite3.connect(config.SQLITE_PATH)
+    try:
+        indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+        stored = dict(conn.execute("SELECT email_id, timestamp FROM emails"))
+    finally:
+        conn.close()
+    assert "emails_date" not in indexes and "emails_timestamp" in indexes
+    assert stored == {e.email_id: e.timestamp for e in emails}